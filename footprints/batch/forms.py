@@ -1,9 +1,6 @@
 import csv
-import io
 
 from django import forms
-from django.utils.encoding import (
-    DjangoUnicodeDecodeError, force_text, smart_text)
 from footprints.batch.models import BatchRow
 
 
@@ -19,6 +16,12 @@ class CreateBatchJobForm(forms.Form):
             "The selected file has an invalid header element. "
             "Column {} is \"{}\", rather than \"{}\".")
 
+    INVALID_LINE = "Line {}: {}"
+    INVALID_COLUMN_COUNT = "found {} columns, rather than {}."
+
+    # malformed rows reported at once
+    MAX_ERRORS = 10
+
     VALID_HEADERS = [
         'Catalog Link', 'BHB number', 'Imprint Title', 'Literary Work Title',
         'Literary Work Author', 'Literary Work Author VIAF ID',
@@ -35,23 +38,35 @@ class CreateBatchJobForm(forms.Form):
 
     csvfile = forms.FileField(required=True)
 
-    def csvfile_reader(self):
+    def csvfile_lines(self):
+        '''Decodes the upload a line at a time. The file is never read
+        into memory as a whole'''
         csv_file = self.cleaned_data['csvfile']
         csv_file.seek(0)
-        as_string = io.StringIO(csv_file.read().decode('utf-8'))
-        return csv.reader(as_string)
+        for line in csv_file:
+            yield line.decode('utf-8')
 
-    def validate_column_count(self, row):
-        return len(row) == len(BatchRow.FIELD_MAPPING)
+    def csvfile_reader(self):
+        return csv.reader(self.csvfile_lines())
+
+    def batch_rows(self, job):
+        '''Yields the job's unsaved rows, skipping the header row and
+        blank lines'''
+        reader = self.csvfile_reader()
+        next(reader, None)
+
+        for row in reader:
+            if not row:
+                continue
 
-    def validate_encoding(self, row):
-        for col in row:
-            try:
-                force_text(col)
-            except DjangoUnicodeDecodeError as e:
-                return False, e
+            batch_row = BatchRow(job=job)
+            for name, col in zip(BatchRow.FIELD_MAPPING, row):
+                setattr(batch_row, name, col.strip())
+            batch_row.normalize()
+            yield batch_row
 
-        return True, ''
+    def validate_column_count(self, row):
+        return len(row) == len(BatchRow.FIELD_MAPPING)
 
     def validate_header(self, row):
         try:
@@ -76,26 +91,37 @@ class CreateBatchJobForm(forms.Form):
         self.validate_clean_data(cleaned_data)
         return cleaned_data
 
-    def validate_clean_data(self, cleaned_data):
-        # do some rudimentary validation on the file
-        try:
-            csvreader = self.csvfile_reader()
-            for idx, row in enumerate(csvreader):
-                if idx == 0 and not self.validate_header(row):
-                    break
-
-                if not self.validate_column_count(row):
-                    self._errors['csvfile'] = self.error_class([
-                        self.INVALID_FILE_FORMAT])
-                    break
-
-                valid, e = self.validate_encoding(row)
-                if not valid:
-                    self._errors['csvfile'] = self.error_class([
-                        self.INVALID_ENCODING.format(
-                            smart_text(e).encode('utf-8'))])
+    def validate_rows(self, csvreader, errors):
+        '''Adds the column count errors of the remaining rows to errors,
+        up to MAX_ERRORS. Errors found before a decoding error are kept'''
+        for row in csvreader:
+            if row and not self.validate_column_count(row):
+                errors.append(self.INVALID_LINE.format(
+                    csvreader.line_num, self.INVALID_COLUMN_COUNT.format(
+                        len(row), len(BatchRow.FIELD_MAPPING))))
+                if len(errors) == self.MAX_ERRORS:
                     break
+        return errors
 
+    def validate_clean_data(self, cleaned_data):
+        # do some rudimentary validation on the file, reporting the first
+        # malformed rows by line number
+        errors = []
+        csvreader = self.csvfile_reader()
+        try:
+            if self.validate_header(next(csvreader, [])):
+                self.validate_rows(csvreader, errors)
+            elif 'csvfile' not in self._errors:
+                # the header row has too many columns
+                errors.append(self.INVALID_FILE_FORMAT)
+
+        except UnicodeDecodeError as e:
+            # raised while reading the line after the last one parsed
+            errors.append(self.INVALID_LINE.format(
+                csvreader.line_num + 1, self.INVALID_ENCODING.format(e)))
         except csv.Error:
-            self._errors['csvfile'] = self.error_class([
-                self.INVALID_FILE_FORMAT])
+            errors.append(self.INVALID_LINE.format(
+                csvreader.line_num, self.INVALID_FILE_FORMAT))
+
+        if errors:
+            self._errors['csvfile'] = self.error_class(errors)
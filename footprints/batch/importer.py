@@ -0,0 +1,573 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Max
+from django.utils.encoding import smart_text
+from haystack.utils import get_identifier
+
+from footprints.batch.models import BatchJob, BatchRow
+from footprints.main.models import Imprint, BookCopy, Footprint, Role, \
+    ExtendedDate, Actor, Person, WrittenWork, CanonicalPlace, Place, \
+    StandardizedIdentification, StandardizedIdentificationType, \
+    natural_text_to_edtf
+from footprints.main.tasks import handle_haystack_signals
+from footprints.main.utils import GeonameUtil
+
+
+def bulk_create(model, objs):
+    '''Model.objects.bulk_create. Sets the new primary keys on databases
+    that don't return them, e.g. sqlite. Rows are inserted in order and
+    the table is locked for the rest of the transaction'''
+    if not objs or connection.features.can_return_rows_from_bulk_insert:
+        return model.objects.bulk_create(objs)
+
+    last = model.objects.aggregate(last=Max('pk'))['last'] or 0
+    model.objects.bulk_create(objs)
+
+    pks = model.objects.filter(pk__gt=last).order_by('pk').values_list(
+        'pk', flat=True)
+    for obj, pk in zip(objs, pks):
+        obj.pk = pk
+    return objs
+
+
+def add_m2m(model, name, pairs):
+    '''The bulk equivalent of obj.<name>.add(related) for a list of
+    (obj id, related id) pairs. Existing pairs are skipped'''
+    field = model._meta.get_field(name)
+    through = field.remote_field.through
+    source = field.m2m_field_name() + '_id'
+    target = field.m2m_reverse_field_name() + '_id'
+
+    through.objects.bulk_create(
+        [through(**{source: a, target: b}) for a, b in sorted(set(pairs))],
+        ignore_conflicts=True)
+
+
+class BatchImporter(object):
+    '''Creates the footprints for the rows of a BatchJob. The existing
+    roles, places, people, imprints and book copies the rows refer to are
+    looked up with one query per model. The missing records are created
+    with bulk_create, which skips the save signals, so the search index is
+    updated by a single batched task once the import commits.
+
+    The rows are resolved in order, as BatchJobUpdateView once did row by
+    row. A later row finds the records created for an earlier one.'''
+
+    def __init__(self, job, user=None):
+        self.job = job
+        self.user = user or job.created_by
+
+        self.viaf_type = StandardizedIdentificationType.objects.viaf()
+        self.bhb_type = StandardizedIdentificationType.objects.bhb()
+
+    def audit(self, obj):
+        # bulk_create skips the audit_log pre_save handlers
+        obj.created_by = self.user
+        obj.last_modified_by = self.user
+        return obj
+
+    def new_date(self, value):
+        dt = ExtendedDate(edtf_format=natural_text_to_edtf(value))
+        dt.check_bounds()  # ExtendedDate.save is skipped
+        return dt
+
+    def load_roles(self, rows):
+        names = {row.footprint_actor_role for row in rows
+                 if row.footprint_actor_role}
+        self.roles = {role.name: role
+                      for role in Role.objects.filter(name__in=names)}
+
+        for name in [Role.AUTHOR, Role.PUBLISHER]:
+            if name not in self.roles:
+                self.roles[name] = Role.objects.get_or_create(name=name)[0]
+
+    def load_places(self, rows):
+        gids = set()
+        for row in rows:
+            gids.update(gid for gid in [
+                row.publication_location, row.footprint_location] if gid)
+
+        canonical = {cp.geoname_id: cp for cp in
+                     CanonicalPlace.objects.filter(geoname_id__in=gids)}
+
+        # one geonames request for each unknown location
+        util = GeonameUtil()
+        new = []
+        for gid in sorted(gids - set(canonical)):
+            name, pt = util.get_geoname_by_id(gid)
+            canonical[gid] = self.audit(CanonicalPlace(
+                geoname_id=gid, canonical_name=name, latlng=pt))
+            new.append(canonical[gid])
+        bulk_create(CanonicalPlace, new)
+
+        places = {}
+        qs = Place.objects.filter(
+            canonical_place__in=canonical.values()).order_by('pk')
+        for place in qs:
+            key = (place.canonical_place_id, place.alternate_name)
+            places.setdefault(key, place)
+
+        # GeonameUtil.get_or_create_place
+        self.places = {}
+        new = []
+        for gid, cp in canonical.items():
+            key = (cp.pk, cp.canonical_name)
+            if key not in places:
+                places[key] = self.audit(Place(
+                    alternate_name=cp.canonical_name, canonical_place=cp))
+                new.append(places[key])
+            self.places[gid] = places[key]
+        bulk_create(Place, new)
+
+    def actor_specs(self, row):
+        '''The (role, name, viaf, born, died) of the actors a row adds to
+        the work, the imprint and the footprint'''
+        specs = {}
+        if row.writtenwork_author:
+            specs['author'] = (
+                self.roles[Role.AUTHOR], row.writtenwork_author,
+                row.writtenwork_author_viaf,
+                row.writtenwork_author_birth_date,
+                row.writtenwork_author_death_date)
+
+        if row.publisher:
+            specs['publisher'] = (
+                self.roles[Role.PUBLISHER], row.publisher,
+                row.publisher_viaf, None, None)
+
+        # a known role must be specified to create the actor
+        role = self.roles.get(row.footprint_actor_role)
+        if role is not None and row.footprint_actor:
+            specs['footprint'] = (
+                role, row.footprint_actor, row.footprint_actor_viaf,
+                row.footprint_actor_birth_date,
+                row.footprint_actor_death_date)
+
+        return specs
+
+    def load_people(self, specs):
+        names = {spec[1] for spec in specs}
+        viafs = {spec[2] for spec in specs if spec[2]}
+
+        # {pk: person}, so each person is loaded once
+        people = {}
+
+        by_viaf = {}
+        qs = Person.objects.filter(
+            standardized_identifier__identifier_type=self.viaf_type,
+            standardized_identifier__identifier__in=viafs).annotate(
+                viaf=F('standardized_identifier__identifier'))
+        for person in qs.order_by('name', 'pk'):
+            by_viaf.setdefault(person.viaf, people.setdefault(
+                person.pk, person))
+
+        by_name = {}
+        qs = Person.objects.filter(name__in=names)
+        for person in qs.order_by('name', 'pk'):
+            by_name.setdefault(person.name, people.setdefault(
+                person.pk, person))
+
+        return by_viaf, by_name
+
+    def resolve_person(self, spec, by_viaf, by_name, changes):
+        '''PersonManager.get_or_create_by_attributes, as found by
+        ActorManager.get_or_create_by_attributes. The changes to
+        new and existing people are collected in changes,
+        {id(person): {'person': person, 'viaf': ..., 'born': ...}}'''
+        role, name, viaf, born, died = spec
+
+        person = by_viaf.get(viaf) if viaf else None
+        if person is not None:
+            return person
+
+        person = by_name.get(name)
+        if person is None:
+            person = self.audit(Person(name=name))
+            by_name[name] = person
+
+        # the people are kept by by_name, so their ids are stable
+        change = changes.setdefault(id(person), {'person': person})
+
+        if (viaf and person.standardized_identifier_id is None and
+                'viaf' not in change):
+            change['viaf'] = viaf
+            by_viaf[viaf] = person
+
+        if born and person.birth_date_id is None and 'born' not in change:
+            change['born'] = born
+
+        if died and person.death_date_id is None and 'died' not in change:
+            change['died'] = died
+
+        return person
+
+    def save_person_records(self, changes):
+        # the new viaf identifiers & dates of the changed people
+        identifiers = []
+        dates = []
+        for change in changes.values():
+            if 'viaf' in change:
+                change['viaf'] = self.audit(StandardizedIdentification(
+                    identifier=change['viaf'], identifier_type=self.viaf_type))
+                identifiers.append(change['viaf'])
+
+            for key in ['born', 'died']:
+                if key in change:
+                    change[key] = self.new_date(change[key])
+                    dates.append(change[key])
+
+        bulk_create(StandardizedIdentification, identifiers)
+        bulk_create(ExtendedDate, dates)
+
+    def apply_person_change(self, change):
+        person = change['person']
+        if 'viaf' in change:
+            person.standardized_identifier = change['viaf']
+        if 'born' in change:
+            person.birth_date = change['born']
+        if 'died' in change:
+            person.death_date = change['died']
+        return person
+
+    def save_people(self, changes):
+        self.save_person_records(changes)
+
+        new = []
+        updated = []
+        for change in changes.values():
+            person = self.apply_person_change(change)
+            if person.pk is None:
+                new.append(person)
+            elif len(change) > 1:
+                updated.append(person)
+
+        bulk_create(Person, new)
+        Person.objects.bulk_update(updated, [
+            'standardized_identifier', 'birth_date', 'death_date'])
+
+        return new + updated
+
+    def load_actors(self, rows):
+        '''Resolves the actors of each row to self.actors,
+        [{'author': actor, ...}, ...] in the order of the rows'''
+        specs = [self.actor_specs(row) for row in rows]
+
+        by_viaf, by_name = self.load_people(
+            [spec for row_specs in specs for spec in row_specs.values()])
+
+        changes = {}
+        resolved = []
+        for row_specs in specs:
+            resolved.append({
+                key: (spec[0], spec[1], self.resolve_person(
+                    spec, by_viaf, by_name, changes))
+                for key, spec in row_specs.items()})
+
+        self.people = self.save_people(changes)
+
+        # Actor.objects.get_or_create(role, person, alias)
+        people = {person.pk for row in resolved
+                  for role, name, person in row.values()}
+        actors = {}
+        for actor in Actor.objects.filter(
+                person__in=people).order_by('pk'):
+            key = (actor.role_id, actor.person_id, actor.alias)
+            actors.setdefault(key, actor)
+
+        new = []
+        self.actors = []
+        for row in resolved:
+            row_actors = {}
+            for key, (role, name, person) in row.items():
+                alias = None if name == person.name else name
+                actor_key = (role.pk, person.pk, alias)
+                if actor_key not in actors:
+                    actors[actor_key] = self.audit(Actor(
+                        role=role, person=person, alias=alias))
+                    new.append(actors[actor_key])
+                row_actors[key] = actors[actor_key]
+            self.actors.append(row_actors)
+        bulk_create(Actor, new)
+
+    def existing_imprints(self, rows):
+        # {bhb number: imprint}
+        bhbs = {row.bhb_number for row in rows if row.bhb_number}
+
+        by_bhb = {}
+        qs = Imprint.objects.filter(
+            standardized_identifier__identifier_type=self.bhb_type,
+            standardized_identifier__identifier__in=bhbs).annotate(
+                bhb=F('standardized_identifier__identifier'))
+        for imprint in qs:
+            by_bhb.setdefault(imprint.bhb, imprint)
+        return by_bhb
+
+    def load_works(self, rows, creators):
+        # {title: work} of the imprints to create
+        titles = {rows[idx].get_writtenwork_title() for idx in creators}
+        works = {work.title: work for work in
+                 WrittenWork.objects.filter(title__in=titles)}
+        new = [self.audit(WrittenWork(title=title))
+               for title in sorted(titles - set(works))]
+        bulk_create(WrittenWork, new)
+        works.update((work.title, work) for work in new)
+        return works
+
+    def new_imprints(self, rows, creators, by_bhb):
+        '''The unsaved imprints of the creator rows, {idx: imprint}, and
+        their unsaved BHB identifiers, [(imprint, identifier), ...]'''
+        works = self.load_works(rows, creators)
+
+        dates = {idx: self.new_date(rows[idx].publication_date)
+                 for idx in creators if rows[idx].publication_date}
+        bulk_create(ExtendedDate, list(dates.values()))
+
+        created = {}
+        identifiers = []
+        for idx in creators:
+            row = rows[idx]
+            created[idx] = self.audit(Imprint(
+                title=row.imprint_title,
+                work=works[row.get_writtenwork_title()],
+                publication_date=dates.get(idx)))
+
+            if row.bhb_number:
+                by_bhb[row.bhb_number] = created[idx]
+                identifiers.append((created[idx], StandardizedIdentification(
+                    identifier=row.bhb_number,
+                    identifier_type=self.bhb_type)))
+        return created, identifiers
+
+    def assign_imprints(self, rows, created, by_bhb):
+        '''Sets self.imprints. Returns the existing imprints whose place
+        changed'''
+        self.imprints = []
+        moved = {}
+        for idx, row in enumerate(rows):
+            imprint = created.get(idx) or by_bhb[row.bhb_number]
+            self.imprints.append(imprint)
+
+            # each row sets the place of its imprint, as add_place did
+            if row.publication_location:
+                imprint.place = self.places[row.publication_location]
+                if imprint.pk is not None:
+                    moved[imprint.pk] = imprint
+        return list(moved.values())
+
+    def add_imprint_actors(self):
+        # the authors and publishers are added to the existing records too
+        add_m2m(WrittenWork, 'actor', [
+            (imprint.work_id, actors['author'].pk) for imprint, actors in
+            zip(self.imprints, self.actors) if 'author' in actors])
+        add_m2m(Imprint, 'actor', [
+            (imprint.pk, actors['publisher'].pk) for imprint, actors in
+            zip(self.imprints, self.actors) if 'publisher' in actors])
+
+    def load_imprints(self, rows):
+        '''Resolves the imprint of each row to self.imprints by its BHB
+        number. ImprintManager.get_or_create_by_attributes'''
+        by_bhb = self.existing_imprints(rows)
+
+        # the first row with an unknown BHB number creates the imprint.
+        # each row without one creates its own
+        creators = []
+        for idx, row in enumerate(rows):
+            if not row.bhb_number or row.bhb_number not in by_bhb:
+                creators.append(idx)
+                by_bhb.setdefault(row.bhb_number, None)
+
+        created, identifiers = self.new_imprints(rows, creators, by_bhb)
+        moved = self.assign_imprints(rows, created, by_bhb)
+
+        bulk_create(Imprint, list(created.values()))
+        Imprint.objects.bulk_update(moved, ['place'])
+
+        bulk_create(StandardizedIdentification,
+                    [self.audit(si) for imprint, si in identifiers])
+        add_m2m(Imprint, 'standardized_identifier', [
+            (imprint.pk, si.pk) for imprint, si in identifiers])
+
+        self.add_imprint_actors()
+
+    def load_copies(self, rows):
+        '''Resolves the book copy of each row to self.copies. A copy is
+        matched by its imprint and call number. Rows without a call number
+        each create a copy'''
+        pks = {imprint.pk for imprint in self.imprints}
+        numbers = {row.book_copy_call_number for row in rows
+                   if row.book_copy_call_number}
+
+        by_number = {}
+        qs = BookCopy.objects.filter(
+            imprint__in=pks, call_number__in=numbers).order_by('pk')
+        for copy in qs:
+            by_number.setdefault((copy.imprint_id, copy.call_number), copy)
+
+        new = []
+        self.copies = []
+        for row, imprint in zip(rows, self.imprints):
+            key = (imprint.pk, row.book_copy_call_number)
+            copy = by_number.get(key) if row.book_copy_call_number else None
+            if copy is None:
+                copy = self.audit(BookCopy(
+                    imprint=imprint,
+                    call_number=row.book_copy_call_number or None))
+                new.append(copy)
+                if row.book_copy_call_number:
+                    by_number[key] = copy
+            self.copies.append(copy)
+
+        bulk_create(BookCopy, new)
+
+    def percent_complete(self, footprint, has_actor):
+        # Footprint.calculate_percent_complete, without the m2m queries.
+        # a new footprint has no languages or digital objects
+        checks = [
+            footprint.has_call_number(),
+            footprint.has_place(),
+            footprint.has_associated_date(),
+            has_actor,
+            footprint.has_notes(),
+        ]
+        return int((4 + sum(1 for c in checks if c)) / 11.0 * 100)
+
+    def create_footprints(self, rows):
+        dates = {idx: self.new_date(row.footprint_date)
+                 for idx, row in enumerate(rows) if row.footprint_date}
+        bulk_create(ExtendedDate, list(dates.values()))
+
+        footprints = []
+        for idx, row in enumerate(rows):
+            place = None
+            if row.footprint_location:
+                place = self.places[row.footprint_location]
+
+            fp = self.audit(Footprint(
+                title=row.imprint_title,
+                book_copy=self.copies[idx], medium=row.medium,
+                medium_description=row.medium_description,
+                provenance=row.provenance, call_number=row.call_number,
+                notes=row.aggregate_notes(),
+                associated_date=dates.get(idx), place=place,
+                narrative=row.footprint_narrative or None))
+            fp.percent_complete = self.percent_complete(
+                fp, 'footprint' in self.actors[idx])
+            footprints.append(fp)
+
+        bulk_create(Footprint, footprints)
+
+        add_m2m(Footprint, 'actor', [
+            (fp.pk, actors['footprint'].pk) for fp, actors in
+            zip(footprints, self.actors) if 'footprint' in actors])
+
+        # for the duplicate checks of later jobs
+        Footprint.objects.refresh_fingerprints([fp.pk for fp in footprints])
+
+        return footprints
+
+    def reindex(self, footprints):
+        signals = []
+        for fp in footprints:
+            identifier = get_identifier(fp)
+            signals.append(('update', identifier))
+
+            # the work, imprint, copy and sibling documents
+            signals.append(('cascade', identifier))
+
+        for obj in self.people + list(self.places.values()):
+            signals.append(('update', get_identifier(obj)))
+
+        # the actor & place bulk writes to the existing works & imprints
+        # send no signals. their documents & dependents are reindexed
+        touched = {}
+        for imprint in self.imprints:
+            touched[get_identifier(imprint)] = None
+            touched['main.writtenwork.{}'.format(imprint.work_id)] = None
+        for identifier in touched:
+            signals.append(('update', identifier))
+            signals.append(('cascade', identifier))
+
+        transaction.on_commit(
+            lambda: handle_haystack_signals.apply_async((signals,)))
+
+    def pending_rows(self):
+        # resumes from the first row not imported yet
+        return self.job.rows().exclude(status=BatchRow.STATUS_IMPORTED)
+
+    @transaction.atomic
+    def run(self, rows=None):
+        '''Imports the rows, by default the rows of the job not imported
+        yet. Returns the new footprints in the order of the rows'''
+        if rows is None:
+            rows = list(self.pending_rows())
+        if not rows:
+            return []
+
+        self.load_roles(rows)
+        self.load_places(rows)
+        self.load_actors(rows)
+        self.load_imprints(rows)
+        self.load_copies(rows)
+        footprints = self.create_footprints(rows)
+
+        for row, fp in zip(rows, footprints):
+            row.footprint = fp
+            row.status = BatchRow.STATUS_IMPORTED
+            row.error = ''
+        BatchRow.objects.bulk_update(rows, ['footprint', 'status', 'error'])
+
+        self.reindex(footprints)
+        return footprints
+
+    def run_chunk(self, rows):
+        '''Imports and commits the rows. When the chunk fails, the rows
+        are imported one at a time so only the failing rows are lost'''
+        try:
+            return self.run(rows)
+        except Exception:
+            if len(rows) < 2:
+                raise
+
+        footprints = []
+        for row in rows:
+            try:
+                footprints.extend(self.run([row]))
+            except Exception as exc:
+                row.footprint = None
+                row.status = BatchRow.STATUS_FAILED
+                row.error = smart_text(exc)
+                row.save(update_fields=['footprint', 'status', 'error'])
+        return footprints
+
+    def run_job(self, chunk_size=None):
+        '''Imports the rows not imported yet in chunks, each committed
+        on its own. The job fails when any of its rows fail. Running it
+        again retries the failed and remaining rows'''
+        chunk_size = chunk_size or settings.BATCH_IMPORT_CHUNK_SIZE
+
+        self.job.status = BatchJob.STATUS_RUNNING
+        self.job.error = ''
+        self.job.save(update_fields=['status', 'error', 'modified_at'])
+
+        try:
+            rows = list(self.pending_rows())
+            for idx in range(0, len(rows), chunk_size):
+                self.run_chunk(rows[idx:idx + chunk_size])
+
+                # still alive, see BatchJob.is_stalled
+                self.job.save(update_fields=['modified_at'])
+        except Exception as exc:
+            self.job.status = BatchJob.STATUS_FAILED
+            self.job.error = smart_text(exc)
+            self.job.save(update_fields=['status', 'error', 'modified_at'])
+            return
+
+        failed = self.job.batchrow_set.filter(
+            status=BatchRow.STATUS_FAILED).count()
+        if failed:
+            self.job.status = BatchJob.STATUS_FAILED
+            self.job.error = '{} rows failed to import'.format(failed)
+        else:
+            self.job.status = BatchJob.STATUS_COMPLETE
+            self.job.processed = True
+        self.job.save()
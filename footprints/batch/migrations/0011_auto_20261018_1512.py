@@ -0,0 +1,42 @@
+# Generated by Django 3.2.18 on 2026-10-18 15:12
+
+from django.db import migrations, models
+
+
+def set_status(apps, schema_editor):
+    BatchJob = apps.get_model('batch', 'BatchJob')
+    BatchRow = apps.get_model('batch', 'BatchRow')
+
+    BatchJob.objects.filter(processed=True).update(status='complete')
+    BatchRow.objects.filter(footprint__isnull=False).update(status='imported')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('batch', '0010_auto_20201013_1514'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchjob',
+            name='error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='batchjob',
+            name='status',
+            field=models.CharField(choices=[('created', 'Created'), ('pending', 'Pending'), ('running', 'Running'), ('complete', 'Complete'), ('failed', 'Failed')], default='created', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='batchrow',
+            name='error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='batchrow',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('imported', 'Imported'), ('failed', 'Failed')], default='pending', max_length=16),
+        ),
+        migrations.RunPython(set_status, migrations.RunPython.noop),
+    ]
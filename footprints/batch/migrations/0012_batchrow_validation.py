@@ -0,0 +1,18 @@
+# Generated by Django 3.2.18 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('batch', '0011_auto_20261018_1512'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchrow',
+            name='validation',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.18 on 2026-10-18 17:20
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('batch', '0012_batchrow_validation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchjob',
+            name='modified_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
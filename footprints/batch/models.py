@@ -1,28 +1,78 @@
+from datetime import timedelta
+
 from audit_log.models.fields import CreatingUserField
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.validators import URLValidator
 from django.db import models
 from django.db.models.query_utils import Q
+from django.utils import timezone
 
 from footprints.batch.validators import validate_date, validate_numeric
 from footprints.main.models import Footprint, Imprint, Role, MEDIUM_CHOICES, \
-    BookCopy
+    BookCopy, footprint_fingerprint
 from footprints.main.utils import format_bhb_number
 
 
 class BatchJob(models.Model):
+    STATUS_CREATED = 'created'
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETE = 'complete'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = (
+        (STATUS_CREATED, 'Created'),
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETE, 'Complete'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
     processed = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     created_by = CreatingUserField()
 
+    # the import runs in a Celery task. see BatchImporter.run_job
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=STATUS_CREATED)
+    error = models.TextField(blank=True, default='')
+
+    # touched as the import progresses. see is_stalled
+    modified_at = models.DateTimeField(auto_now=True)
+
     def rows(self):
         return self.batchrow_set.all().order_by('id')
 
+    def is_stalled(self):
+        # e.g. the worker died mid-import
+        timeout = timedelta(seconds=settings.BATCH_IMPORT_STALLED_AFTER)
+        return self.modified_at < timezone.now() - timeout
+
+    def is_processing(self):
+        return (self.status in [self.STATUS_PENDING, self.STATUS_RUNNING] and
+                not self.is_stalled())
+
+    def progress(self):
+        counts = dict(self.batchrow_set.order_by().values_list(
+            'status').annotate(n=models.Count('id')))
+        return {status: counts.get(status, 0)
+                for status, label in BatchRow.STATUS_CHOICES}
+
     def __str__(self):
         return str(self.id)
 
 
 class BatchRow(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_IMPORTED = 'imported'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_IMPORTED, 'Imported'),
+        (STATUS_FAILED, 'Failed'),
+    )
 
     FIELD_MAPPING = [
         'catalog_url',
@@ -163,14 +213,24 @@ class BatchRow(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    error = models.TextField(blank=True, default='')
+
+    # the stored results of BatchRowValidator
+    validation = models.JSONField(null=True, blank=True)
+
     @classmethod
     def imported_fields(cls):
         return [BatchRow._meta.get_field(name) for name in cls.FIELD_MAPPING]
 
-    def save(self, *args, **kwargs):
-        if (self.writtenwork_title.endswith('.')):
+    def normalize(self):
+        # bulk_create skips save, uploads call this directly
+        if self.writtenwork_title and self.writtenwork_title.endswith('.'):
             self.writtenwork_title = self.writtenwork_title[:-1]
 
+    def save(self, *args, **kwargs):
+        self.normalize()
         super(BatchRow, self).save(*args, **kwargs)
 
     def aggregate_notes(self):
@@ -216,6 +276,13 @@ class BatchRow(models.Model):
 
         return msg
 
+    def fingerprint(self):
+        '''The fingerprint of the footprint this row imports'''
+        return footprint_fingerprint(
+            self.medium, self.provenance, self.call_number,
+            self.aggregate_notes(), self.get_writtenwork_title(),
+            self.bhb_number, self.footprint_location)
+
     def similar_footprints(self):
         kwargs = {
             'medium': self.medium,
@@ -0,0 +1,12 @@
+from celery import shared_task
+from django.contrib.auth.models import User
+
+from footprints.batch.importer import BatchImporter
+from footprints.batch.models import BatchJob
+
+
+@shared_task
+def import_batch_job(job_id, user_id=None, **kwargs):
+    job = BatchJob.objects.get(id=job_id)
+    user = User.objects.filter(id=user_id).first()
+    BatchImporter(job, user).run_job()
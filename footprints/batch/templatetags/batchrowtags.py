@@ -1,5 +1,7 @@
 from django import template
 
+from footprints.batch.validation import field_class
+
 register = template.Library()
 
 
@@ -10,22 +12,12 @@ def field_value(batch_row, field):
 
 @register.simple_tag()
 def validate_field_value(row, field, value):
-    # required field, null or empty?
-    if not value and (not field.null or not field.blank):
-        return 'missing has-error'
-
-    # per field validators
-    valid = True
-    try:
-        method_name = 'validate_{}'.format(field.name)
-        method = getattr(row, method_name)
-        valid = method()
-    except AttributeError:
-        valid = True  # some fields don't need additional validation
-
-    if valid and not value:
-        return 'empty'
-    elif valid:
-        return 'valid'
-    else:
-        return 'invalid has-error'
+    # per field validators. some fields don't need additional validation
+    method = getattr(row, 'validate_{}'.format(field.name), None)
+    return field_class(field, value, method)
+
+
+@register.simple_tag
+def validation_class(row, field):
+    # see BatchRowValidator
+    return row.validation['fields'][field.name]
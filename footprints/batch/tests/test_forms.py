@@ -3,6 +3,7 @@ from django.test.testcases import TestCase
 
 from footprints.batch.forms import CreateBatchJobForm
 from footprints.batch.models import BatchRow
+from footprints.batch.tests.factories import BatchJobFactory
 
 
 class CreateBatchJobFormTest(TestCase):
@@ -26,7 +27,73 @@ class CreateBatchJobFormTest(TestCase):
 
         form.clean()
         self.assertTrue('csvfile' in form._errors.keys())
-        self.assertEqual(form._errors['csvfile'], [form.INVALID_FILE_FORMAT])
+        self.assertEqual(form._errors['csvfile'], [
+            'Line 2: found 4 columns, rather than 26.'])
+
+    def test_form_clean_line_numbers(self):
+        row = ',' * (len(BatchRow.FIELD_MAPPING) - 1)
+        content = '\r\n'.join([
+            ','.join(CreateBatchJobForm.VALID_HEADERS), row, '1,2', '',
+            row, '"multi\r\nline",3'])
+        csvfile = SimpleUploadedFile('file.csv', str.encode(content))
+
+        form = CreateBatchJobForm()
+        form._errors = {}
+        form.cleaned_data = {'csvfile': csvfile}
+
+        form.clean()
+        self.assertEqual(form._errors['csvfile'], [
+            'Line 3: found 2 columns, rather than 26.',
+            'Line 7: found 2 columns, rather than 26.'])
+
+    def test_form_clean_encoding(self):
+        content = ','.join(CreateBatchJobForm.VALID_HEADERS) + '\r\n'
+        content += ',' * (len(BatchRow.FIELD_MAPPING) - 1) + '\r\n'
+        csvfile = SimpleUploadedFile(
+            'file.csv', str.encode(content) + b'\xff,\xfe\r\n')
+
+        form = CreateBatchJobForm()
+        form._errors = {}
+        form.cleaned_data = {'csvfile': csvfile}
+
+        form.clean()
+        self.assertEqual(len(form._errors['csvfile']), 1)
+        self.assertTrue(form._errors['csvfile'][0].startswith(
+            'Line 3: The selected file is not encoded properly.'))
+
+    def test_form_clean_errors_before_encoding(self):
+        content = ','.join(CreateBatchJobForm.VALID_HEADERS) + '\r\n'
+        content += '1,2\r\n'
+        csvfile = SimpleUploadedFile(
+            'file.csv', str.encode(content) + b'\xff,\xfe\r\n')
+
+        form = CreateBatchJobForm()
+        form._errors = {}
+        form.cleaned_data = {'csvfile': csvfile}
+
+        form.clean()
+        self.assertEqual(len(form._errors['csvfile']), 2)
+        self.assertEqual(form._errors['csvfile'][0],
+                         'Line 2: found 2 columns, rather than 26.')
+        self.assertTrue(form._errors['csvfile'][1].startswith('Line 3: '))
+
+    def test_batch_rows(self):
+        row = ['value'] * len(BatchRow.FIELD_MAPPING)
+        row[3] = ' Leshon Limudim. '
+        content = '\r\n'.join([
+            ','.join(CreateBatchJobForm.VALID_HEADERS), ','.join(row), ''])
+        csvfile = SimpleUploadedFile('file.csv', str.encode(content))
+
+        form = CreateBatchJobForm()
+        form.cleaned_data = {'csvfile': csvfile}
+
+        job = BatchJobFactory()
+        rows = list(form.batch_rows(job))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0].job, job)
+        self.assertEqual(rows[0].catalog_url, 'value')
+        self.assertEqual(rows[0].writtenwork_title, 'Leshon Limudim')
+        self.assertIsNone(rows[0].pk)
 
     def test_form_validate_headers(self):
         content = 'bad content'
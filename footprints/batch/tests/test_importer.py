@@ -0,0 +1,276 @@
+from django.db import connection
+from django.test.testcases import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from footprints.batch.importer import BatchImporter, bulk_create
+from footprints.batch.models import BatchJob, BatchRow
+from footprints.batch.tests.factories import BatchJobFactory, BatchRowFactory
+from footprints.main.models import Footprint, Imprint, Person, Role, \
+    StandardizedIdentificationType, WrittenWork
+from footprints.main.tests.factories import RoleFactory, BookCopyFactory, \
+    ImprintFactory, PlaceFactory, CanonicalPlaceFactory, PersonFactory, \
+    StandardizedIdentificationFactory
+from footprints.main.utils import lookup_geoname
+
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class BulkCreateTest(TestCase):
+
+    def test_bulk_create(self):
+        works = [WrittenWork(title='Iliad'), WrittenWork(title='Odyssey')]
+        bulk_create(WrittenWork, works)
+
+        self.assertEqual(WrittenWork.objects.get(title='Iliad').pk,
+                         works[0].pk)
+        self.assertEqual(WrittenWork.objects.get(title='Odyssey').pk,
+                         works[1].pk)
+
+        self.assertEqual(bulk_create(WrittenWork, []), [])
+
+
+class BatchImporterTest(TestCase):
+
+    def setUp(self):
+        self.job = BatchJobFactory()
+        self.record1 = BatchRowFactory(job=self.job)
+        self.record2 = BatchRowFactory(job=self.job,
+                                       footprint_date='1996',
+                                       medium='Approbation in imprint')
+
+        RoleFactory(name=self.record1.footprint_actor_role)
+
+    def test_run(self):
+        fp1, fp2 = BatchImporter(self.job).run()
+
+        self.record1.refresh_from_db()
+        self.assertEqual(self.record1.footprint, fp1)
+        self.record2.refresh_from_db()
+        self.assertEqual(self.record2.footprint, fp2)
+
+        # the rows share a BHB number and a book copy call number
+        self.assertEqual(fp1.book_copy, fp2.book_copy)
+        self.assertEqual(Imprint.objects.count(), 1)
+
+        imprint = fp1.book_copy.imprint
+        self.assertEqual(imprint.title, self.record1.imprint_title)
+        self.assertEqual(imprint.work.title, self.record1.writtenwork_title)
+        self.assertEqual(str(imprint.publication_date), '1542')
+        self.assertEqual(imprint.get_bhb_number().identifier, '106200')
+        self.assertEqual(imprint.created_by, self.job.created_by)
+
+        q = {
+            'person__standardized_identifier__identifier':
+                self.record1.writtenwork_author_viaf,
+            'person__name': self.record1.writtenwork_author,
+            'person__birth_date__edtf_format': '1702',
+            'person__death_date__edtf_format': '1789',
+            'role__name': Role.AUTHOR
+        }
+        self.assertEqual(imprint.work.actor.filter(**q).count(), 1)
+
+        q = {
+            'person__standardized_identifier__identifier':
+                self.record1.publisher_viaf,
+            'person__name': self.record1.publisher,
+            'role__name': Role.PUBLISHER
+        }
+        self.assertEqual(imprint.actor.filter(**q).count(), 1)
+
+        fp1 = Footprint.objects.get(id=fp1.id)
+        self.assertEqual(fp1.medium, self.record1.medium)
+        self.assertEqual(fp1.medium_description,
+                         self.record1.medium_description)
+        self.assertEqual(fp1.provenance, self.record1.provenance)
+        self.assertEqual(fp1.call_number, self.record1.call_number)
+        self.assertEqual(fp1.notes, self.record1.aggregate_notes())
+        self.assertEqual(str(fp1.associated_date), '1989')
+        self.assertEqual(fp1.place, None)
+        self.assertEqual(fp1.narrative, 'Sample Narrative')
+        self.assertEqual(fp1.percent_complete,
+                         fp1.calculate_percent_complete())
+        self.assertEqual(fp1.fingerprint, self.record1.fingerprint())
+
+        # one person and actor for both rows
+        self.assertEqual(Person.objects.filter(
+            name=self.record1.footprint_actor).count(), 1)
+        self.assertEqual(fp1.actor.first(), fp2.actor.first())
+        self.assertEqual(fp1.actor.first().role.name,
+                         self.record1.footprint_actor_role)
+
+    def test_run_existing(self):
+        bhb_type = StandardizedIdentificationType.objects.bhb()
+        imprint = ImprintFactory()
+        imprint.standardized_identifier.add(StandardizedIdentificationFactory(
+            identifier='106200', identifier_type=bhb_type))
+        copy = BookCopyFactory(imprint=imprint)
+
+        viaf_type = StandardizedIdentificationType.objects.viaf()
+        author = PersonFactory(
+            name='Ibn Yahya',
+            standardized_identifier=StandardizedIdentificationFactory(
+                identifier=self.record1.writtenwork_author_viaf,
+                identifier_type=viaf_type))
+        publisher = PersonFactory(
+            name=self.record1.publisher, standardized_identifier=None)
+
+        fp1, fp2 = BatchImporter(self.job).run()
+        self.assertEqual(fp1.book_copy, copy)
+        self.assertEqual(fp2.book_copy, copy)
+
+        # found by viaf, the name becomes an alias
+        actor = imprint.work.actor.get(role__name=Role.AUTHOR)
+        self.assertEqual(actor.person, author)
+        self.assertEqual(actor.alias, self.record1.writtenwork_author)
+
+        # found by name, the viaf is added
+        publisher.refresh_from_db()
+        self.assertEqual(publisher.get_viaf_number(),
+                         self.record1.publisher_viaf)
+        self.assertTrue(imprint.actor.filter(person=publisher).exists())
+
+    def test_run_no_bhb_number(self):
+        self.job.batchrow_set.update(bhb_number='', book_copy_call_number='')
+
+        fp1, fp2 = BatchImporter(self.job).run()
+        self.assertNotEqual(fp1.book_copy.imprint, fp2.book_copy.imprint)
+        self.assertEqual(fp1.book_copy.imprint.work,
+                         fp2.book_copy.imprint.work)
+        self.assertIsNone(fp1.book_copy.call_number)
+
+    def test_load_places(self):
+        cp = CanonicalPlaceFactory(position='51.064650,20.944979')
+        place = PlaceFactory(
+            canonical_place=cp, alternate_name=cp.canonical_name)
+        self.job.batchrow_set.update(
+            publication_location=cp.geoname_id, footprint_location='1')
+
+        content = {
+            'name': 'Osgiliath',
+            'adminName1': 'Gondor', 'countryName': 'Middle Earth',
+            'lat': '-44.2599', 'lng': '170.1043'
+        }
+
+        lookup_geoname.cache_clear()
+        with self.settings(GEONAMES_KEY='abcd'):
+            with mock.patch(
+                    'footprints.main.utils.geonames_session') as mock_session:
+                mock_get = mock_session.return_value.get
+                mock_get.return_value.json.return_value = content
+                fp1, fp2 = BatchImporter(self.job).run()
+
+                # one request for both rows
+                self.assertEqual(mock_get.call_count, 1)
+
+        self.assertEqual(fp1.book_copy.imprint.place, place)
+
+        self.assertEqual(fp1.place, fp2.place)
+        self.assertEqual(-44.2599, fp1.place.latitude())
+        self.assertEqual(170.1043, fp1.place.longitude())
+        self.assertEqual('Osgiliath, Gondor, Middle Earth',
+                         fp1.place.alternate_name)
+        self.assertEqual('Osgiliath, Gondor, Middle Earth',
+                         fp1.place.canonical_place.canonical_name)
+
+    def test_unknown_role(self):
+        Role.objects.filter(name=self.record1.footprint_actor_role).delete()
+
+        fp1, fp2 = BatchImporter(self.job).run()
+        self.assertFalse(fp1.actor.exists())
+
+    def test_run_job(self):
+        BatchImporter(self.job).run_job(chunk_size=1)
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, BatchJob.STATUS_COMPLETE)
+        self.assertTrue(self.job.processed)
+        self.assertEqual(self.job.progress(), {
+            'pending': 0, 'imported': 2, 'failed': 0})
+
+        # the footprints are found by the second chunk
+        self.record2.refresh_from_db()
+        self.assertEqual(self.record2.footprint.book_copy.imprint,
+                         Imprint.objects.get())
+
+    def test_run_job_resume(self):
+        self.job.batchrow_set.filter(id=self.record2.id).update(
+            footprint_location='1')
+
+        with mock.patch('footprints.batch.importer.GeonameUtil.'
+                        'get_geoname_by_id') as mock_get:
+            mock_get.side_effect = ValueError('geonames is down')
+            BatchImporter(self.job).run_job()
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, BatchJob.STATUS_FAILED)
+        self.assertEqual(self.job.error, '1 rows failed to import')
+        self.assertFalse(self.job.processed)
+
+        # the other row in the chunk is imported
+        self.record1.refresh_from_db()
+        self.assertEqual(self.record1.status, BatchRow.STATUS_IMPORTED)
+        fp1 = self.record1.footprint
+
+        self.record2.refresh_from_db()
+        self.assertEqual(self.record2.status, BatchRow.STATUS_FAILED)
+        self.assertEqual(self.record2.error, 'geonames is down')
+        self.assertIsNone(self.record2.footprint)
+
+        # fix the row & resume
+        self.job.batchrow_set.filter(id=self.record2.id).update(
+            footprint_location=None)
+        BatchImporter(self.job).run_job()
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, BatchJob.STATUS_COMPLETE)
+        self.assertEqual(self.job.error, '')
+
+        self.record1.refresh_from_db()
+        self.assertEqual(self.record1.footprint, fp1)
+        self.record2.refresh_from_db()
+        self.assertEqual(self.record2.status, BatchRow.STATUS_IMPORTED)
+        self.assertEqual(Footprint.objects.count(), 2)
+
+    def test_queries(self):
+        # the number of queries does not depend on the number of rows
+        BatchImporter(self.job).run()
+
+        counts = []
+        for n in [2, 4]:
+            job = BatchJobFactory()
+            for i in range(n):
+                BatchRowFactory(
+                    job=job, bhb_number='{}{}'.format(n, i),
+                    writtenwork_author='Author {}{}'.format(n, i),
+                    writtenwork_author_viaf='{}{}'.format(n, i))
+
+            importer = BatchImporter(job)
+            with CaptureQueriesContext(connection) as ctx:
+                importer.run()
+            counts.append(len(ctx.captured_queries))
+
+        self.assertEqual(counts[0], counts[1])
+
+    def test_reindex(self):
+        with mock.patch('footprints.batch.importer.'
+                        'handle_haystack_signals') as mock_task:
+            with self.captureOnCommitCallbacks(execute=True):
+                fp1, fp2 = BatchImporter(self.job).run()
+
+            self.assertEqual(mock_task.apply_async.call_count, 1)
+
+        signals = mock_task.apply_async.call_args[0][0][0]
+        identifier = 'main.footprint.{}'.format(fp1.id)
+        self.assertTrue(('update', identifier) in signals)
+        self.assertTrue(('cascade', identifier) in signals)
+
+        # the imprint & work the authors and publishers were added to
+        imprint = fp1.book_copy.imprint
+        for identifier in ['main.imprint.{}'.format(imprint.id),
+                           'main.writtenwork.{}'.format(imprint.work_id)]:
+            self.assertTrue(('update', identifier) in signals)
+            self.assertTrue(('cascade', identifier) in signals)
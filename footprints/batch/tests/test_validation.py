@@ -0,0 +1,146 @@
+from django.test.testcases import TestCase
+
+from footprints.batch.models import BatchRow
+from footprints.batch.importer import BatchImporter
+from footprints.batch.tests.factories import BatchJobFactory, BatchRowFactory
+from footprints.batch.validation import BatchRowValidator, field_class
+from footprints.main.models import StandardizedIdentificationType, \
+    StandardizedIdentification
+from footprints.main.tests.factories import ImprintFactory, BookCopyFactory, \
+    RoleFactory, StandardizedIdentificationFactory, WrittenWorkFactory
+
+
+class FieldClassTest(TestCase):
+
+    def test_field_class(self):
+        fld = BatchRow._meta.get_field('imprint_title')
+        self.assertEqual(field_class(fld, '', None), 'missing has-error')
+        self.assertEqual(field_class(fld, 'Sample', None), 'valid')
+
+        fld = BatchRow._meta.get_field('footprint_date')
+        self.assertEqual(field_class(fld, None, None), 'empty')
+        self.assertEqual(field_class(fld, 'foobar', lambda: False),
+                         'invalid has-error')
+        self.assertEqual(field_class(fld, '1902', lambda: True), 'valid')
+
+
+class BatchRowValidatorTest(TestCase):
+
+    def setUp(self):
+        self.job = BatchJobFactory()
+
+    def assert_matches_row(self, row):
+        # the job-level checks agree with the BatchRow methods
+        validator = BatchRowValidator([row])
+        validator.load([row])
+
+        self.assertEqual(validator.validate_book_copy_call_number(row),
+                         row.validate_book_copy_call_number())
+        self.assertEqual(validator.validate_footprint_actor_role(row),
+                         row.validate_footprint_actor_role())
+        self.assertEqual(validator.check_imprint_integrity(row),
+                         row.check_imprint_integrity())
+        self.assertEqual(validator.check_book_copy_integrity(row),
+                         row.check_book_copy_integrity())
+
+    def test_validate_book_copy_call_number(self):
+        self.assert_matches_row(BatchRowFactory(book_copy_call_number=None))
+        self.assert_matches_row(BatchRowFactory(book_copy_call_number='abc'))
+
+        # book copy exists and the bhb numbers do not match
+        copy = BookCopyFactory()
+        row = BatchRowFactory()
+        self.assert_matches_row(row)
+
+        # book copy exists, and the bhb numbers match
+        bhb_type = StandardizedIdentificationType.objects.bhb()
+        si = StandardizedIdentification.objects.create(
+            identifier=row.bhb_number, identifier_type=bhb_type)
+        copy.imprint.standardized_identifier.add(si)
+        self.assert_matches_row(row)
+
+        # multiple copies
+        BookCopyFactory()
+        self.assert_matches_row(row)
+
+    def test_validate_footprint_actor_role(self):
+        row = BatchRowFactory()
+        self.assert_matches_row(row)
+
+        RoleFactory(name=row.footprint_actor_role)
+        self.assert_matches_row(row)
+
+        self.assert_matches_row(BatchRowFactory(footprint_actor_role=''))
+
+    def test_check_imprint_integrity(self):
+        row = BatchRowFactory()
+        self.assert_matches_row(row)
+
+        imprint = ImprintFactory()
+        sid = StandardizedIdentificationFactory(identifier=row.bhb_number)
+        imprint.standardized_identifier.add(sid)
+        self.assert_matches_row(row)
+
+        work = WrittenWorkFactory(title=row.writtenwork_title)
+        imprint = ImprintFactory(title=row.imprint_title, work=work)
+        sid = StandardizedIdentificationFactory(identifier=row.bhb_number)
+        imprint.standardized_identifier.add(sid)
+        self.assert_matches_row(row)
+
+    def test_validate(self):
+        RoleFactory(name='Expurgator')
+        row1 = BatchRowFactory(job=self.job)
+        row2 = BatchRowFactory(job=self.job, footprint_date='foobar',
+                               imprint_title='')
+
+        rows = BatchRowValidator(list(self.job.rows())).validate()
+        self.assertEqual(rows[0].validation['fields']['footprint_date'],
+                         'valid')
+        self.assertEqual(rows[1].validation['fields']['footprint_date'],
+                         'invalid has-error')
+        self.assertEqual(rows[1].validation['fields']['imprint_title'],
+                         'missing has-error')
+        self.assertIsNone(rows[0].validation['imprint_integrity'])
+        self.assertEqual(rows[0].validation['similar'], [])
+
+        # the results are stored
+        row1.refresh_from_db()
+        self.assertEqual(row1.validation, rows[0].validation)
+        row2.refresh_from_db()
+        self.assertEqual(row2.validation, rows[1].validation)
+
+        # and not recomputed
+        rows = list(self.job.rows())
+        with self.assertNumQueries(0):
+            BatchRowValidator(rows).validate()
+
+        # unless forced
+        rows[1].footprint_date = '1902'
+        BatchRowValidator(rows[1:]).validate(force=True)
+        self.assertEqual(rows[1].validation['fields']['footprint_date'],
+                         'valid')
+
+    def test_similar_footprints(self):
+        RoleFactory(name='Expurgator')
+        row = BatchRowFactory(job=self.job)
+        fp, = BatchImporter(self.job).run()
+
+        # the same footprint in a later job
+        job = BatchJobFactory()
+        row1 = BatchRowFactory(job=job, medium=row.medium.upper())
+        row2 = BatchRowFactory(job=job, provenance='Elsewhere')
+
+        rows = BatchRowValidator(list(job.rows())).validate()
+        self.assertEqual(rows[0].validation['similar'], [fp.id])
+        self.assertEqual(rows[1].validation['similar'], [])
+
+        # fuzzy mode runs the broader per-row query
+        rows = BatchRowValidator(rows, fuzzy=True).validate(force=True)
+        self.assertEqual(rows[0].validation['similar'],
+                         list(row1.similar_footprints()))
+        self.assertEqual(rows[1].validation['similar'],
+                         list(row2.similar_footprints()))
+
+        # and is not stored
+        row1.refresh_from_db()
+        self.assertEqual(row1.validation['similar'], [fp.id])
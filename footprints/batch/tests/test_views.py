@@ -1,17 +1,21 @@
+from datetime import timedelta
+from json import loads
+
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test.client import RequestFactory
 from django.test.testcases import TestCase
 from django.urls.base import reverse
+from django.utils import timezone
 from django.contrib.messages import get_messages
 
 from footprints.batch.forms import CreateBatchJobForm
 from footprints.batch.models import BatchRow, BatchJob
 from footprints.batch.tests.factories import BatchJobFactory, BatchRowFactory
-from footprints.batch.views import BatchJobListView, BatchJobUpdateView
+from footprints.batch.tasks import import_batch_job
+from footprints.batch.views import BatchJobListView
 from footprints.main.models import Footprint
-from footprints.main.tests.factories import UserFactory, WrittenWorkFactory, \
-    ImprintFactory, FootprintFactory, RoleFactory, BookCopyFactory, \
-    PlaceFactory, GroupFactory, BATCH_PERMISSIONS, CanonicalPlaceFactory
+from footprints.main.tests.factories import UserFactory, RoleFactory, \
+    GroupFactory, BATCH_PERMISSIONS
 
 
 try:
@@ -64,11 +68,31 @@ class BatchJobListViewTest(TestCase):
         self.assertEqual(job.created_by, self.view.request.user)
         self.assertEqual(job.batchrow_set.count(), 1)
 
+    def test_form_valid_chunks(self):
+        header = ','.join(BatchRow.FIELD_MAPPING)
+        rows = ['{},{}'.format(i, ','.join(
+            ['x'] * (len(BatchRow.FIELD_MAPPING) - 1))) for i in range(3)]
+        content = '\n'.join([header] + rows)
+        csvfile = SimpleUploadedFile('test.csv', str.encode(content))
+
+        form = CreateBatchJobForm()
+        form.cleaned_data = {'csvfile': csvfile}
+
+        self.view.chunk_size = 2
+        with self.assertNumQueries(5):
+            # the savepoint & release, the job and two inserts
+            self.view.form_valid(form)
+
+        self.assertEqual(
+            list(self.view.job.rows().values_list('catalog_url', flat=True)),
+            ['0', '1', '2'])
+
 
 class BatchJobDetailView(TestCase):
 
     def test_get(self):
         job = BatchJobFactory()
+        row = BatchRowFactory(job=job)
         url = reverse('batchjob-detail-view', kwargs={'pk': job.id})
 
         response = self.client.get(url)
@@ -81,6 +105,14 @@ class BatchJobDetailView(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTrue('fields' in response.context_data)
 
+        # the rows are validated & the results stored
+        rows = response.context_data['rows']
+        self.assertEqual(rows, [row])
+        self.assertEqual(
+            rows[0].validation['fields']['imprint_title'], 'valid')
+        row.refresh_from_db()
+        self.assertEqual(row.validation, rows[0].validation)
+
 
 class BatchJobDeleteViewTest(TestCase):
     def setUp(self):
@@ -127,142 +159,24 @@ class BatchJobUpdateViewTest(TestCase):
         response = self.client.post(self.url)
         self.assertEqual(response.status_code, 403)
 
-    def test_add_author(self):
-        work = WrittenWorkFactory()
-        row = BatchRowFactory()
-        RoleFactory(name='Author')
-
-        view = BatchJobUpdateView()
-        view.add_author(row, work)
-
-        q = {
-            'person__standardized_identifier__identifier':
-                row.writtenwork_author_viaf,
-            'person__name': row.writtenwork_author,
-            'person__birth_date__edtf_format': '1702',
-            'person__death_date__edtf_format': '1789',
-            'role__name': 'Author'
-        }
-        self.assertTrue(work.actor.filter(**q).exists())
-
-    def test_add_publisher(self):
-        imprint = ImprintFactory()
-        row = BatchRowFactory()
-
-        view = BatchJobUpdateView()
-        view.add_publisher(row, imprint)
-
-        q = {
-            'person__standardized_identifier__identifier':
-                row.publisher_viaf,
-            'person__name': row.publisher,
-            'role__name': 'Publisher'
-        }
-        self.assertTrue(imprint.actor.filter(**q).exists())
-
-    def test_add_actor(self):
-        footprint = FootprintFactory()
-
-        view = BatchJobUpdateView()
-        view.add_actor(self.record1, footprint)
+    def test_post(self):
+        self.client.login(username=self.staff.username, password='test')
 
-        q = {
-            'person__name': self.record1.footprint_actor,
-            'role__name': self.record1.footprint_actor_role
-        }
-        self.assertTrue(footprint.actor.filter(**q).exists())
+        with mock.patch('footprints.batch.views.import_batch_job') as task:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(self.url)
+            self.assertEqual(response.status_code, 302)
 
-    def test_add_place_new(self):
-        content = {
-            'name': 'Osgiliath',
-            'adminName1': 'Gondor', 'countryName': 'Middle Earth',
-            'lat': '-44.2599', 'lng': '170.1043'
-        }
+        task.delay.assert_called_once_with(self.job.id, self.staff.id)
+        messages = [m.message for m in get_messages(response.wsgi_request)]
+        self.assertIn('queued', messages[0])
 
-        with self.settings(GEONAMES_KEY='abcd'):
-            with mock.patch('footprints.main.utils.requests.get') as mock_get:
-                mock_get.return_value.json.return_value = content
-
-                footprint = FootprintFactory()
-                view = BatchJobUpdateView()
-                view.add_place(footprint, '1')
-
-                footprint.refresh_from_db()
-                self.assertEqual(-44.2599, footprint.place.latitude())
-                self.assertEqual(170.1043, footprint.place.longitude())
-                self.assertEqual(
-                    'Osgiliath, Gondor, Middle Earth',
-                    footprint.place.alternate_name)
-                self.assertEqual(
-                    'Osgiliath, Gondor, Middle Earth',
-                    footprint.place.canonical_place.canonical_name)
-
-    def test_add_place_existing(self):
-        position = '51.064650,20.944979'
-        cp = CanonicalPlaceFactory(position=position)
-        place = PlaceFactory(
-            canonical_place=cp, alternate_name=cp.canonical_name)
-        footprint = FootprintFactory()
-
-        view = BatchJobUpdateView()
-        view.add_place(footprint, cp.geoname_id)
-
-        footprint.refresh_from_db()
-        self.assertEqual(place.latitude(), footprint.place.latitude())
-        self.assertEqual(place.longitude(), footprint.place.longitude())
-        self.assertEqual(place.alternate_name, footprint.place.alternate_name)
-        self.assertEqual(place.canonical_place.canonical_name,
-                         footprint.place.canonical_place.canonical_name)
-
-    def test_get_or_create_imprint(self):
-        view = BatchJobUpdateView()
-        imprint = view.get_or_create_imprint(self.record1)
-
-        self.assertIsNone(imprint.place)
-
-        self.assertTrue(imprint.work.actor.filter(
-            person__name=self.record1.writtenwork_author).exists())
-
-        self.assertTrue(imprint.actor.filter(
-            person__name=self.record1.publisher).exists())
-
-    def test_get_or_create_copy(self):
-        view = BatchJobUpdateView()
-
-        # match copy via book call number
-        existing_copy = BookCopyFactory(call_number='123456')
-        copy = view.get_or_create_copy(existing_copy.imprint,
-                                       existing_copy.call_number)
-        self.assertEqual(existing_copy, copy)
-
-        # get a new copy. no footprint found to match
-        imprint = ImprintFactory()
-        copy = view.get_or_create_copy(imprint, 'abcd')
-        self.assertEqual(copy.call_number, 'abcd')
-
-    def test_create_footprint(self):
-        copy = BookCopyFactory()
-
-        view = BatchJobUpdateView()
-        fp = view.create_footprint(self.record1, copy)
-
-        self.assertEqual(fp.book_copy, copy)
-        self.assertEqual(fp.medium, self.record1.medium)
-        self.assertEqual(fp.medium_description,
-                         self.record1.medium_description)
-        self.assertEqual(fp.provenance, self.record1.provenance)
-        self.assertEqual(fp.call_number, self.record1.call_number)
-        self.assertEqual(fp.notes, self.record1.aggregate_notes())
-
-        self.assertEqual(str(fp.associated_date),
-                         self.record1.footprint_date)
-        self.assertEqual(fp.place, None)
-        self.assertEqual(fp.narrative, 'Sample Narrative')
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, BatchJob.STATUS_PENDING)
+        self.assertFalse(self.job.processed)
 
-    def test_post(self):
-        self.client.login(username=self.staff.username, password='test')
-        response = self.client.post(self.url)
-        self.assertEqual(response.status_code, 302)
+        # the worker runs the import
+        import_batch_job(self.job.id, self.staff.id)
 
         fp1 = Footprint.objects.get(medium='Library Catalog/Union Catalog')
         a = self.record1.similar_footprints()
@@ -270,6 +184,7 @@ class BatchJobUpdateViewTest(TestCase):
         self.assertEqual(a.first(), fp1.id)
         self.record1.refresh_from_db()
         self.assertEqual(self.record1.footprint, fp1)
+        self.assertEqual(fp1.created_by, self.staff)
 
         fp2 = Footprint.objects.get(medium='Approbation in imprint')
         a = self.record2.similar_footprints()
@@ -279,11 +194,68 @@ class BatchJobUpdateViewTest(TestCase):
         self.assertEqual(self.record2.footprint, fp2)
 
         self.assertTrue(fp1.book_copy, fp2.book_copy)
-        messages = [m.message for m in get_messages(response.wsgi_request)]
-        self.assertIn('2 footprints created', messages[0])
 
         self.job.refresh_from_db()
         self.assertTrue(self.job.processed)
+        self.assertEqual(self.job.status, BatchJob.STATUS_COMPLETE)
+
+    def test_post_processing(self):
+        self.job.status = BatchJob.STATUS_RUNNING
+        self.job.save()
+
+        self.client.login(username=self.staff.username, password='test')
+        with mock.patch('footprints.batch.views.import_batch_job') as task:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(self.url)
+
+        self.assertFalse(task.delay.called)
+        messages = [m.message for m in get_messages(response.wsgi_request)]
+        self.assertIn('already processing', messages[0])
+
+    def test_post_stalled(self):
+        # the worker died mid-import
+        self.job.status = BatchJob.STATUS_RUNNING
+        self.job.save()
+        BatchJob.objects.filter(id=self.job.id).update(
+            modified_at=timezone.now() - timedelta(hours=1))
+
+        self.client.login(username=self.staff.username, password='test')
+        with mock.patch('footprints.batch.views.import_batch_job') as task:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(self.url)
+
+        task.delay.assert_called_once_with(self.job.id, self.staff.id)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, BatchJob.STATUS_PENDING)
+        self.assertTrue(self.job.is_processing())
+
+
+class BatchJobProgressViewTest(TestCase):
+
+    def test_get(self):
+        job = BatchJobFactory(status=BatchJob.STATUS_RUNNING)
+        BatchRowFactory(job=job, status=BatchRow.STATUS_IMPORTED)
+        BatchRowFactory(job=job, status=BatchRow.STATUS_FAILED)
+        BatchRowFactory(job=job)
+
+        url = reverse('batchjob-progress-view', kwargs={'pk': job.id})
+
+        grp = GroupFactory(permissions=BATCH_PERMISSIONS)
+        staff = UserFactory(group=grp)
+        self.client.login(username=staff.username, password='test')
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 405)
+
+        response = self.client.get(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+
+        the_json = loads(response.content.decode('utf-8'))
+        self.assertEqual(the_json['status'], 'running')
+        self.assertEqual(the_json['total'], 3)
+        self.assertEqual(the_json['imported'], 1)
+        self.assertEqual(the_json['failed'], 1)
+        self.assertEqual(the_json['poll'], url)
 
 
 class BatchRowUpdateViewTest(TestCase):
@@ -315,6 +287,10 @@ class BatchRowUpdateViewTest(TestCase):
         self.assertEqual(self.row.imprint_title, 'Something different')
         self.assertEqual(self.row.bhb_number, 'abcdefg')
 
+        # the stored validation is recomputed
+        self.assertEqual(self.row.validation['fields']['bhb_number'],
+                         'invalid has-error')
+
 
 class BatchRowDeleteViewTest(TestCase):
     def setUp(self):
@@ -2,7 +2,7 @@ from django.conf.urls import url
 
 from footprints.batch.views import BatchJobDetailView, BatchJobListView, \
     BatchJobDeleteView, BatchRowUpdateView, BatchRowDeleteView, \
-    BatchJobUpdateView
+    BatchJobUpdateView, BatchJobProgressView
 
 
 urlpatterns = [
@@ -14,6 +14,8 @@ urlpatterns = [
         BatchJobDeleteView.as_view(), name='batchjob-delete-view'),
     url(r'job/update/(?P<pk>\d+)/$',
         BatchJobUpdateView.as_view(), name='batchjob-update-view'),
+    url(r'job/progress/(?P<pk>\d+)/$',
+        BatchJobProgressView.as_view(), name='batchjob-progress-view'),
     url(r'row/update/(?P<pk>\d+)/$',
         BatchRowUpdateView.as_view(), name='batchrow-update-view'),
     url(r'row/delete/(?P<pk>\d+)/$',
@@ -0,0 +1,176 @@
+from footprints.batch.models import BatchRow
+from footprints.main.models import BookCopy, Footprint, Imprint, Role, \
+    StandardizedIdentification, SLUG_BHB
+from footprints.main.utils import format_bhb_number
+
+
+def field_class(field, value, validate):
+    '''The css class of a row's field value. validate is the field's
+    additional check, e.g. BatchRow.validate_footprint_date, or None'''
+
+    # required field, null or empty?
+    if not value and (not field.null or not field.blank):
+        return 'missing has-error'
+
+    valid = True
+    try:
+        if validate is not None:
+            valid = validate()
+    except AttributeError:
+        valid = True
+
+    if valid and not value:
+        return 'empty'
+    elif valid:
+        return 'valid'
+    else:
+        return 'invalid has-error'
+
+
+class BatchRowValidator(object):
+    '''Validates a job's rows in one pass. The book copies, imprints and
+    roles the BatchRow.validate_* and check_* methods look up one row at a
+    time are looked up once for all the rows.
+
+    Similar footprints are the footprints sharing the row's fingerprint,
+    found for all the rows with one query. The fuzzy mode runs the broader
+    BatchRow.similar_footprints query for each row instead, and its
+    results are only kept in memory.
+
+    The results are stored in BatchRow.validation and reused until the
+    row is edited:
+    {'fields': {name: css class}, 'imprint_integrity': msg,
+     'book_copy_integrity': msg, 'similar': [footprint id, ...]}'''
+
+    def __init__(self, rows, fuzzy=False):
+        self.rows = rows
+        self.fuzzy = fuzzy
+
+    def load(self, rows):
+        # {call number: [imprint id, ...]}, one entry per copy
+        numbers = {row.book_copy_call_number for row in rows
+                   if row.book_copy_call_number}
+        self.copies = {}
+        qs = BookCopy.objects.filter(call_number__in=numbers).order_by('pk')
+        for number, imprint in qs.values_list('call_number', 'imprint'):
+            self.copies.setdefault(number, []).append(imprint)
+
+        # Imprint.get_bhb_number of the copies' imprints
+        imprints = {ids[0] for ids in self.copies.values() if len(ids) == 1}
+        self.copy_bhbs = {}
+        qs = StandardizedIdentification.objects.filter(
+            imprint__in=imprints, identifier_type__slug=SLUG_BHB)
+        for imprint, identifier in qs.order_by('pk').values_list(
+                'imprint', 'identifier'):
+            self.copy_bhbs.setdefault(imprint, identifier)
+
+        # {bhb number: (imprint id, work id, work title)}
+        bhbs = {row.bhb_number for row in rows if row.bhb_number}
+        self.imprints = {}
+        qs = Imprint.objects.filter(
+            standardized_identifier__identifier__in=bhbs).order_by(
+                'work', 'pk')
+        for bhb, imprint, work, title in qs.values_list(
+                'standardized_identifier__identifier', 'id', 'work',
+                'work__title'):
+            self.imprints.setdefault(bhb, (imprint, work, title))
+
+        names = {row.footprint_actor_role for row in rows
+                 if row.footprint_actor_role}
+        self.roles = set(Role.objects.for_footprint().filter(
+            name__in=names).values_list('name', flat=True))
+
+        # {fingerprint: [footprint id, ...]}
+        self.duplicates = {}
+        if not self.fuzzy:
+            qs = Footprint.objects.filter(
+                fingerprint__in={row.fingerprint() for row in rows})
+            for fingerprint, pk in qs.order_by('pk').values_list(
+                    'fingerprint', 'pk'):
+                self.duplicates.setdefault(fingerprint, []).append(pk)
+
+    def validate_book_copy_call_number(self, row):
+        # BatchRow.validate_book_copy_call_number
+        if not row.book_copy_call_number:
+            return True
+
+        imprints = self.copies.get(row.book_copy_call_number, [])
+        if len(imprints) != 1:
+            return True
+
+        # the imprint BHB numbers must match
+        bhb = self.copy_bhbs.get(imprints[0])
+        if bhb is None:
+            return False
+        return format_bhb_number(row.bhb_number) == format_bhb_number(bhb)
+
+    def validate_footprint_actor_role(self, row):
+        # BatchRow.validate_footprint_actor_role
+        if row.footprint_actor and not row.footprint_actor_role:
+            return False
+
+        if not row.footprint_actor_role:
+            return True
+
+        return row.footprint_actor_role in self.roles
+
+    def check_imprint_integrity(self, row):
+        # BatchRow.check_imprint_integrity
+        if row.bhb_number not in self.imprints:
+            return None
+
+        imprint, work, title = self.imprints[row.bhb_number]
+        if (row.writtenwork_title and
+                (title or '').lower() != row.writtenwork_title.lower()):
+            return row.IMPRINT_INTEGRITY.format(
+                work, imprint, 'literary work title')
+
+        return None
+
+    def check_book_copy_integrity(self, row):
+        # BatchRow.check_book_copy_integrity. empty call numbers are
+        # not shared with anything
+        if len(self.copies.get(row.book_copy_call_number, [])) > 1:
+            return row.BOOK_COPY_INTEGRITY.format(row.book_copy_call_number)
+
+        return None
+
+    def similar_footprints(self, row):
+        if self.fuzzy:
+            return list(row.similar_footprints())
+        return self.duplicates.get(row.fingerprint(), [])
+
+    def get_validator(self, row, field):
+        name = 'validate_{}'.format(field.name)
+        if hasattr(self, name):
+            return lambda: getattr(self, name)(row)
+        return getattr(row, name, None)
+
+    def validate_row(self, row):
+        fields = {}
+        for field in BatchRow.imported_fields():
+            fields[field.name] = field_class(
+                field, getattr(row, field.name),
+                self.get_validator(row, field))
+
+        return {
+            'fields': fields,
+            'imprint_integrity': self.check_imprint_integrity(row),
+            'book_copy_integrity': self.check_book_copy_integrity(row),
+            'similar': self.similar_footprints(row),
+        }
+
+    def validate(self, force=False):
+        '''Validates the rows without stored results, or all the rows
+        when forced. Returns the rows. Fuzzy results are not stored'''
+        rows = [row for row in self.rows
+                if force or row.validation is None]
+
+        if rows:
+            self.load(rows)
+            for row in rows:
+                row.validation = self.validate_row(row)
+            if not self.fuzzy:
+                BatchRow.objects.bulk_update(rows, ['validation'])
+
+        return self.rows
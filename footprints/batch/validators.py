@@ -1,14 +1,18 @@
 import re
-from django.utils.encoding import smart_text
-from edtf.edtf import EDTF
+
+from footprints.main.models import natural_text_to_edtf
+
+
+NUMERIC = re.compile(r'^[0-9]*$')
 
 
 def validate_date(value):
+    # natural_text_to_edtf caches the parsed values
     if not value:
         return True
 
     try:
-        s = smart_text(EDTF.from_natural_text(value))
+        s = natural_text_to_edtf(value)
         return s != '' and 'invalid' not in s
     except OverflowError:
         return False
@@ -18,4 +22,4 @@ def validate_numeric(value):
     if not value:
         return True
 
-    return re.match(r'^[0-9]*$', value) is not None
+    return NUMERIC.match(value) is not None
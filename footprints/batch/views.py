@@ -1,3 +1,5 @@
+from itertools import islice
+
 from django.contrib import messages
 from django.db import transaction
 from django.http.response import HttpResponseRedirect
@@ -9,16 +11,16 @@ from django.views.generic.edit import FormView, DeleteView
 
 from footprints.batch.forms import CreateBatchJobForm
 from footprints.batch.models import BatchJob, BatchRow
-from footprints.batch.templatetags.batchrowtags import validate_field_value
-from footprints.main.models import Imprint, BookCopy, Footprint, \
-    Role, ExtendedDate, Actor
-from footprints.mixins import (LoggedInMixin, BatchAccessMixin)
-from footprints.main.utils import GeonameUtil
+from footprints.batch.tasks import import_batch_job
+from footprints.batch.validation import BatchRowValidator
+from footprints.mixins import (LoggedInMixin, BatchAccessMixin,
+                               JSONResponseMixin)
 
 
 class BatchJobListView(LoggedInMixin, BatchAccessMixin, FormView):
     template_name = 'batch/batchjob_list.html'
     form_class = CreateBatchJobForm
+    chunk_size = 500
 
     def get_context_data(self, **kwargs):
         context = super(BatchJobListView, self).get_context_data(**kwargs)
@@ -31,13 +33,13 @@ class BatchJobListView(LoggedInMixin, BatchAccessMixin, FormView):
     @transaction.atomic
     def form_valid(self, form):
         self.job = BatchJob.objects.create(created_by=self.request.user)
-        table = form.csvfile_reader()
-        next(table)  # skip the header row
-        for row in table:
-            batch_row = BatchRow(job=self.job)
-            for idx, col in enumerate(row):
-                setattr(batch_row, BatchRow.FIELD_MAPPING[idx], col.strip())
-            batch_row.save()
+
+        # insert the streamed rows a chunk at a time
+        rows = form.batch_rows(self.job)
+        chunk = list(islice(rows, self.chunk_size))
+        while chunk:
+            BatchRow.objects.bulk_create(chunk)
+            chunk = list(islice(rows, self.chunk_size))
 
         return super(BatchJobListView, self).form_valid(form)
 
@@ -48,125 +50,62 @@ class BatchJobDetailView(LoggedInMixin, BatchAccessMixin, DetailView):
     def get_context_data(self, **kwargs):
         context = super(BatchJobDetailView, self).get_context_data(**kwargs)
         context['fields'] = BatchRow.imported_fields()
+
+        # ?fuzzy=1 rechecks every row with the broader similarity query
+        fuzzy = self.request.GET.get('fuzzy') == '1'
+        context['fuzzy'] = fuzzy
+        context['rows'] = BatchRowValidator(
+            list(self.object.rows().select_related('footprint')),
+            fuzzy=fuzzy).validate(force=fuzzy)
         return context
 
 
 class BatchJobUpdateView(LoggedInMixin, BatchAccessMixin, View):
 
-    INVALID_LOCATION = (
-        'Location [{}] lookup failed at the {} level [id={}]')
-
-    def add_place(self, obj, geoname_id):
-        obj.place = GeonameUtil().get_or_create_place(geoname_id)
-        obj.save()
-
-    def add_author(self, record, work):
-        role, created = Role.objects.get_or_create(name=Role.AUTHOR)
-
-        author, created = Actor.objects.get_or_create_by_attributes(
-            record.writtenwork_author, record.writtenwork_author_viaf, role,
-            record.writtenwork_author_birth_date,
-            record.writtenwork_author_death_date)
-        work.actor.add(author)
-
-    def add_publisher(self, record, imprint):
-        role, created = Role.objects.get_or_create(name=Role.PUBLISHER)
-        publisher, created = Actor.objects.get_or_create_by_attributes(
-            record.publisher, record.publisher_viaf, role, None, None)
-
-        imprint.actor.add(publisher)
-
-    def add_actor(self, record, footprint):
-        try:
-            role = Role.objects.get(name=record.footprint_actor_role)
-            actor, created = Actor.objects.get_or_create_by_attributes(
-                record.footprint_actor, record.footprint_actor_viaf, role,
-                record.footprint_actor_birth_date,
-                record.footprint_actor_death_date)
-            footprint.actor.add(actor)
-        except Role.DoesNotExist:
-            pass  # role must be specified to create the actor
-
-    def get_or_create_imprint(self, record):
-        imprint, created = Imprint.objects.get_or_create_by_attributes(
-            record.bhb_number, record.get_writtenwork_title(),
-            record.imprint_title, record.publication_date)
-
-        if record.publication_location:
-            self.add_place(imprint, record.publication_location)
-
-        self.add_author(record, imprint.work)
-        self.add_publisher(record, imprint)
-
-        return imprint
-
-    def get_or_create_copy(self, imprint, book_call_number):
-
-        if book_call_number:
-            try:
-                # imprints were validated
-                return BookCopy.objects.get(imprint=imprint,
-                                            call_number=book_call_number)
-            except BookCopy.DoesNotExist:
-                pass  # not unexpected
+    def post(self, *args, **kwargs):
+        pk = kwargs.get('pk', None)
 
-        # If there is no matching BookCopy for the imprint/book_call_number
-        # Create a new book copy for this imprint
-        copy = BookCopy.objects.create(imprint=imprint)
+        # one import at a time. a second post waits for the lock
+        with transaction.atomic():
+            job = get_object_or_404(
+                BatchJob.objects.select_for_update(), pk=pk)
 
-        if book_call_number:
-            copy.call_number = book_call_number
-            copy.save()
+            if job.is_processing():
+                msg = 'Batch job {} is already processing'.format(job.id)
+            else:
+                job.status = BatchJob.STATUS_PENDING
+                job.save(update_fields=['status', 'modified_at'])
 
-        return copy
+                user_id = self.request.user.id
+                transaction.on_commit(
+                    lambda: import_batch_job.delay(job.id, user_id))
+                msg = 'Batch job queued for processing'
 
-    def create_footprint(self, record, copy):
-        fp = Footprint.objects.create(
-            title=record.imprint_title,
-            book_copy=copy, medium=record.medium,
-            medium_description=record.medium_description,
-            provenance=record.provenance, call_number=record.call_number,
-            notes=record.aggregate_notes())
+        messages.add_message(self.request, messages.INFO, msg)
 
-        if record.footprint_date:
-            fp.associated_date = ExtendedDate.objects.create_from_string(
-                record.footprint_date)
+        return HttpResponseRedirect(
+            reverse('batchjob-detail-view', kwargs={'pk': pk}))
 
-        if record.footprint_location:
-            self.add_place(fp, record.footprint_location)
 
-        if record.footprint_narrative:
-            fp.narrative = record.footprint_narrative
+def batch_job_context(job):
+    progress = job.progress()
+    return {
+        'id': job.id,
+        'status': job.status,
+        'error': job.error,
+        'total': sum(progress.values()),
+        'imported': progress[BatchRow.STATUS_IMPORTED],
+        'failed': progress[BatchRow.STATUS_FAILED],
+        'poll': reverse('batchjob-progress-view', args=[job.id]),
+    }
 
-        fp.save()
 
-        self.add_actor(record, fp)
+class BatchJobProgressView(LoggedInMixin, BatchAccessMixin,
+                           JSONResponseMixin, View):
 
-        return fp
-
-    @transaction.atomic
-    def post(self, *args, **kwargs):
-        pk = kwargs.get('pk', None)
-        job = get_object_or_404(BatchJob, pk=pk)
-
-        n = 0
-        for record in job.batchrow_set.all():
-            imprint = self.get_or_create_imprint(record)
-            copy = self.get_or_create_copy(
-                imprint, record.book_copy_call_number)
-            footprint = self.create_footprint(record, copy)
-            record.footprint = footprint
-            record.save()
-            n += 1
-
-        job.processed = True
-        job.save()
-
-        msg = 'Batch job processed. {} footprints created'.format(n)
-        messages.add_message(self.request, messages.INFO, msg)
-
-        return HttpResponseRedirect(
-            reverse('batchjob-detail-view', kwargs={'pk': pk}))
+    def get(self, request, *args, **kwargs):
+        job = get_object_or_404(BatchJob, pk=kwargs.get('pk'))
+        return self.render_to_json_response(batch_job_context(job))
 
 
 class BatchJobDeleteView(LoggedInMixin, BatchAccessMixin, DeleteView):
@@ -179,17 +118,16 @@ class BatchRowUpdateView(LoggedInMixin, BatchAccessMixin, View):
         pk = kwargs.get('pk', None)
         row = get_object_or_404(BatchRow, pk=pk)
 
-        errors = {}
-
-        # validate all the fields
         for fld in BatchRow.imported_fields():
             if fld.name in self.request.POST:
                 value = self.request.POST.get(fld.name)
                 setattr(row, fld.name, value)
-                errors[fld.name] = validate_field_value(row, fld, value)
 
         row.save()
 
+        # the stored validation is only recomputed when the row changes
+        BatchRowValidator([row]).validate(force=True)
+
         msg = 'Record {} updated'.format(row.id)
         messages.add_message(self.request, messages.INFO, msg)
 
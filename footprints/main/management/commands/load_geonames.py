@@ -0,0 +1,107 @@
+import csv
+from itertools import islice
+import io
+import zipfile
+
+from django.contrib.gis.geos.point import Point
+from django.core.management.base import BaseCommand
+
+from footprints.main.models import Geoname
+
+
+# geonames dump columns, see https://download.geonames.org/export/dump/
+FIELD_GEONAME_ID = 0
+FIELD_NAME = 1
+FIELD_LATITUDE = 4
+FIELD_LONGITUDE = 5
+FIELD_FEATURE_CLASS = 6
+FIELD_COUNTRY_CODE = 8
+FIELD_ADMIN1_CODE = 10
+
+
+def read_lines(filename):
+    '''Yields the decoded lines of a dump, plain or zipped, skipping the
+    comments'''
+    if zipfile.is_zipfile(filename):
+        archive = zipfile.ZipFile(filename)
+        name = [n for n in archive.namelist()
+                if n.endswith('.txt') and n != 'readme.txt'][0]
+        stream = io.TextIOWrapper(archive.open(name), encoding='utf-8')
+    else:
+        stream = open(filename, encoding='utf-8')
+
+    with stream:
+        for line in stream:
+            if line.strip() and not line.startswith('#'):
+                yield line.rstrip('\n')
+
+
+def read_names(filename, key, value):
+    # {code: name} from countryInfo.txt or admin1CodesASCII.txt
+    if not filename:
+        return {}
+    rows = csv.reader(read_lines(filename), delimiter='\t',
+                      quoting=csv.QUOTE_NONE)
+    return {row[key]: row[value] for row in rows}
+
+
+class Command(BaseCommand):
+    help = ('Load a geonames dump, e.g. allCountries.zip, into the local '
+            'gazetteer. Existing geoname ids are skipped, so an interrupted '
+            'load can be rerun. Running web & worker processes keep the '
+            'geonames they cached from the api until restarted')
+
+    def add_arguments(self, parser):
+        parser.add_argument('filename')
+        parser.add_argument(
+            '--countries', default=None,
+            help='countryInfo.txt, for the country names')
+        parser.add_argument(
+            '--admin1', default=None,
+            help='admin1CodesASCII.txt, for the region names')
+        parser.add_argument(
+            '--feature-class', action='append', dest='feature_classes',
+            default=[], help='Load only this feature class, e.g. P')
+        parser.add_argument(
+            '--replace', action='store_true', default=False,
+            help='Delete the gazetteer before loading')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000)
+
+    def geonames(self, filename, countries, regions, feature_classes):
+        rows = csv.reader(read_lines(filename), delimiter='\t',
+                          quoting=csv.QUOTE_NONE)
+        for row in rows:
+            feature_class = row[FIELD_FEATURE_CLASS]
+            if feature_classes and feature_class not in feature_classes:
+                continue
+
+            country = row[FIELD_COUNTRY_CODE]
+            region = '{}.{}'.format(country, row[FIELD_ADMIN1_CODE])
+            yield Geoname(
+                geoname_id=row[FIELD_GEONAME_ID], name=row[FIELD_NAME],
+                admin_name=regions.get(region, ''),
+                country_name=countries.get(country, ''),
+                feature_class=feature_class,
+                latlng=Point(float(row[FIELD_LONGITUDE]),
+                             float(row[FIELD_LATITUDE])))
+
+    def handle(self, *args, **options):
+        countries = read_names(options['countries'], 0, 4)
+        regions = read_names(options['admin1'], 0, 1)
+
+        if options['replace']:
+            Geoname.objects.all().delete()
+
+        geonames = self.geonames(
+            options['filename'], countries, regions,
+            options['feature_classes'])
+
+        count = 0
+        chunk = list(islice(geonames, options['batch_size']))
+        while chunk:
+            Geoname.objects.bulk_create(chunk, ignore_conflicts=True)
+            count += len(chunk)
+            chunk = list(islice(geonames, options['batch_size']))
+
+        self.stdout.write('{} geonames read'.format(count))
@@ -1,37 +1,63 @@
-from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.db.utils import IntegrityError
-import requests
 
 from footprints.main.models import CanonicalPlace
+from footprints.main.utils import GeonameUtil
+
+
+class LimitReached(Exception):
+    pass
 
 
 class Command(BaseCommand):
 
-    def get_match(self, lat, lng):
-        nearbyUrl = ('https://secure.geonames.org/findNearby?'
-                     'featureClass=P&featureClass=A&'
-                     'username={}&type=json&lat={}&lng={}').format(
-                         settings.GEONAMES_KEY, lat, lng)
-        results = requests.get(nearbyUrl)
-        the_json = results.json()
-        if 'geonames' in the_json:
-            return the_json['geonames'][0]
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit', type=int, default=100,
+            help=('Geonames api requests to make for places missing from '
+                  'the local gazetteer'))
+        parser.add_argument(
+            '--offline', action='store_true', default=False,
+            help='Match against the local gazetteer only')
+
+    def get_match(self, util, lat, lng):
+        '''The nearest place in the local gazetteer or, unless offline,
+        according to the geonames api'''
+        match = util.local_nearby(lat, lng)
+        if match or self.offline:
+            return match
+
+        if self.requests == self.limit:
+            raise LimitReached('Request limit reached. Try again later')
+
+        # query the geonames api and retrieve a matching id
+        self.requests += 1
+        try:
+            return util.remote_nearby(lat, lng)
+        except ValueError as e:
+            # geonames has a limit of 1,000 tries per hour
+            raise LimitReached('{}. Try again later'.format(e))
 
     def handle(self, *app_labels, **options):
-        for cplace in CanonicalPlace.objects.filter(geoname_id=None)[:100]:
-            # query the geonames api and retrieve a matching id
-            match = self.get_match(cplace.latitude(), cplace.longitude())
-            if not match:
-                # geonames has a limit of 1,000 tries per hour
+        util = GeonameUtil()
+        self.offline = options['offline']
+        self.limit = options['limit']
+        self.requests = 0
+
+        qs = CanonicalPlace.objects.filter(geoname_id=None)
+        for cplace in qs.iterator():
+            try:
+                match = self.get_match(
+                    util, cplace.latitude(), cplace.longitude())
+            except LimitReached as e:
                 # exit gracefully
-                print('Hourly limit exceeded. Try again later')
+                print(e)
                 break
 
-            name = match['name']
-            if match['adminName1']:
-                name += ', ' + match['adminName1']
-            name += ', ' + match['countryName']
+            if not match:
+                continue
+
+            name = util.format_name(match)
 
             # write out the match
             print('{}:{} >> {}'.format(
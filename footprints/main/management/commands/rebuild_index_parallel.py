@@ -0,0 +1,164 @@
+import json
+import multiprocessing
+import os
+import tempfile
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connections as db_connections
+from haystack import connections
+
+from footprints.main.models import DataVersion
+
+
+DEFAULT_STATE_FILE = os.path.join(
+    tempfile.gettempdir(), 'footprints_rebuild_index.json')
+
+
+def get_index(using, label):
+    model = apps.get_model(label)
+    return connections[using].get_unified_index().get_index(model)
+
+
+def init_worker():
+    # forked workers must not share the parent's database connection.
+    # closing it here forces each worker to open its own.
+    db_connections.close_all()
+
+
+def update_range(args):
+    '''Prepare and post the documents for one pk range.
+    Runs in a worker process, so it takes a single tuple argument'''
+    using, label, start, end = args
+
+    index = get_index(using, label)
+    qs = index.index_queryset(using=using).filter(
+        pk__gte=start, pk__lte=end).order_by('pk')
+
+    backend = connections[using].get_backend()
+    backend.update(index, qs, commit=True)
+
+    return label, start, end, len(qs)
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the search indexes by splitting each index into '
+            'primary key ranges and updating the ranges in parallel')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model', action='append', dest='models', default=[],
+            help='Rebuild only this model, e.g. main.footprint')
+        parser.add_argument(
+            '--workers', type=int, default=multiprocessing.cpu_count(),
+            help='Number of worker processes. 1 runs in process')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of records in each pk range')
+        parser.add_argument(
+            '--using', default='default',
+            help='The haystack connection to update')
+        parser.add_argument(
+            '--state-file', default=DEFAULT_STATE_FILE,
+            help='Where to record the completed pk ranges')
+        parser.add_argument(
+            '--resume', action='store_true', default=False,
+            help='Skip the pk ranges completed by a previous run')
+        parser.add_argument(
+            '--clear', action='store_true', default=False,
+            help='Remove the existing documents before rebuilding')
+
+    def get_labels(self, using, models):
+        if models:
+            return [label.lower() for label in models]
+
+        unified_index = connections[using].get_unified_index()
+        return sorted(model._meta.label_lower
+                      for model in unified_index.get_indexed_models())
+
+    def pk_ranges(self, index, using, batch_size):
+        qs = index.index_queryset(using=using).prefetch_related(None)
+        pks = list(qs.order_by('pk').values_list('pk', flat=True))
+
+        ranges = []
+        for idx in range(0, len(pks), batch_size):
+            batch = pks[idx:idx + batch_size]
+            ranges.append((batch[0], batch[-1]))
+        return ranges
+
+    def load_state(self, path):
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+        return {label: {tuple(r) for r in ranges}
+                for label, ranges in state.items()}
+
+    def save_state(self, path, state):
+        data = {label: sorted(ranges) for label, ranges in state.items()}
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    def get_tasks(self, using, labels, batch_size, state):
+        tasks = []
+        totals = {}
+        for label in labels:
+            index = get_index(using, label)
+            ranges = self.pk_ranges(index, using, batch_size)
+            totals[label] = len(ranges)
+
+            completed = state.setdefault(label, set())
+            for start, end in ranges:
+                if (start, end) not in completed:
+                    tasks.append((using, label, start, end))
+        return tasks, totals
+
+    def checkpoint(self, results, path, state, totals, counts):
+        for label, start, end, n in results:
+            # the range is committed to solr. record it for --resume
+            state[label].add((start, end))
+            counts[label] += n
+            self.save_state(path, state)
+            self.report(label, state, totals, counts)
+
+    def report(self, label, state, totals, counts):
+        self.stdout.write('{}: {}/{} ranges, {} documents'.format(
+            label, len(state[label]), totals[label], counts[label]))
+
+    def handle(self, *args, **options):
+        using = options['using']
+        path = options['state_file']
+        labels = self.get_labels(using, options['models'])
+
+        state = self.load_state(path) if options['resume'] else {}
+
+        if options['clear'] and not options['resume']:
+            backend = connections[using].get_backend()
+            backend.clear(models=[apps.get_model(label) for label in labels])
+
+        tasks, totals = self.get_tasks(
+            using, labels, options['batch_size'], state)
+        counts = dict.fromkeys(labels, 0)
+
+        workers = options['workers']
+        if workers < 2:
+            results = map(update_range, tasks)
+            self.checkpoint(results, path, state, totals, counts)
+        else:
+            # let each worker open its own database connection
+            db_connections.close_all()
+            with multiprocessing.Pool(workers, initializer=init_worker) as p:
+                results = p.imap_unordered(update_range, tasks)
+                self.checkpoint(results, path, state, totals, counts)
+
+        if os.path.exists(path):
+            os.remove(path)
+
+        # artifacts built from search results are now stale
+        DataVersion.objects.bump(DataVersion.SEARCH_INDEX)
+
+        self.stdout.write('Rebuilt {}'.format(', '.join(labels)))
@@ -0,0 +1,126 @@
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from haystack import connections
+
+from footprints.main.models import IndexWatermark
+from footprints.main.search_indexes import INDEX_DEPENDENCIES
+from footprints.main.tasks import CeleryHaystackBatchSignalHandler
+
+
+# rows saved in transactions that were still open at the last run may
+# carry a modified_at just under the mark. reindexing twice is harmless.
+OVERLAP = timedelta(minutes=5)
+
+# runs are hourly. a lock left by a killed run expires eventually
+LOCK_KEY = 'update_index_incremental'
+LOCK_TIMEOUT = 60 * 60 * 3
+
+
+def has_modified_at(model):
+    try:
+        model._meta.get_field('modified_at')
+        return True
+    except FieldDoesNotExist:
+        return False
+
+
+class Command(BaseCommand):
+    help = ('Reindex the records changed, directly or through their related '
+            'records, since the last run. Deleted records are not detected')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model', action='append', dest='models', default=[],
+            help='Update only this model, e.g. main.footprint')
+        parser.add_argument(
+            '--since', default=None,
+            help='Ignore the stored watermark and start from this datetime')
+
+    def get_labels(self, models):
+        if models:
+            return [label.lower() for label in models]
+
+        unified_index = connections['default'].get_unified_index()
+        return sorted(model._meta.label_lower
+                      for model in unified_index.get_indexed_models())
+
+    def get_lookups(self, label):
+        '''The modified_at lookups from the indexed model, to itself and
+        to each related record its documents embed'''
+        lookups = []
+        if has_modified_at(apps.get_model(label)):
+            lookups.append('modified_at')
+
+        for source, dependents in INDEX_DEPENDENCIES.items():
+            if has_modified_at(apps.get_model(source)):
+                lookups.extend('{}__modified_at'.format(lookup)
+                               for lookup in dependents.get(label, []))
+        return lookups
+
+    def changed_pks(self, label, since):
+        model = apps.get_model(label)
+        if since is None:
+            # first run. the index is built with rebuild_index_parallel,
+            # only the mark is recorded
+            return []
+
+        pks = set()
+        for lookup in self.get_lookups(label):
+            qs = model.objects.filter(**{lookup + '__gte': since})
+            pks.update(qs.order_by().values_list('pk', flat=True))
+        return sorted(pks)
+
+    def get_since(self, label, since):
+        if since:
+            return since
+
+        try:
+            mark = IndexWatermark.objects.get(label=label).watermark
+        except IndexWatermark.DoesNotExist:
+            return None
+
+        return mark - OVERLAP
+
+    def parse_since(self, value):
+        if not value:
+            return None
+
+        since = parse_datetime(value)
+        if since is None:
+            raise CommandError('Invalid --since datetime: {}'.format(value))
+
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        return since
+
+    def handle(self, *args, **options):
+        since = self.parse_since(options['since'])
+
+        if not cache.add(LOCK_KEY, True, LOCK_TIMEOUT):
+            self.stdout.write('Another run is in progress')
+            return
+
+        try:
+            self.update(options['models'], since)
+        finally:
+            cache.delete(LOCK_KEY)
+
+    def update(self, models, since):
+        for label in self.get_labels(models):
+            # taken before the queries so no change falls between runs
+            started = timezone.now()
+
+            pks = self.changed_pks(label, self.get_since(label, since))
+            signals = [('update', '{}.{}'.format(label, pk)) for pk in pks]
+            CeleryHaystackBatchSignalHandler(signals).handle()
+
+            IndexWatermark.objects.update_or_create(
+                label=label, defaults={'watermark': started})
+
+            self.stdout.write('{}: {} documents'.format(label, len(pks)))
@@ -0,0 +1,55 @@
+# Generated by Django 3.2.18 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+from footprints.main.models import parse_edtf
+
+
+BOUNDS_FIELDS = ['start_date', 'end_date', 'is_interval', 'display']
+
+
+def fill_bounds(apps, schema_editor):
+    ExtendedDate = apps.get_model('main', 'ExtendedDate')
+
+    batch = []
+    for dt in ExtendedDate.objects.order_by('pk').iterator():
+        (dt.start_date, dt.end_date,
+         dt.is_interval, dt.display) = parse_edtf(dt.edtf_format)
+        batch.append(dt)
+
+        if len(batch) == 1000:
+            ExtendedDate.objects.bulk_update(batch, BOUNDS_FIELDS)
+            batch = []
+
+    ExtendedDate.objects.bulk_update(batch, BOUNDS_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0051_index_watermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='extendeddate',
+            name='display',
+            field=models.CharField(blank=True, default='', max_length=256),
+        ),
+        migrations.AddField(
+            model_name='extendeddate',
+            name='end_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='extendeddate',
+            name='is_interval',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='extendeddate',
+            name='start_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_bounds, migrations.RunPython.noop),
+    ]
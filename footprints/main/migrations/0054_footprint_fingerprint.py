@@ -0,0 +1,52 @@
+# Generated by Django 3.2.18 on 2026-10-18 16:10
+
+from django.db import migrations, models
+
+from footprints.main.models import SLUG_BHB, footprint_fingerprint
+
+
+def populate_fingerprints(apps, schema_editor):
+    Footprint = apps.get_model('main', 'Footprint')
+    StandardizedIdentification = \
+        apps.get_model('main', 'StandardizedIdentification')
+
+    # {imprint id: bhb number}
+    bhbs = {}
+    qs = StandardizedIdentification.objects.filter(
+        identifier_type__slug=SLUG_BHB, imprint__isnull=False)
+    for imprint, identifier in qs.order_by('pk').values_list(
+            'imprint', 'identifier'):
+        bhbs.setdefault(imprint, identifier)
+
+    qs = Footprint.objects.select_related(
+        'book_copy__imprint__work', 'place__canonical_place').order_by('pk')
+
+    footprints = []
+    for footprint in qs.iterator():
+        imprint = footprint.book_copy.imprint
+        place = footprint.place
+        footprint.fingerprint = footprint_fingerprint(
+            footprint.medium, footprint.provenance, footprint.call_number,
+            footprint.notes, imprint.work.title, bhbs.get(imprint.id),
+            place.canonical_place.geoname_id
+            if place and place.canonical_place else None)
+        footprints.append(footprint)
+
+    Footprint.objects.bulk_update(footprints, ['fingerprint'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0053_exportjob_dataversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='footprint',
+            name='fingerprint',
+            field=models.CharField(blank=True, db_index=True, max_length=40, null=True),
+        ),
+        migrations.RunPython(populate_fingerprints,
+                             migrations.RunPython.noop),
+    ]
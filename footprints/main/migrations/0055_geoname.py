@@ -0,0 +1,29 @@
+# Generated by Django 3.2.18 on 2026-10-18 16:40
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0054_footprint_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Geoname',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('geoname_id', models.TextField(unique=True)),
+                ('name', models.TextField()),
+                ('admin_name', models.TextField(blank=True, default='')),
+                ('country_name', models.TextField(blank=True, default='')),
+                ('feature_class', models.CharField(blank=True, default='', max_length=1)),
+                ('latlng', django.contrib.gis.db.models.fields.PointField(srid=4326)),
+            ],
+            options={
+                'ordering': ['name', 'id'],
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.18 on 2026-10-18 19:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0055_geoname'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportjob',
+            name='modified_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
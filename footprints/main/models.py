@@ -1,8 +1,14 @@
-from datetime import date
+from collections import namedtuple
+from datetime import date, timedelta
+from functools import lru_cache
+import hashlib
+import uuid
 
 from audit_log.models.fields import LastUserField, CreatingUserField
+from django.conf import settings
 from django.contrib.gis.db.models.fields import PointField
 from django.db import models
+from django.db.models import F
 from django.db.models.signals import m2m_changed
 from django.template import loader
 from django.urls.base import reverse
@@ -102,10 +108,24 @@ class ExtendedDateManager(models.Manager):
         return ExtendedDate(edtf_format=dt)
 
     def create_from_string(self, date_str):
-        edtf = smart_text(EDTF.from_natural_text(date_str))
+        edtf = natural_text_to_edtf(date_str)
         return ExtendedDate.objects.create(edtf_format=edtf)
 
 
+def date_range_aggregates(field):
+    '''The earliest start and latest end of the ExtendedDates related
+    through field. Missing and open-ended bounds are skipped'''
+    start = '{}__start_date'.format(field)
+    end = '{}__end_date'.format(field)
+
+    return {
+        'range_start': models.Min(
+            start, filter=models.Q(**{start + '__gt': date.min})),
+        'range_end': models.Max(
+            end, filter=models.Q(**{end + '__lt': date.max})),
+    }
+
+
 def append_uncertain(dt, uncertain):
     if uncertain:
         dt = '{}?'.format(dt)
@@ -127,21 +147,66 @@ class ExtendedDate(models.Model):
         5: 'May', 6: 'June', 7: 'July', 8: 'August', 9: 'September',
         10: 'October', 11: 'November', 12: 'December'}
 
+    # denormalized from edtf_format on save. see set_bounds
+    start_date = models.DateField(null=True, blank=True)
+    end_date = models.DateField(null=True, blank=True)
+    is_interval = models.BooleanField(default=False)
+    display = models.CharField(max_length=256, blank=True, default='')
+
+    BOUNDS_FIELDS = ['start_date', 'end_date', 'is_interval', 'display']
+
     class Meta:
         verbose_name = 'Extended Date Format'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(ExtendedDate, cls).from_db(db, field_names, values)
+
+        # rows saved before the columns existed are parsed on demand
+        if instance.__dict__.get('display'):
+            instance._bounds_format = instance.__dict__.get('edtf_format')
+        return instance
+
+    def save(self, *args, **kwargs):
+        self.check_bounds()
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'edtf_format' in update_fields:
+            kwargs['update_fields'] = \
+                set(update_fields) | set(self.BOUNDS_FIELDS)
+
+        super(ExtendedDate, self).save(*args, **kwargs)
+
     def __str__(self):
+        self.check_bounds()
+        return self.display
+
+    def as_edtf(self):
+        return EDTF(self.edtf_format)
+
+    def parse_bounds(self):
+        # uncached. see parse_edtf
         e = self.as_edtf()
+        return EDTFBounds(self._start(e), self._end(e), e.is_interval,
+                          self._display(e) or '')
 
+    def set_bounds(self):
+        (self.start_date, self.end_date,
+         self.is_interval, self.display) = parse_edtf(self.edtf_format)
+        self._bounds_format = self.edtf_format
+
+    def check_bounds(self):
+        # the columns are stale until set_bounds sees the current format
+        if getattr(self, '_bounds_format', None) != self.edtf_format:
+            self.set_bounds()
+
+    def _display(self, e):
         if e.is_interval:
             return "%s - %s" % (self.fmt(e.date_obj.start, True),
                                 self.fmt(e.date_obj.end, True))
         else:
             return self.fmt(e.date_obj, False)
 
-    def as_edtf(self):
-        return EDTF(self.edtf_format)
-
     def ordinal(self, n):
         # cribbed from http://codegolf.stackexchange.com/
         # questions/4707/outputting-ordinal-numbers-1st-2nd-3rd#answer-4712
@@ -216,9 +281,7 @@ class ExtendedDate(models.Model):
         # just compare the year 9999 to the returned year
         return None if not dt or dt.year == date.max.year else dt
 
-    def start(self):
-        edtf = self.as_edtf()
-
+    def _start(self, edtf):
         if edtf.is_interval:
             dt = edtf.start_date_earliest()
         else:
@@ -226,16 +289,47 @@ class ExtendedDate(models.Model):
 
         return self._validate_python_date(dt)
 
-    def end(self):
-        edtf = self.as_edtf()
-
+    def _end(self, edtf):
         if not edtf.is_interval:
             return edtf.date_latest()
 
         return self._validate_python_date(edtf.end_date_latest())
 
+    def start(self):
+        self.check_bounds()
+        return self.start_date
+
+    def end(self):
+        self.check_bounds()
+        return self.end_date
+
     def match_string(self, date_str):
-        return self.edtf_format == smart_text(EDTF.from_natural_text(date_str))
+        return self.edtf_format == natural_text_to_edtf(date_str)
+
+
+EDTF_CACHE_SIZE = 4096
+
+EDTFBounds = namedtuple(
+    'EDTFBounds', ['start_date', 'end_date', 'is_interval', 'display'])
+
+
+@lru_cache(maxsize=EDTF_CACHE_SIZE)
+def parse_edtf(edtf_format):
+    '''Returns the EDTFBounds of an edtf string. The same values, e.g.
+    "1750" or "18xx", are shared by many dates'''
+    return ExtendedDate(edtf_format=edtf_format).parse_bounds()
+
+
+@lru_cache(maxsize=EDTF_CACHE_SIZE)
+def natural_text_to_edtf(date_str):
+    return smart_text(EDTF.from_natural_text(date_str))
+
+
+def edtf_cache_info():
+    return {
+        'parse_edtf': parse_edtf.cache_info(),
+        'natural_text_to_edtf': natural_text_to_edtf.cache_info(),
+    }
 
 
 def fmt_uncertain(date_obj, result):
@@ -336,7 +430,7 @@ class DigitalObject(models.Model):
     source_url = models.URLField(null=True, blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
-    modified_at = models.DateTimeField(auto_now=True)
+    modified_at = models.DateTimeField(auto_now=True, db_index=True)
 
     created_by = CreatingUserField(related_name="digitalobject_created_by")
     last_modified_by = LastUserField(
@@ -430,7 +524,7 @@ class StandardizedIdentification(models.Model):
     permalink = models.URLField(null=True, blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
-    modified_at = models.DateTimeField(auto_now=True)
+    modified_at = models.DateTimeField(auto_now=True, db_index=True)
 
     created_by = CreatingUserField(
         related_name='standardizedidentification_created_by')
@@ -474,11 +568,11 @@ class PersonManager(models.Manager):
         # update birth date & death date
         if born and person.birth_date is None:
             person.birth_date = ExtendedDate.objects.create(
-                edtf_format=smart_text(EDTF.from_natural_text(born)))
+                edtf_format=natural_text_to_edtf(born))
 
         if died and person.death_date is None:
             person.death_date = ExtendedDate.objects.create(
-                edtf_format=smart_text(EDTF.from_natural_text(died)))
+                edtf_format=natural_text_to_edtf(died))
 
         person.save()
         return person
@@ -521,7 +615,7 @@ class Person(models.Model):
     notes = models.TextField(null=True, blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
-    modified_at = models.DateTimeField(auto_now=True)
+    modified_at = models.DateTimeField(auto_now=True, db_index=True)
 
     created_by = CreatingUserField(related_name='person_created_by')
     last_modified_by = LastUserField(related_name='person_last_modified_by')
@@ -595,7 +689,7 @@ class Actor(models.Model):
     notes = models.TextField(null=True, blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
-    modified_at = models.DateTimeField(auto_now=True)
+    modified_at = models.DateTimeField(auto_now=True, db_index=True)
 
     created_by = CreatingUserField(related_name='actor_created_by')
     last_modified_by = LastUserField(
@@ -625,7 +719,7 @@ class CanonicalPlace(models.Model):
     geoname_id = models.TextField(null=True, blank=True, unique=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
-    modified_at = models.DateTimeField(auto_now=True)
+    modified_at = models.DateTimeField(auto_now=True, db_index=True)
 
     created_by = CreatingUserField(related_name='can_place_created_by')
     last_modified_by = LastUserField(related_name='can_place_last_modified_by')
@@ -651,6 +745,35 @@ class CanonicalPlace(models.Model):
         return self.latlng_string() == latlng
 
 
+class Geoname(models.Model):
+    '''A place in the local copy of the geonames gazetteer, loaded from a
+    dump with the load_geonames command'''
+    geoname_id = models.TextField(unique=True)
+    name = models.TextField()
+    admin_name = models.TextField(blank=True, default='')
+    country_name = models.TextField(blank=True, default='')
+    feature_class = models.CharField(max_length=1, blank=True, default='')
+    latlng = PointField()
+
+    class Meta:
+        ordering = ['name', 'id']
+
+    def __str__(self):
+        return self.name
+
+    def as_json(self):
+        # the shape of the geonames api records
+        return {
+            'geonameId': self.geoname_id,
+            'name': self.name,
+            'adminName1': self.admin_name,
+            'countryName': self.country_name,
+            'fcl': self.feature_class,
+            'lat': str(self.latlng.coords[1]),
+            'lng': str(self.latlng.coords[0])
+        }
+
+
 class Place(models.Model):
     objects = PlaceManager()
 
@@ -660,7 +783,7 @@ class Place(models.Model):
         CanonicalPlace, null=True, on_delete=models.CASCADE)
 
     created_at = models.DateTimeField(auto_now_add=True)
-    modified_at = models.DateTimeField(auto_now=True)
+    modified_at = models.DateTimeField(auto_now=True, db_index=True)
 
     created_by = CreatingUserField(related_name='place_created_by')
     last_modified_by = LastUserField(related_name='place_last_modified_by')
@@ -717,7 +840,7 @@ class WrittenWork(models.Model):
         StandardizedIdentification, blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
-    modified_at = models.DateTimeField(auto_now=True)
+    modified_at = models.DateTimeField(auto_now=True, db_index=True)
 
     created_by = CreatingUserField(related_name='writtenwork_created_by')
     last_modified_by = LastUserField(
@@ -831,20 +954,12 @@ class ImprintManager(models.Manager):
         return imprint, created
 
     def get_start_date(self, imprints):
-        the_date = date.max
-        for imprint in imprints.select_related('publication_date'):
-            start_date = imprint.start_date()
-            if start_date and start_date != date.min and start_date < the_date:
-                the_date = start_date
-        return None if the_date == date.max else the_date
+        return imprints.aggregate(
+            **date_range_aggregates('publication_date'))['range_start']
 
     def get_end_date(self, imprints):
-        the_date = date.min
-        for imprint in imprints.select_related('publication_date'):
-            end_date = imprint.end_date()
-            if end_date and end_date != date.max and end_date > the_date:
-                the_date = end_date
-        return None if the_date == date.min else the_date
+        return imprints.aggregate(
+            **date_range_aggregates('publication_date'))['range_end']
 
 
 class Imprint(models.Model):
@@ -872,7 +987,7 @@ class Imprint(models.Model):
     notes = models.TextField(null=True, blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
-    modified_at = models.DateTimeField(auto_now=True)
+    modified_at = models.DateTimeField(auto_now=True, db_index=True)
 
     created_by = CreatingUserField(related_name='imprint_created_by')
     last_modified_by = LastUserField(related_name='imprint_last_modified_by')
@@ -1045,7 +1160,7 @@ class BookCopy(models.Model):
     notes = models.TextField(null=True, blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
-    modified_at = models.DateTimeField(auto_now=True)
+    modified_at = models.DateTimeField(auto_now=True, db_index=True)
 
     created_by = CreatingUserField(related_name='bookcopy_created_by')
     last_modified_by = LastUserField(related_name='bookcopy_last_modified_by')
@@ -1113,31 +1228,48 @@ class BookCopy(models.Model):
         return lst
 
     def footprints_start_date(self):
-        qs = self.footprint_set.select_related('associated_date')
-        return Footprint.objects.get_start_date(qs)
+        return Footprint.objects.get_start_date(self.footprint_set.all())
 
     def footprints_end_date(self):
-        qs = self.footprint_set.select_related('associated_date')
-        return Footprint.objects.get_end_date(qs)
+        return Footprint.objects.get_end_date(self.footprint_set.all())
+
+
+def footprint_fingerprint(medium, provenance, call_number, notes,
+                          work_title, bhb_number, geoname_id):
+    '''A hash of the values batch imports compare to find duplicate
+    footprints. Case, repeated whitespace and the BHB number's zero
+    padding are ignored'''
+    values = [medium, provenance, call_number, notes, work_title,
+              (bhb_number or '').lstrip('0'), geoname_id]
+    normalized = [' '.join(str(value).lower().split())
+                  if value is not None else '' for value in values]
+    return hashlib.sha1(
+        '\x1f'.join(normalized).encode('utf-8')).hexdigest()
 
 
 class FootprintManager(models.Manager):
 
     def get_start_date(self, footprints):
-        the_date = date.max
-        for fp in footprints.select_related('associated_date'):
-            start_date = fp.start_date()
-            if start_date and start_date != date.min and start_date < the_date:
-                the_date = start_date
-        return None if the_date == date.max else the_date
+        return footprints.aggregate(
+            **date_range_aggregates('associated_date'))['range_start']
 
     def get_end_date(self, footprints):
-        the_date = date.min
-        for fp in footprints.select_related('associated_date'):
-            end_date = fp.end_date()
-            if end_date and end_date != date.max and end_date > the_date:
-                the_date = end_date
-        return None if the_date == date.min else the_date
+        return footprints.aggregate(
+            **date_range_aggregates('associated_date'))['range_end']
+
+    def refresh_fingerprints(self, ids):
+        '''Recomputes the fingerprints of the footprints. Kept current by
+        the search index signal handler'''
+        footprints = list(self.filter(id__in=ids).select_related(
+            'book_copy__imprint__work', 'place__canonical_place'
+        ).prefetch_related(
+            'book_copy__imprint__standardized_identifier__identifier_type'))
+
+        for footprint in footprints:
+            footprint.fingerprint = footprint.calculate_fingerprint()
+
+        self.bulk_update(footprints, ['fingerprint'], batch_size=500)
+        return footprints
 
 
 class Footprint(models.Model):
@@ -1183,11 +1315,15 @@ class Footprint(models.Model):
 
     percent_complete = models.IntegerField(default=0)
 
+    # see footprint_fingerprint
+    fingerprint = models.CharField(
+        max_length=40, null=True, blank=True, db_index=True)
+
     verified = models.BooleanField(default=False)
     verified_modified_at = models.DateTimeField(null=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
-    modified_at = models.DateTimeField(auto_now=True)
+    modified_at = models.DateTimeField(auto_now=True, db_index=True)
 
     created_by = CreatingUserField(related_name='footprint_created_by')
     last_modified_by = LastUserField(related_name='footprint_last_modified_by')
@@ -1254,6 +1390,18 @@ class Footprint(models.Model):
             # factoryboy construction may throw ValueErrors
             return 0
 
+    def calculate_fingerprint(self):
+        imprint = self.book_copy.imprint
+        bhb = imprint.get_bhb_number()
+
+        geoname_id = None
+        if self.place and self.place.canonical_place:
+            geoname_id = self.place.canonical_place.geoname_id
+
+        return footprint_fingerprint(
+            self.medium, self.provenance, self.call_number, self.notes,
+            imprint.work.title, bhb.identifier if bhb else None, geoname_id)
+
     def display_title(self):
         # return written work title OR the footprint title ?
         if (self.book_copy.imprint.work.title is not None and
@@ -1321,15 +1469,90 @@ class Footprint(models.Model):
         return self == lst[-1]
 
 
-def work_actor_changed(sender, **kwargs):
-    # Save Footprint to trigger index update
-    work = kwargs['instance']
-    for fp in Footprint.objects.filter(book_copy__imprint__work=work):
-        fp.save()
+class IndexWatermark(models.Model):
+    '''The modified_at high-water mark reached by the incremental
+    search index updates of one model'''
+    label = models.CharField(max_length=256, unique=True)
+    watermark = models.DateTimeField()
+
+    def __str__(self):
+        return '{}: {}'.format(self.label, self.watermark)
+
+
+class DataVersionManager(models.Manager):
+
+    def current(self, name):
+        version, created = self.get_or_create(name=name)
+        return version.version
+
+    def bump(self, name):
+        if not self.filter(name=name).update(version=F('version') + 1):
+            self.get_or_create(name=name, defaults={'version': 1})
+
+
+class DataVersion(models.Model):
+    '''A counter that moves whenever the named data changes. Artifacts
+    built from the data are stale once it moves'''
+    SEARCH_INDEX = 'search_index'
+
+    objects = DataVersionManager()
+
+    name = models.CharField(max_length=256, unique=True)
+    version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return '{}: {}'.format(self.name, self.version)
+
+
+class ExportJob(models.Model):
+    '''A footprint search export written to storage by a Celery task'''
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETE = 'complete'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETE, 'Complete'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    uuid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+
+    # the normalized search parameters & their hash
+    params = models.TextField()
+    key = models.CharField(max_length=64, db_index=True)
+    compress = models.BooleanField(default=False)
+
+    # the search index version the export was built from
+    data_version = models.PositiveIntegerField()
+
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    rows = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(null=True, blank=True)
+    artifact = models.FileField(
+        upload_to='exports/%Y/%m/%d/', null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    modified_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def is_stalled(self):
+        # e.g. the worker died mid-export
+        timeout = timedelta(seconds=settings.EXPORT_JOB_STALLED_AFTER)
+        return (self.status in [self.STATUS_PENDING, self.STATUS_RUNNING] and
+                self.modified_at < timezone.now() - timeout)
+
+    def __str__(self):
+        return '{} ({})'.format(self.uuid, self.status)
 
 
 def footprint_actor_changed(sender, **kwargs):
-    # Save Footprint to trigger index update
+    # percent_complete depends on the actors. the index updates
+    # are queued by the FootprintsSignalProcessor
     kwargs['instance'].save()
 
 
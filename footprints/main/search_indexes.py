@@ -1,10 +1,13 @@
+from itertools import chain
 import re
 
 from django.utils.encoding import smart_text
 
+from django.apps import apps
+from django.db.models import Prefetch
 from django.db.models.query_utils import Q
 from footprints.main.models import WrittenWork, Footprint, Person, Place, \
-    Imprint, Actor, BookCopy
+    Imprint, Actor, BookCopy, DigitalObject, Role
 from haystack.constants import Indexable
 from haystack.fields import CharField, NgramField, DateTimeField, \
     IntegerField, MultiValueField, BooleanField
@@ -325,6 +328,9 @@ class FootprintIndex(SearchIndex, Indexable):
 
     is_terminal = BooleanField()
 
+    censored = BooleanField()
+    expurgated = BooleanField()
+
     # custom sort fields
     added = DateTimeField(model_attr='created_at')
     complete = IntegerField(model_attr='percent_complete')
@@ -334,17 +340,41 @@ class FootprintIndex(SearchIndex, Indexable):
     owners = CharField()
     wtitle = CharField()
 
+    # stored for rendering search results without loading the footprint
+    date_display = CharField(indexed=False, null=True)
+    place_display = CharField(indexed=False, null=True)
+    owner_names = MultiValueField(indexed=False)
+    work_title = CharField(indexed=False, null=True)
+    imprint_title = CharField(indexed=False, null=True)
+    printer_names = MultiValueField(indexed=False)
+    pub_date_display = CharField(indexed=False, null=True)
+    imprint_place_display = CharField(indexed=False, null=True)
+
     def get_model(self):
         return Footprint
 
     def index_queryset(self, using=None):
+        # rebuild_index slices this queryset into batches. The prefetches
+        # load actors, digital objects and sibling footprints for a whole
+        # batch in a fixed number of queries. The prepare_* methods read
+        # from these caches rather than querying per footprint.
+        actors = Actor.objects.select_related('person', 'role')
+
         qs = self.get_model().objects.all()
         qs = qs.select_related(
             'created_by', 'associated_date', 'place__canonical_place',
-            'book_copy__imprint__work', 'book_copy__imprint__place',
+            'book_copy__imprint__work',
+            'book_copy__imprint__publication_date',
             'book_copy__imprint__place__canonical_place').prefetch_related(
                 'book_copy__imprint__standardized_identifier__identifier_type',
-                'actor__person', 'book_copy__imprint__work__actor')
+                Prefetch('actor', queryset=actors),
+                Prefetch('book_copy__imprint__actor', queryset=actors),
+                Prefetch('book_copy__imprint__work__actor', queryset=actors),
+                Prefetch('book_copy__footprint_set',
+                         queryset=Footprint.objects.select_related(
+                             'associated_date')),
+                Prefetch('digital_object',
+                         queryset=DigitalObject.objects.only('id')))
         return qs
 
     def prepare_object_type(self, obj):
@@ -389,7 +419,8 @@ class FootprintIndex(SearchIndex, Indexable):
                               remove_articles=True)
 
     def prepare_owners(self, obj):
-        a = [o.display_name() for o in obj.owners()]
+        a = [o.display_name() for o in obj.actor.all()
+             if o.role.name == Role.OWNER]
         return format_sort_by(', '.join(a), remove_articles=True)
 
     def prepare_footprint_location(self, obj):
@@ -417,21 +448,21 @@ class FootprintIndex(SearchIndex, Indexable):
 
         return []
 
-    def prepare_actor(self, obj):
-        qs = Actor.objects.filter(
-            Q(writtenwork=obj.book_copy.imprint.work) |
-            Q(imprint=obj.book_copy.imprint) |
-            Q(footprint=obj)).distinct()
+    def _actors(self, obj):
+        # work, imprint & footprint actors without duplicates. iterating
+        # .all() takes advantage of the relations prefetched above
+        imprint = obj.book_copy.imprint
+        actors = {}
+        for actor in chain(imprint.work.actor.all(), imprint.actor.all(),
+                           obj.actor.all()):
+            actors[actor.id] = actor
+        return actors.values()
 
-        return [actor.id for actor in qs]
+    def prepare_actor(self, obj):
+        return [actor.id for actor in self._actors(obj)]
 
     def prepare_actor_title(self, obj):
-        qs = Actor.objects.filter(
-            Q(writtenwork=obj.book_copy.imprint.work) |
-            Q(imprint=obj.book_copy.imprint) |
-            Q(footprint=obj)).distinct()
-
-        return [smart_text(actor) for actor in qs]
+        return [smart_text(actor) for actor in self._actors(obj)]
 
     def prepare_has_image(self, obj):
         return obj.has_at_least_one_digital_object()
@@ -440,7 +471,50 @@ class FootprintIndex(SearchIndex, Indexable):
         return obj.book_copy.identifier()
 
     def prepare_is_terminal(self, obj):
-        return obj.is_terminal()
+        # same as Footprint.is_terminal, sorting the prefetched siblings
+        lst = list(obj.book_copy.footprint_set.all())
+        lst.sort(key=lambda fp: fp.sort_date())
+        return obj == lst[-1]
+
+    def prepare_date_display(self, obj):
+        if obj.associated_date:
+            return smart_text(obj.associated_date)
+
+    def prepare_place_display(self, obj):
+        if obj.place:
+            return smart_text(obj.place)
+
+    def prepare_owner_names(self, obj):
+        return [o.display_name() for o in obj.actor.all()
+                if o.role.name == Role.OWNER]
+
+    def prepare_work_title(self, obj):
+        return obj.book_copy.imprint.work.title
+
+    def prepare_imprint_title(self, obj):
+        return obj.book_copy.imprint.title
+
+    def prepare_printer_names(self, obj):
+        return [p.display_name() for p in obj.book_copy.imprint.actor.all()
+                if p.role.name == Role.PRINTER]
+
+    def prepare_censored(self, obj):
+        # Imprint.has_censor, from the prefetched actors
+        return any(a.role.name == Role.CENSOR
+                   for a in obj.book_copy.imprint.actor.all())
+
+    def prepare_expurgated(self, obj):
+        return any(a.role.name == Role.EXPURGATOR for a in obj.actor.all())
+
+    def prepare_pub_date_display(self, obj):
+        imprint = obj.book_copy.imprint
+        if imprint.publication_date:
+            return smart_text(imprint.publication_date)
+
+    def prepare_imprint_place_display(self, obj):
+        imprint = obj.book_copy.imprint
+        if imprint.place:
+            return smart_text(imprint.place)
 
 
 # PersonIndex is used by the NameListView to create an autocomplete field
@@ -476,3 +550,102 @@ class PlaceIndex(SearchIndex, Indexable):
 
     def prepare_sort_by(self, obj):
         return format_sort_by(smart_text(obj), remove_articles=True)
+
+
+# Which indexed documents embed data from a changed record.
+# {changed model: {dependent model: [lookups from dependent to changed]}}
+ACTOR_DEPENDENCIES = {
+    'main.writtenwork': [
+        'actor', 'imprint__actor', 'imprint__bookcopy__footprint__actor'],
+    'main.imprint': ['actor', 'bookcopy__footprint__actor'],
+    'main.bookcopy': [
+        'imprint__work__actor', 'imprint__actor', 'footprint__actor'],
+    'main.footprint': [
+        'book_copy__imprint__work__actor', 'book_copy__imprint__actor',
+        'actor'],
+}
+
+PLACE_DEPENDENCIES = {
+    'main.writtenwork': [
+        'imprint__place', 'imprint__bookcopy__footprint__place'],
+    'main.imprint': ['place', 'bookcopy__footprint__place'],
+    'main.bookcopy': ['imprint__place', 'footprint__place'],
+    'main.footprint': ['place', 'book_copy__imprint__place'],
+}
+
+
+def _follow(dependencies, field):
+    return {label: ['{}__{}'.format(lookup, field) for lookup in lookups]
+            for label, lookups in dependencies.items()}
+
+
+INDEX_DEPENDENCIES = {
+    'main.writtenwork': {
+        'main.imprint': ['work'],
+        'main.bookcopy': ['imprint__work'],
+        'main.footprint': ['book_copy__imprint__work'],
+    },
+    'main.imprint': {
+        'main.writtenwork': ['imprint'],
+        'main.bookcopy': ['imprint'],
+        'main.footprint': ['book_copy__imprint'],
+    },
+    'main.bookcopy': {
+        'main.writtenwork': ['imprint__bookcopy'],
+        'main.imprint': ['bookcopy'],
+        'main.footprint': ['book_copy'],
+    },
+    'main.footprint': {
+        'main.writtenwork': ['imprint__bookcopy__footprint'],
+        'main.imprint': ['bookcopy__footprint'],
+        'main.bookcopy': ['footprint'],
+        # is_terminal depends on the sibling footprints
+        'main.footprint': ['book_copy__footprint'],
+    },
+    'main.actor': ACTOR_DEPENDENCIES,
+    'main.person': _follow(ACTOR_DEPENDENCIES, 'person'),
+    'main.role': _follow(ACTOR_DEPENDENCIES, 'role'),
+    'main.place': PLACE_DEPENDENCIES,
+    'main.canonicalplace': dict(
+        _follow(PLACE_DEPENDENCIES, 'canonical_place'),
+        **{'main.place': ['canonical_place']}),
+    'main.extendeddate': {
+        'main.writtenwork': [
+            'imprint__publication_date',
+            'imprint__bookcopy__footprint__associated_date'],
+        'main.imprint': [
+            'publication_date', 'bookcopy__footprint__associated_date'],
+        'main.bookcopy': [
+            'imprint__publication_date', 'footprint__associated_date'],
+        'main.footprint': [
+            'associated_date', 'book_copy__imprint__publication_date',
+            'book_copy__footprint__associated_date'],
+    },
+    'main.digitalobject': {
+        'main.footprint': ['digital_object'],
+    },
+    'main.standardizedidentification': {
+        'main.footprint': ['book_copy__imprint__standardized_identifier'],
+    },
+}
+
+
+def index_dependents(instance):
+    '''Returns the identifiers of the indexed records, other than the
+    instance itself, whose documents embed data from the instance'''
+    label = instance._meta.label_lower
+    identifiers = []
+
+    for dependent, lookups in INDEX_DEPENDENCIES.get(label, {}).items():
+        q = Q()
+        for lookup in lookups:
+            q |= Q(**{lookup: instance.pk})
+
+        qs = apps.get_model(dependent).objects.filter(q)
+        if dependent == label:
+            qs = qs.exclude(pk=instance.pk)
+
+        pks = qs.order_by().values_list('pk', flat=True).distinct()
+        identifiers.extend('{}.{}'.format(dependent, pk) for pk in pks)
+
+    return identifiers
@@ -274,27 +274,27 @@ class PathmapperEventSerializer(Serializer):
 
 
 class PathmapperTableRowSerializer(Serializer):
-    work_id = serializers.CharField(read_only=True)
-    work_title = serializers.CharField(
-        source='object.book_copy.imprint.work.title', read_only=True)
-    imprint_id = serializers.CharField(read_only=True)
-    imprint_title = serializers.CharField(
-        source='object.book_copy.imprint.display_title', read_only=True)
+    '''Serializes footprint search results, or raw Solr documents, from
+    the stored index fields without loading the footprints'''
+    work_id = serializers.CharField(read_only=True, default=None)
+    work_title = serializers.CharField(read_only=True, default=None)
+    imprint_id = serializers.CharField(read_only=True, default=None)
+    imprint_title = serializers.SerializerMethodField()
     pub_date = serializers.CharField(
-        source='object.book_copy.imprint.publication_date')
+        source='pub_date_display', read_only=True, default=None)
     pub_location = serializers.CharField(
-        source='imprint_location_title')
-    book_copy_identifier = serializers.CharField(read_only=True)
+        source='imprint_location_title', read_only=True, default=None)
+    book_copy_identifier = serializers.CharField(
+        read_only=True, default=None)
     footprint_id = serializers.CharField(source='object_id', read_only=True)
-    footprint_title = serializers.CharField(source='title', read_only=True)
+    footprint_title = serializers.CharField(
+        source='title', read_only=True, default=None)
     footprint_date = serializers.CharField(
-        source='object.associated_date', read_only=True)
+        source='date_display', read_only=True, default=None)
     footprint_location = serializers.CharField(
-        source='footprint_location_title')
-    censored = serializers.CharField(
-        source='object.book_copy.imprint.has_censor')
-    expurgated = serializers.CharField(
-        source='object.has_expurgator')
+        source='footprint_location_title', read_only=True, default=None)
+    censored = serializers.CharField(read_only=True, default=False)
+    expurgated = serializers.CharField(read_only=True, default=False)
 
     class Meta:
         fields = (
@@ -304,6 +304,16 @@ class PathmapperTableRowSerializer(Serializer):
             'footprint_id', 'footprint_title', 'footprint_date',
             'footprint_location', 'expurgated', 'censored')
 
+    def get_stored(self, obj, name):
+        if isinstance(obj, dict):
+            return obj.get(name)
+        return getattr(obj, name, None)
+
+    def get_imprint_title(self, obj):
+        # Imprint.display_title
+        return (self.get_stored(obj, 'imprint_title') or
+                self.get_stored(obj, 'work_title'))
+
 
 class DigitalObjectExtendedSerializer(HyperlinkedModelSerializer):
     footprints = PathmapperFootprintSerializer(
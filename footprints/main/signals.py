@@ -1,26 +1,110 @@
-# from django.conf import settings
+import atexit
+import threading
+
+from django.conf import settings
 from django.db.models import signals
 from django.db import connection, transaction
-from footprints.main.tasks import handle_haystack_signal
+from footprints.main.search_indexes import INDEX_DEPENDENCIES, \
+    index_dependents
+from footprints.main.tasks import handle_haystack_signals
 from haystack.exceptions import NotHandled
 from haystack.indexes import SearchIndex
 from haystack.signals import BaseSignalProcessor
 from haystack.utils import get_identifier
 
 
+class IndexSignalQueue(object):
+    """
+    Coalesces committed index signals. Repeated signals for an identifier
+    are collapsed into one, the most recent action winning. A cascade is
+    kept alongside the identifier's own update or delete. The pending
+    signals are sent as a single batched task once the window (in seconds)
+    elapses. A window of 0 sends each signal as it arrives.
+    """
+
+    def __init__(self, window=0):
+        self.window = window
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def add(self, action, identifier):
+        with self.lock:
+            # re-insert to keep the pending signals in arrival order
+            key = (action == 'cascade', identifier)
+            self.pending.pop(key, None)
+            self.pending[key] = action
+
+            if self.window and self.timer is None:
+                self.timer = threading.Timer(self.window, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+        if not self.window:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+            pairs = [(action, identifier)
+                     for (_, identifier), action in self.pending.items()]
+            self.pending = {}
+
+        if pairs:
+            handle_haystack_signals.apply_async((pairs,))
+
+
 class FootprintsSignalProcessor(BaseSignalProcessor):
 
     def setup(self):
+        self.queue = IndexSignalQueue(
+            getattr(settings, 'INDEX_COALESCE_WINDOW', 0))
+
+        # don't lose signals still waiting on the timer at exit
+        atexit.register(self.queue.flush)
+
         signals.post_save.connect(self.enqueue_save)
+        signals.pre_delete.connect(self.enqueue_dependents)
         signals.post_delete.connect(self.enqueue_delete)
+        signals.m2m_changed.connect(self.enqueue_m2m)
 
     def teardown(self):
         signals.post_save.disconnect(self.enqueue_save)
+        signals.pre_delete.disconnect(self.enqueue_dependents)
         signals.post_delete.disconnect(self.enqueue_delete)
+        signals.m2m_changed.disconnect(self.enqueue_m2m)
+
+        self.queue.flush()
 
     def enqueue_save(self, sender, instance, **kwargs):
+        if instance._meta.label_lower in INDEX_DEPENDENCIES:
+            # the dependent documents are looked up by the worker
+            self.enqueue_task('cascade', get_identifier(instance))
+
         return self.enqueue('update', instance, sender, **kwargs)
 
+    def enqueue_dependents(self, sender, instance, **kwargs):
+        # the relations are gone once the instance is deleted,
+        # so the dependent documents are looked up now
+        if instance._meta.label_lower in INDEX_DEPENDENCIES:
+            for identifier in index_dependents(instance):
+                self.enqueue_task('update', identifier)
+
+    def enqueue_m2m(self, sender, instance, action, reverse, model, pk_set,
+                    **kwargs):
+        if action not in ['post_add', 'post_remove', 'post_clear']:
+            return
+
+        self.enqueue_save(type(instance), instance)
+
+        if reverse and pk_set:
+            # e.g. actor.writtenwork_set.add(work)
+            for obj in model.objects.filter(pk__in=pk_set):
+                self.enqueue_save(model, obj)
+
     def enqueue_delete(self, sender, instance, **kwargs):
         return self.enqueue('delete', instance, sender, **kwargs)
 
@@ -46,8 +130,8 @@ class FootprintsSignalProcessor(BaseSignalProcessor):
                     self.enqueue_task(action, get_identifier(instance))
 
     def enqueue_task(self, action, identifier):
-        func = lambda: handle_haystack_signal.apply_async(  # noqa: E731
-            (action, identifier))
+        # only committed changes are queued. rolled back signals are dropped
+        func = lambda: self.queue.add(action, identifier)  # noqa: E731
 
         if hasattr(transaction, 'on_commit'):
             # Django 1.9 on_commit hook
@@ -1,7 +1,12 @@
 from celery import shared_task
 from django.apps import apps
 from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from footprints.main.models import DataVersion, ExportJob, Footprint
+from footprints.main.search_indexes import index_dependents
+from footprints.pathmapper.models import BookCopyRoute
 from haystack import connection_router, connections
+from haystack.constants import ID
 from haystack.exceptions import NotHandled as IndexNotFoundException
 
 
@@ -151,6 +156,153 @@ class CeleryHaystackSignalHandler(object):
                 raise UnrecognizedActionException(action)
 
 
+class CeleryHaystackBatchSignalHandler(object):
+    '''Handles a list of coalesced (action, identifier) signals. The
+    instances of each model are loaded through the index_queryset and sent
+    to the backend in chunks, with a single commit at the end'''
+
+    chunk_size = 500
+
+    def __init__(self, signals):
+        self.signals = signals
+
+    def group_signals(self):
+        # {(action, object_path): [identifier, ...]}
+        groups = {}
+        for action, identifier in self.signals:
+            object_path = \
+                CeleryHaystackSignalHandler.split_identifier(identifier)[0]
+            groups.setdefault((action, object_path), []).append(identifier)
+        return groups
+
+    def expand_cascades(self, groups):
+        '''Replaces each 'cascade' group with 'update' groups for the
+        documents that embed data from the changed records'''
+        expanded = {}
+        dependents = {}
+        for (action, object_path), identifiers in groups.items():
+            if action != 'cascade':
+                expanded[(action, object_path)] = identifiers
+                continue
+
+            handler = CeleryHaystackSignalHandler(identifiers[0])
+            pks = [handler.split_identifier(i)[1] for i in identifiers]
+            model_class = handler.get_model_class()
+            for instance in model_class._default_manager.filter(pk__in=pks):
+                for identifier in index_dependents(instance):
+                    dependents[identifier] = None
+
+        for identifier in dependents:
+            object_path = \
+                CeleryHaystackSignalHandler.split_identifier(identifier)[0]
+            lst = expanded.setdefault(('update', object_path), [])
+            if identifier not in lst:
+                lst.append(identifier)
+
+        return expanded
+
+    def chunks(self, lst):
+        for idx in range(0, len(lst), self.chunk_size):
+            yield lst[idx:idx + self.chunk_size]
+
+    def handle_delete(self, current_index, using, identifiers):
+        backend = connections[using].get_backend()
+
+        try:
+            for chunk in self.chunks(identifiers):
+                if hasattr(backend, 'conn'):
+                    # solr. one delete-by-query per chunk
+                    query = '{}:({})'.format(ID, ' OR '.join(
+                        '"{}"'.format(identifier) for identifier in chunk))
+                    backend.conn.delete(q=query, commit=False)
+                else:
+                    for identifier in chunk:
+                        backend.remove(identifier, commit=False)
+        except Exception as exc:
+            raise IndexOperationException(index=current_index, reason=exc)
+
+    def handle_update(self, current_index, using, pks):
+        backend = connections[using].get_backend()
+        qs = current_index.index_queryset(using=using)
+
+        try:
+            for chunk in self.chunks(pks):
+                # instances deleted since the signal was queued are skipped
+                instances = list(qs.filter(pk__in=chunk))
+                if instances:
+                    backend.update(current_index, instances, commit=False)
+        except Exception as exc:
+            raise IndexOperationException(index=current_index, reason=exc)
+
+    def commit(self, using):
+        backend = connections[using].get_backend()
+        if hasattr(backend, 'conn'):
+            backend.conn.commit()
+
+    def refresh_routes(self, groups):
+        # the routes embed the same records as the book copy documents
+        identifiers = groups.get(('update', 'main.bookcopy'), [])
+        pks = [CeleryHaystackSignalHandler.split_identifier(i)[1]
+               for i in identifiers]
+        if pks:
+            BookCopyRoute.objects.refresh(pks)
+
+    def refresh_fingerprints(self, groups):
+        # the fingerprints embed the work title, bhb number & place
+        identifiers = groups.get(('update', 'main.footprint'), [])
+        pks = [CeleryHaystackSignalHandler.split_identifier(i)[1]
+               for i in identifiers]
+        if pks:
+            Footprint.objects.refresh_fingerprints(pks)
+
+    def handle(self):
+        touched = set()
+
+        groups = self.expand_cascades(self.group_signals())
+        self.refresh_routes(groups)
+        self.refresh_fingerprints(groups)
+        for (action, object_path), identifiers in groups.items():
+            handler = CeleryHaystackSignalHandler(identifiers[0])
+            model_class = handler.get_model_class()
+            pks = [handler.split_identifier(i)[1] for i in identifiers]
+
+            for current_index, using in handler.get_indexes(model_class):
+                if action == 'delete':
+                    self.handle_delete(current_index, using, identifiers)
+                elif action == 'update':
+                    self.handle_update(current_index, using, pks)
+                else:
+                    raise UnrecognizedActionException(action)
+                touched.add(using)
+
+        # a single commit for the whole batch
+        for using in touched:
+            self.commit(using)
+
+        if touched:
+            # artifacts built from search results are now stale
+            DataVersion.objects.bump(DataVersion.SEARCH_INDEX)
+
+
 @shared_task
 def handle_haystack_signal(action, identifier, **kwargs):
     CeleryHaystackSignalHandler(identifier).handle(action)
+
+
+@shared_task
+def handle_haystack_signals(signals, **kwargs):
+    CeleryHaystackBatchSignalHandler(signals).handle()
+
+
+@shared_task
+def update_index_incremental(**kwargs):
+    call_command('update_index_incremental')
+
+
+@shared_task
+def export_footprints(job_id, **kwargs):
+    # imported here, the views are not loaded by the worker otherwise
+    from footprints.main.views import ExportFootprintSearch
+
+    job = ExportJob.objects.get(id=job_id)
+    ExportFootprintSearch().run_job(job)
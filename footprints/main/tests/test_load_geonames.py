@@ -0,0 +1,147 @@
+from io import StringIO
+import os
+import tempfile
+import zipfile
+
+from django.contrib.gis.geos.point import Point
+from django.core.management import call_command
+from django.test import TestCase
+
+from footprints.main.management.commands.populate_geoname_id import \
+    Command as PopulateCommand, LimitReached
+from footprints.main.models import Geoname
+from footprints.main.tests.factories import CanonicalPlaceFactory
+
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+DUMP = '\n'.join([
+    '\t'.join(['3094802', 'Kraków', 'Krakow', 'Cracow', '50.06143',
+               '19.93658', 'P', 'PPLA', 'PL', '', '77', '1261', '', '',
+               '755050', '', '219', 'Europe/Warsaw', '2023-01-01']),
+    '\t'.join(['3083271', 'Wawel', 'Wawel', '', '50.05406', '19.93545',
+               'S', 'CSTL', 'PL', '', '77', '', '', '', '0', '', '210',
+               'Europe/Warsaw', '2023-01-01']),
+    '\t'.join(['798544', 'Republic of Poland', 'Republic of Poland', '',
+               '52', '20', 'A', 'PCLI', 'PL', '', '00', '', '', '',
+               '38500000', '', '131', 'Europe/Warsaw', '2023-01-01']),
+    ''])
+
+COUNTRIES = '\n'.join([
+    '#ISO\tISO3\tISO-Numeric\tfips\tCountry',
+    'PL\tPOL\t616\tPL\tPoland\tWarsaw', ''])
+
+ADMIN1 = 'PL.77\tLesser Poland\tLesser Poland\t858787\n'
+
+
+class LoadGeonamesTest(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def test_handle(self):
+        out = StringIO()
+        call_command(
+            'load_geonames', self.write('PL.txt', DUMP),
+            countries=self.write('countryInfo.txt', COUNTRIES),
+            admin1=self.write('admin1CodesASCII.txt', ADMIN1),
+            feature_classes=['P', 'A'], stdout=out)
+        self.assertTrue('2 geonames read' in out.getvalue())
+
+        geoname = Geoname.objects.get(geoname_id='3094802')
+        self.assertEqual(geoname.name, 'Kraków')
+        self.assertEqual(geoname.admin_name, 'Lesser Poland')
+        self.assertEqual(geoname.country_name, 'Poland')
+        self.assertEqual(geoname.feature_class, 'P')
+        self.assertEqual(geoname.latlng.coords, (19.93658, 50.06143))
+
+        self.assertEqual(
+            Geoname.objects.get(geoname_id='798544').admin_name, '')
+        self.assertFalse(Geoname.objects.filter(geoname_id='3083271'))
+
+    def test_handle_zip(self):
+        path = os.path.join(self.tmpdir.name, 'PL.zip')
+        with zipfile.ZipFile(path, 'w') as archive:
+            archive.writestr('readme.txt', '')
+            archive.writestr('PL.txt', DUMP)
+
+        # existing geonames are kept
+        call_command('load_geonames', path, stdout=StringIO())
+        call_command('load_geonames', path, stdout=StringIO())
+        self.assertEqual(Geoname.objects.count(), 3)
+
+
+class PopulateGeonameIdTest(TestCase):
+
+    def test_handle_offline(self):
+        Geoname.objects.create(
+            geoname_id='3094802', name='Kraków', admin_name='Lesser Poland',
+            country_name='Poland', feature_class='P',
+            latlng=Point(19.93658, 50.06143))
+
+        cp1 = CanonicalPlaceFactory(
+            geoname_id=None, position='50.0614,19.9366')
+        cp2 = CanonicalPlaceFactory(
+            geoname_id=None, position='40.7128,-74.0060')
+
+        call_command('populate_geoname_id', offline=True)
+
+        cp1.refresh_from_db()
+        self.assertEqual(cp1.geoname_id, '3094802')
+        self.assertEqual(cp1.canonical_name, 'Kraków, Lesser Poland, Poland')
+
+        cp2.refresh_from_db()
+        self.assertIsNone(cp2.geoname_id)
+
+    def test_get_match_limit(self):
+        cmd = PopulateCommand()
+        cmd.offline = False
+        cmd.limit = 1
+        cmd.requests = 0
+
+        util = mock.Mock()
+        util.local_nearby.return_value = None
+        util.remote_nearby.return_value = {'name': 'New York'}
+
+        self.assertEqual(cmd.get_match(util, 40.71, -74.0)['name'],
+                         'New York')
+
+        # only the api requests count toward the limit
+        util.local_nearby.return_value = {'name': 'Kraków'}
+        self.assertEqual(cmd.get_match(util, 50.06, 19.94)['name'],
+                         'Kraków')
+
+        util.local_nearby.return_value = None
+        with self.assertRaises(LimitReached):
+            cmd.get_match(util, 40.71, -74.0)
+        self.assertEqual(util.remote_nearby.call_count, 1)
+
+    def test_get_match_remote(self):
+        cmd = PopulateCommand()
+        cmd.offline = False
+        cmd.limit = 100
+        cmd.requests = 0
+
+        util = mock.Mock()
+        util.local_nearby.return_value = None
+
+        # e.g. a point at sea
+        util.remote_nearby.return_value = None
+        self.assertIsNone(cmd.get_match(util, 0, -30.0))
+
+        util.remote_nearby.side_effect = ValueError('Geonames error: limit')
+        with self.assertRaises(LimitReached):
+            cmd.get_match(util, 40.71, -74.0)
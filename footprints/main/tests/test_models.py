@@ -9,7 +9,8 @@ from footprints.main.models import Language, DigitalFormat, \
     ExtendedDate, StandardizedIdentification, \
     Actor, Imprint, FOOTPRINT_LEVEL, IMPRINT_LEVEL, WRITTENWORK_LEVEL, Role, \
     Place, Footprint, WrittenWork, BookCopy, StandardizedIdentificationType, \
-    CanonicalPlace
+    CanonicalPlace, parse_edtf, natural_text_to_edtf, edtf_cache_info, \
+    footprint_fingerprint
 from footprints.main.templatetags.moderation import \
     flag_empty_narrative, flag_percent_complete, flag_empty_call_number, \
     flag_empty_bhb_number, moderation_flags, moderation_footprints
@@ -22,6 +23,12 @@ from footprints.main.tests.factories import RoleFactory, \
 from footprints.main.utils import string_to_point
 
 
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
 class LanguageTest(TestCase):
 
     def test_language(self):
@@ -325,6 +332,59 @@ class ExtendedDateTest(TestCase):
         dt = ExtendedDate.objects.create(edtf_format='1700/18xx')
         self.assertEqual(dt.end(), datetime.date(1899, 12, 31))
 
+    def test_bounds_columns(self):
+        dt = ExtendedDate.objects.create(edtf_format='1700/18xx')
+
+        dt = ExtendedDate.objects.get(id=dt.id)
+        self.assertEqual(dt.start_date, datetime.date(1700, 1, 1))
+        self.assertEqual(dt.end_date, datetime.date(1899, 12, 31))
+        self.assertTrue(dt.is_interval)
+        self.assertEqual(dt.display, '1700 - 1800s')
+
+        with mock.patch.object(ExtendedDate, 'as_edtf') as as_edtf:
+            self.assertEqual(dt.start(), datetime.date(1700, 1, 1))
+            self.assertEqual(str(dt), '1700 - 1800s')
+            self.assertFalse(as_edtf.called)
+
+    def test_bounds_stale(self):
+        dt = ExtendedDate.objects.create(edtf_format='1700')
+        dt.edtf_format = '1800'
+        self.assertEqual(dt.start(), datetime.date(1800, 1, 1))
+
+        dt.edtf_format = '1900'
+        dt.save(update_fields=['edtf_format'])
+        dt = ExtendedDate.objects.get(id=dt.id)
+        self.assertEqual(dt.display, '1900')
+
+    def test_bounds_backfill(self):
+        dt = ExtendedDate.objects.create(edtf_format='1700')
+        ExtendedDate.objects.filter(id=dt.id).update(
+            start_date=None, display='')
+
+        # rows the migration did not fill are parsed on demand
+        dt = ExtendedDate.objects.get(id=dt.id)
+        self.assertEqual(dt.start(), datetime.date(1700, 1, 1))
+
+    def test_parse_cache(self):
+        parse_edtf.cache_clear()
+        natural_text_to_edtf.cache_clear()
+
+        ExtendedDate(edtf_format='18xx').start()
+        self.assertEqual(str(ExtendedDate(edtf_format='18xx')),
+                         '19th century')
+        self.assertEqual(parse_edtf('18xx').end_date,
+                         datetime.date(1899, 12, 31))
+
+        info = edtf_cache_info()
+        self.assertEqual(info['parse_edtf'].misses, 1)
+        self.assertEqual(info['parse_edtf'].hits, 2)
+
+        dt = ExtendedDate.objects.create_from_string('approximately 1983')
+        self.assertTrue(dt.match_string('approximately 1983'))
+        info = edtf_cache_info()
+        self.assertEqual(info['natural_text_to_edtf'].misses, 1)
+        self.assertEqual(info['natural_text_to_edtf'].hits, 1)
+
 
 class ImprintTest(TestCase):
 
@@ -532,6 +592,37 @@ class ActorTest(TestCase):
         self.assertEqual(actor.person, actor2.person)
 
 
+class FootprintFingerprintTest(TestCase):
+
+    def test_footprint_fingerprint(self):
+        values = ['Medium', 'Provenance', 'call  number', None, 'Odyssey',
+                  '000106200', 'geo001']
+        self.assertEqual(
+            footprint_fingerprint(*values),
+            footprint_fingerprint(
+                'medium', ' provenance', 'Call number', '', 'ODYSSEY',
+                '106200', 'geo001'))
+        self.assertNotEqual(
+            footprint_fingerprint(*values),
+            footprint_fingerprint(
+                'Medium', 'Provenance', 'call number', None, 'Odyssey',
+                '106200', None))
+
+    def test_refresh_fingerprints(self):
+        fp = FootprintFactory()
+        bhb = fp.book_copy.imprint.get_bhb_number()
+        self.assertIsNone(fp.fingerprint)
+
+        Footprint.objects.refresh_fingerprints([fp.id])
+        fp.refresh_from_db()
+        self.assertEqual(fp.fingerprint, footprint_fingerprint(
+            'Medium', 'Provenance', 'call number', 'lorem ipsum',
+            fp.book_copy.imprint.work.title,
+            bhb.identifier if bhb else None,
+            fp.place.canonical_place.geoname_id))
+        self.assertEqual(fp.fingerprint, fp.calculate_fingerprint())
+
+
 class FootprintTest(TestCase):
 
     def test_footprint(self):
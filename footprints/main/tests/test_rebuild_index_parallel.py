@@ -0,0 +1,72 @@
+from io import StringIO
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from footprints.main.management.commands.rebuild_index_parallel import \
+    Command, get_index
+from footprints.main.models import DataVersion
+from footprints.main.tests.factories import FootprintFactory
+
+
+class RebuildIndexParallelTest(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        os.remove(self.path)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_pk_ranges(self):
+        fps = [FootprintFactory() for i in range(5)]
+        index = get_index('default', 'main.footprint')
+
+        ranges = Command().pk_ranges(index, 'default', 2)
+        self.assertEqual(ranges, [
+            (fps[0].id, fps[1].id),
+            (fps[2].id, fps[3].id),
+            (fps[4].id, fps[4].id)])
+
+    def test_state(self):
+        cmd = Command()
+        self.assertEqual(cmd.load_state(self.path), {})
+
+        state = {'main.footprint': {(1, 5), (6, 9)}}
+        cmd.save_state(self.path, state)
+        self.assertEqual(cmd.load_state(self.path), state)
+
+    def test_get_tasks_resume(self):
+        fps = [FootprintFactory() for i in range(3)]
+
+        state = {'main.footprint': {(fps[0].id, fps[1].id)}}
+        tasks, totals = Command().get_tasks(
+            'default', ['main.footprint'], 2, state)
+
+        self.assertEqual(totals, {'main.footprint': 2})
+        self.assertEqual(
+            tasks, [('default', 'main.footprint', fps[2].id, fps[2].id)])
+
+    def test_handle(self):
+        FootprintFactory()
+        FootprintFactory()
+
+        version = DataVersion.objects.current(DataVersion.SEARCH_INDEX)
+
+        out = StringIO()
+        call_command('rebuild_index_parallel', model=['main.footprint'],
+                     workers=1, batch_size=1, state_file=self.path,
+                     stdout=out)
+
+        self.assertTrue('main.footprint: 2/2 ranges, 2 documents'
+                        in out.getvalue())
+        self.assertFalse(os.path.exists(self.path))
+
+        # the cached pathmapper responses are stale
+        self.assertEqual(
+            DataVersion.objects.current(DataVersion.SEARCH_INDEX),
+            version + 1)
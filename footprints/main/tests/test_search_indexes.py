@@ -1,9 +1,13 @@
+from django.db import connection
 from django.test.testcases import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils.encoding import smart_text
 
 from footprints.main.search_indexes import FootprintIndex, BookCopyIndex, \
-    WrittenWorkIndex, ImprintIndex
-from footprints.main.tests.factories import FootprintFactory
+    WrittenWorkIndex, ImprintIndex, index_dependents
+from footprints.main.models import Role
+from footprints.main.tests.factories import FootprintFactory, \
+    ExtendedDateFactory, DigitalObjectFactory, ActorFactory, RoleFactory
 
 
 class TestFootprintIndex(TestCase):
@@ -24,6 +28,40 @@ class TestFootprintIndex(TestCase):
         self.assertTrue(smart_text(fp.book_copy.imprint.work.actor.first())
                         in actors)
 
+    def test_prepare_stored_fields(self):
+        fp = FootprintFactory()
+        imprint = fp.book_copy.imprint
+
+        data = FootprintIndex().full_prepare(fp)
+        self.assertEqual(data['date_display'], smart_text(fp.associated_date))
+        self.assertEqual(data['place_display'], smart_text(fp.place))
+        self.assertEqual(data['owner_names'],
+                         [o.display_name() for o in fp.owners()])
+        self.assertEqual(data['work_title'], imprint.work.title)
+        self.assertEqual(data['imprint_title'], imprint.title)
+        self.assertEqual(data['printer_names'],
+                         [p.display_name() for p in imprint.printers()])
+        self.assertEqual(data['pub_date_display'],
+                         smart_text(imprint.publication_date))
+        self.assertEqual(data['imprint_place_display'],
+                         smart_text(imprint.place))
+
+    def test_prepare_censored_expurgated(self):
+        fp = FootprintFactory()
+
+        data = FootprintIndex().full_prepare(fp)
+        self.assertFalse(data['censored'])
+        self.assertFalse(data['expurgated'])
+
+        fp.book_copy.imprint.actor.add(ActorFactory(
+            role=RoleFactory(name=Role.CENSOR, level='imprint')))
+        fp.actor.add(ActorFactory(
+            role=RoleFactory(name=Role.EXPURGATOR, level='footprint')))
+
+        data = FootprintIndex().full_prepare(fp)
+        self.assertTrue(data['censored'])
+        self.assertTrue(data['expurgated'])
+
 
 class TestBookCopyIndex(TestCase):
 
@@ -100,3 +138,81 @@ class TestWrittenWorkIndex(TestCase):
             fp.book_copy.imprint.work)
         self.assertTrue(smart_text(fp.book_copy.imprint.work.actor.first())
                         in actors)
+
+
+class TestFootprintIndexBatch(TestCase):
+
+    def prepare_batch(self):
+        index = FootprintIndex()
+        with CaptureQueriesContext(connection) as ctx:
+            for fp in index.index_queryset():
+                index.full_prepare(fp)
+        return len(ctx.captured_queries)
+
+    def test_constant_queries_per_batch(self):
+        FootprintFactory()
+        n = self.prepare_batch()
+
+        FootprintFactory()
+        FootprintFactory()
+        self.assertEqual(self.prepare_batch(), n)
+
+    def test_prepare_is_terminal(self):
+        fp = FootprintFactory(
+            associated_date=ExtendedDateFactory(edtf_format='1750'))
+        later = FootprintFactory(
+            book_copy=fp.book_copy,
+            associated_date=ExtendedDateFactory(edtf_format='1800'))
+
+        index = FootprintIndex()
+        qs = index.index_queryset()
+        self.assertFalse(index.prepare_is_terminal(qs.get(id=fp.id)))
+        self.assertTrue(index.prepare_is_terminal(qs.get(id=later.id)))
+
+    def test_prepare_has_image(self):
+        fp = FootprintFactory()
+
+        index = FootprintIndex()
+        self.assertFalse(
+            index.prepare_has_image(index.index_queryset().get(id=fp.id)))
+
+        fp.digital_object.add(DigitalObjectFactory())
+        self.assertTrue(
+            index.prepare_has_image(index.index_queryset().get(id=fp.id)))
+
+
+class TestIndexDependents(TestCase):
+
+    def test_work(self):
+        fp = FootprintFactory()
+        book_copy = fp.book_copy
+        imprint = book_copy.imprint
+
+        self.assertEqual(sorted(index_dependents(imprint.work)), sorted([
+            'main.imprint.{}'.format(imprint.id),
+            'main.bookcopy.{}'.format(book_copy.id),
+            'main.footprint.{}'.format(fp.id)]))
+
+    def test_footprint_siblings(self):
+        fp1 = FootprintFactory()
+        fp2 = FootprintFactory(book_copy=fp1.book_copy)
+        FootprintFactory()  # unrelated
+
+        identifiers = index_dependents(fp1)
+        self.assertTrue('main.footprint.{}'.format(fp2.id) in identifiers)
+        self.assertFalse('main.footprint.{}'.format(fp1.id) in identifiers)
+        self.assertEqual(len(identifiers), 4)
+
+    def test_actor(self):
+        fp = FootprintFactory()
+        actor = fp.actor.first()
+
+        self.assertEqual(sorted(index_dependents(actor)), sorted([
+            'main.writtenwork.{}'.format(fp.book_copy.imprint.work.id),
+            'main.imprint.{}'.format(fp.book_copy.imprint.id),
+            'main.bookcopy.{}'.format(fp.book_copy.id),
+            'main.footprint.{}'.format(fp.id)]))
+
+    def test_unindexed_model(self):
+        fp = FootprintFactory()
+        self.assertEqual(index_dependents(fp.created_by), [])
@@ -0,0 +1,109 @@
+from django.test import TestCase
+import haystack
+
+from footprints.main.signals import IndexSignalQueue
+from footprints.main.tests.factories import FootprintFactory, ActorFactory
+
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class IndexSignalQueueTest(TestCase):
+
+    def test_no_window(self):
+        queue = IndexSignalQueue(0)
+
+        with mock.patch('footprints.main.signals.handle_haystack_signals') \
+                as mock_task:
+            queue.add('update', 'main.footprint.1')
+            queue.add('update', 'main.footprint.1')
+
+            self.assertEqual(mock_task.apply_async.call_count, 2)
+            mock_task.apply_async.assert_called_with(
+                ([('update', 'main.footprint.1')],))
+
+    def test_coalesce(self):
+        queue = IndexSignalQueue(60)
+
+        with mock.patch('footprints.main.signals.handle_haystack_signals') \
+                as mock_task:
+            queue.add('update', 'main.footprint.1')
+            queue.add('update', 'main.footprint.2')
+            queue.add('update', 'main.footprint.1')
+            queue.add('delete', 'main.footprint.2')
+            self.assertFalse(mock_task.apply_async.called)
+            self.assertIsNotNone(queue.timer)
+
+            queue.flush()
+            mock_task.apply_async.assert_called_once_with(
+                ([('update', 'main.footprint.1'),
+                  ('delete', 'main.footprint.2')],))
+            self.assertIsNone(queue.timer)
+            self.assertEqual(queue.pending, {})
+
+    def test_coalesce_cascade(self):
+        queue = IndexSignalQueue(60)
+
+        with mock.patch('footprints.main.signals.handle_haystack_signals') \
+                as mock_task:
+            queue.add('cascade', 'main.writtenwork.1')
+            queue.add('update', 'main.writtenwork.1')
+            queue.add('cascade', 'main.writtenwork.1')
+            queue.add('delete', 'main.writtenwork.1')
+
+            queue.flush()
+            mock_task.apply_async.assert_called_once_with(
+                ([('cascade', 'main.writtenwork.1'),
+                  ('delete', 'main.writtenwork.1')],))
+
+    def test_flush_empty(self):
+        queue = IndexSignalQueue(60)
+
+        with mock.patch('footprints.main.signals.handle_haystack_signals') \
+                as mock_task:
+            queue.flush()
+            self.assertFalse(mock_task.apply_async.called)
+
+
+class FootprintsSignalProcessorTest(TestCase):
+
+    def setUp(self):
+        self.fp = FootprintFactory()
+        self.work = self.fp.book_copy.imprint.work
+
+    def test_save_cascades(self):
+        with mock.patch.object(haystack.signal_processor,
+                               'enqueue_task') as enqueue:
+            self.work.save()
+
+            enqueue.assert_any_call(
+                'cascade', 'main.writtenwork.{}'.format(self.work.id))
+            enqueue.assert_any_call(
+                'update', 'main.writtenwork.{}'.format(self.work.id))
+
+    def test_delete_enqueues_dependents(self):
+        book_copy = self.fp.book_copy
+
+        with mock.patch.object(haystack.signal_processor,
+                               'enqueue_task') as enqueue:
+            self.fp.delete()
+
+            enqueue.assert_any_call(
+                'update', 'main.bookcopy.{}'.format(book_copy.id))
+            enqueue.assert_any_call(
+                'delete', 'main.footprint.{}'.format(self.fp.id))
+
+    def test_m2m_changed(self):
+        actor = ActorFactory()
+
+        with mock.patch.object(haystack.signal_processor,
+                               'enqueue_task') as enqueue:
+            actor.writtenwork_set.add(self.work)
+
+            enqueue.assert_any_call(
+                'cascade', 'main.actor.{}'.format(actor.id))
+            enqueue.assert_any_call(
+                'cascade', 'main.writtenwork.{}'.format(self.work.id))
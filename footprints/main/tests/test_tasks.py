@@ -0,0 +1,138 @@
+from json import loads
+
+from django.test import TestCase
+from haystack.backends.simple_backend import SimpleSearchBackend
+
+from footprints.main.models import DataVersion, Footprint
+from footprints.main.search_indexes import FootprintIndex, BookCopyIndex
+from footprints.main.tasks import CeleryHaystackBatchSignalHandler
+from footprints.main.tests.factories import FootprintFactory
+from footprints.pathmapper.models import BookCopyRoute
+
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class CeleryHaystackBatchSignalHandlerTest(TestCase):
+
+    def test_group_signals(self):
+        handler = CeleryHaystackBatchSignalHandler([
+            ('update', 'main.footprint.1'),
+            ('update', 'main.imprint.2'),
+            ('update', 'main.footprint.3'),
+            ('delete', 'main.footprint.4')])
+
+        self.assertEqual(handler.group_signals(), {
+            ('update', 'main.footprint'):
+                ['main.footprint.1', 'main.footprint.3'],
+            ('update', 'main.imprint'): ['main.imprint.2'],
+            ('delete', 'main.footprint'): ['main.footprint.4']})
+
+    def test_handle(self):
+        fp1 = FootprintFactory()
+        fp2 = FootprintFactory()
+
+        handler = CeleryHaystackBatchSignalHandler([
+            ('update', 'main.footprint.{}'.format(fp1.id)),
+            ('update', 'main.footprint.{}'.format(fp2.id)),
+            ('update', 'main.footprint.0'),  # no longer exists
+            ('delete', 'main.footprint.0')])
+
+        with mock.patch.object(SimpleSearchBackend, 'update') as update, \
+                mock.patch.object(SimpleSearchBackend, 'remove') as remove:
+            handler.handle()
+
+            # one backend update for all the footprints, committed later
+            self.assertEqual(update.call_count, 1)
+            index, instances = update.call_args[0]
+            self.assertTrue(isinstance(index, FootprintIndex))
+            self.assertEqual(set(instances), {fp1, fp2})
+            self.assertEqual(update.call_args[1], {'commit': False})
+            remove.assert_called_once_with('main.footprint.0', commit=False)
+
+        # cached exports of the old index are stale
+        self.assertEqual(
+            DataVersion.objects.current(DataVersion.SEARCH_INDEX), 1)
+
+    def test_handle_chunks(self):
+        fps = [FootprintFactory() for i in range(3)]
+
+        handler = CeleryHaystackBatchSignalHandler([
+            ('update', 'main.footprint.{}'.format(fp.id)) for fp in fps])
+        handler.chunk_size = 2
+
+        with mock.patch.object(SimpleSearchBackend, 'update') as update:
+            handler.handle()
+
+            self.assertEqual(update.call_count, 2)
+            self.assertEqual(set(update.call_args_list[0][0][1]),
+                             set(fps[:2]))
+            self.assertEqual(update.call_args_list[1][0][1], fps[2:])
+
+    def test_expand_cascades(self):
+        fp = FootprintFactory()
+        book_copy = fp.book_copy
+
+        handler = CeleryHaystackBatchSignalHandler([
+            ('update', 'main.footprint.{}'.format(fp.id)),
+            ('cascade', 'main.bookcopy.{}'.format(book_copy.id)),
+            ('cascade', 'main.bookcopy.0')])  # no longer exists
+
+        groups = handler.expand_cascades(handler.group_signals())
+        self.assertFalse(('cascade', 'main.bookcopy') in groups)
+        self.assertEqual(groups[('update', 'main.footprint')],
+                         ['main.footprint.{}'.format(fp.id)])
+        self.assertEqual(
+            groups[('update', 'main.imprint')],
+            ['main.imprint.{}'.format(book_copy.imprint.id)])
+
+    def test_handle_cascade(self):
+        fp = FootprintFactory()
+
+        handler = CeleryHaystackBatchSignalHandler([
+            ('cascade', 'main.bookcopy.{}'.format(fp.book_copy.id))])
+
+        with mock.patch.object(SimpleSearchBackend, 'update') as update:
+            handler.handle()
+
+            # the bookcopy itself is not updated, only its dependents
+            indexes = [type(c[0][0]) for c in update.call_args_list]
+            self.assertTrue(FootprintIndex in indexes)
+            self.assertFalse(BookCopyIndex in indexes)
+
+    def test_handle_routes(self):
+        fp = FootprintFactory()
+
+        # a footprint change updates the book copy document and route
+        handler = CeleryHaystackBatchSignalHandler([
+            ('cascade', 'main.footprint.{}'.format(fp.id))])
+
+        with mock.patch.object(SimpleSearchBackend, 'update'):
+            handler.handle()
+
+        route = BookCopyRoute.objects.get(book_copy=fp.book_copy)
+        self.assertEqual(loads(route.data)['footprints'][0]['id'], fp.id)
+
+    def test_handle_fingerprints(self):
+        fp = FootprintFactory()
+        work = fp.book_copy.imprint.work
+
+        # a work change updates the footprint documents & fingerprints
+        Footprint.objects.refresh_fingerprints([fp.id])
+        fp.refresh_from_db()
+        before = fp.fingerprint
+
+        work.title = 'The Iliad'
+        work.save()
+
+        handler = CeleryHaystackBatchSignalHandler([
+            ('cascade', 'main.writtenwork.{}'.format(work.id))])
+        with mock.patch.object(SimpleSearchBackend, 'update'):
+            handler.handle()
+
+        fp.refresh_from_db()
+        self.assertNotEqual(fp.fingerprint, before)
+        self.assertEqual(fp.fingerprint, fp.calculate_fingerprint())
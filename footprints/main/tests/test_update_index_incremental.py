@@ -0,0 +1,74 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import timezone
+
+from footprints.main.management.commands.update_index_incremental import \
+    Command, LOCK_KEY
+from footprints.main.models import IndexWatermark, WrittenWork
+from footprints.main.tests.factories import FootprintFactory
+
+
+class UpdateIndexIncrementalTest(TestCase):
+
+    def test_get_lookups(self):
+        lookups = Command().get_lookups('main.footprint')
+        self.assertTrue('modified_at' in lookups)
+        self.assertTrue('book_copy__imprint__work__modified_at' in lookups)
+        self.assertTrue('actor__person__modified_at' in lookups)
+
+        # role and extendeddate have no modified_at
+        self.assertFalse('actor__role__modified_at' in lookups)
+        self.assertFalse('associated_date__modified_at' in lookups)
+
+    def test_changed_pks(self):
+        fp1 = FootprintFactory()
+        fp2 = FootprintFactory()
+
+        since = timezone.now() + timedelta(minutes=1)
+        WrittenWork.objects.filter(id=fp2.book_copy.imprint.work.id).update(
+            modified_at=since)
+
+        cmd = Command()
+        self.assertEqual(cmd.changed_pks('main.footprint', since), [fp2.id])
+        self.assertEqual(cmd.changed_pks('main.footprint', None), [])
+        self.assertEqual(
+            cmd.changed_pks('main.footprint', since - timedelta(days=1)),
+            [fp1.id, fp2.id])
+
+    def test_handle(self):
+        FootprintFactory()
+
+        # first run. only the mark is recorded
+        out = StringIO()
+        call_command('update_index_incremental', models=['main.footprint'],
+                     stdout=out)
+        self.assertTrue('main.footprint: 0 documents' in out.getvalue())
+
+        mark = IndexWatermark.objects.get(label='main.footprint')
+
+        out = StringIO()
+        call_command('update_index_incremental', models=['main.footprint'],
+                     since=(mark.watermark - timedelta(minutes=1)).isoformat(),
+                     stdout=out)
+        self.assertTrue('main.footprint: 1 documents' in out.getvalue())
+
+    def test_handle_invalid_since(self):
+        with self.assertRaises(CommandError):
+            call_command('update_index_incremental', since='yesterday')
+
+    def test_handle_locked(self):
+        cache.add(LOCK_KEY, True)
+        try:
+            out = StringIO()
+            call_command('update_index_incremental',
+                         models=['main.footprint'], stdout=out)
+        finally:
+            cache.delete(LOCK_KEY)
+
+        self.assertTrue('Another run is in progress' in out.getvalue())
+        self.assertFalse(IndexWatermark.objects.exists())
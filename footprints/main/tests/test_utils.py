@@ -2,9 +2,12 @@ from unittest import mock
 
 from django.test.testcases import TestCase
 
-from footprints.main.models import Actor, Role
+from django.contrib.gis.geos.point import Point
+
+from footprints.main.models import Actor, Geoname, Role
 from footprints.main.utils import (
-    interpolate_role_actors, snake_to_camel, camel_to_snake, GeonameUtil)
+    interpolate_role_actors, snake_to_camel, camel_to_snake, GeonameUtil,
+    lookup_geoname)
 
 
 class CustomUtilsTest(TestCase):
@@ -61,6 +64,9 @@ class CustomUtilsTest(TestCase):
 
 class GeonameUtilTest(TestCase):
 
+    def setUp(self):
+        lookup_geoname.cache_clear()
+
     def test_format_name(self):
         data = {'name': 'Albany', 'adminName1': '', 'countryName': 'US'}
         self.assertEqual('Albany, US', GeonameUtil().format_name(data))
@@ -76,7 +82,9 @@ class GeonameUtilTest(TestCase):
         }
 
         with self.settings(GEONAMES_KEY='abcd'):
-            with mock.patch('footprints.main.utils.requests.get') as mock_get:
+            with mock.patch(
+                    'footprints.main.utils.geonames_session') as mock_session:
+                mock_get = mock_session.return_value.get
                 mock_get.return_value.json.return_value = content
 
                 place = GeonameUtil().get_or_create_place('123')
@@ -89,3 +97,72 @@ class GeonameUtilTest(TestCase):
 
                 self.assertEqual(place.id,
                                  GeonameUtil().get_or_create_place('123').id)
+
+                # one request, the second lookup finds the canonical place
+                self.assertEqual(mock_get.call_count, 1)
+
+    def test_get_geoname_by_id(self):
+        Geoname.objects.create(
+            geoname_id='3094802', name='Kraków', admin_name='Lesser Poland',
+            country_name='Poland', feature_class='P',
+            latlng=Point(19.93658, 50.06143))
+
+        with mock.patch(
+                'footprints.main.utils.geonames_session') as mock_session:
+            name, pt = GeonameUtil().get_geoname_by_id('3094802')
+            self.assertEqual(name, 'Kraków, Lesser Poland, Poland')
+            self.assertEqual(pt.coords, (19.93658, 50.06143))
+
+            # found in the local gazetteer, then in the lru cache
+            with self.assertNumQueries(0):
+                GeonameUtil().get_geoname_by_id('3094802')
+
+            self.assertFalse(mock_session.called)
+
+    def test_get_geoname_by_id_not_found(self):
+        content = {'status': {'message': 'no such geoname'}}
+
+        with self.settings(GEONAMES_KEY='abcd'):
+            with mock.patch(
+                    'footprints.main.utils.geonames_session') as mock_session:
+                mock_get = mock_session.return_value.get
+                mock_get.return_value.json.return_value = content
+
+                with self.assertRaises(ValueError):
+                    GeonameUtil().get_geoname_by_id('123')
+
+    def test_local_nearby(self):
+        Geoname.objects.create(
+            geoname_id='1', name='Kraków', feature_class='P',
+            latlng=Point(19.93658, 50.06143))
+        Geoname.objects.create(
+            geoname_id='2', name='Nowa Huta', feature_class='P',
+            latlng=Point(20.03333, 50.07159))
+        Geoname.objects.create(
+            geoname_id='3', name='Wawel', feature_class='S',
+            latlng=Point(19.93545, 50.05406))
+
+        util = GeonameUtil()
+        self.assertEqual(util.local_nearby(50.054, 19.935)['geonameId'], '1')
+        self.assertIsNone(util.local_nearby(40.7128, -74.0060))
+
+    def test_remote_nearby(self):
+        util = GeonameUtil()
+        with self.settings(GEONAMES_KEY='abcd'):
+            with mock.patch(
+                    'footprints.main.utils.geonames_session') as mock_session:
+                mock_json = mock_session.return_value.get.return_value.json
+
+                mock_json.return_value = {
+                    'geonames': [{'geonameId': 5128581, 'name': 'New York'}]}
+                match = util.remote_nearby(40.7128, -74.0060)
+                self.assertEqual(match['name'], 'New York')
+
+                # nothing nearby, e.g. at sea
+                mock_json.return_value = {'geonames': []}
+                self.assertIsNone(util.remote_nearby(0, -30.0))
+
+                mock_json.return_value = {
+                    'status': {'message': 'hourly limit', 'value': 19}}
+                with self.assertRaises(ValueError):
+                    util.remote_nearby(40.7128, -74.0060)
@@ -1,18 +1,26 @@
+from datetime import timedelta
+import gzip
+import io
 from json import loads
+import tempfile
 
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser, Group, Permission
 from django.core import mail
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.test import TestCase
 from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
 from django.urls.base import reverse
+from django.utils import timezone
 from django.utils.encoding import smart_text
+import pyarrow.parquet
 
 from footprints.main.forms import ContactUsForm
 from footprints.main.models import Footprint, Actor, Imprint, \
     StandardizedIdentificationType, ExtendedDate, Language, \
-    WrittenWork, BookCopy, Role
+    WrittenWork, BookCopy, Role, DataVersion, ExportJob
 from footprints.main.search_indexes import format_sort_by
 from footprints.main.tests.factories import (
     UserFactory, WrittenWorkFactory, ImprintFactory, FootprintFactory,
@@ -23,7 +31,14 @@ from footprints.main.tests.factories import (
 from footprints.main.utils import interpolate_role_actors
 from footprints.main.views import (
     CreateFootprintView, AddActorView, ContactUsView, FootprintDetailView,
-    ExportFootprintSearch, VerifiedFootprintFeed, AddPlaceView)
+    ExportFootprintSearch, VerifiedFootprintFeed, AddPlaceView,
+    get_arrow_schema)
+
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
 
 
 class BasicTest(TestCase):
@@ -272,10 +287,8 @@ class ExportFootprintSearchTest(TestCase):
             Role.objects.all().for_imprint(),
             self.footprint2.book_copy.imprint.actor.all())
 
-        # Mock a SearchQuerySet
+        # Mock a SearchQuerySet. get_rows only reads the hits' pk
         qs = Footprint.objects.all()
-        for o in qs:
-            o.object = o
 
         rows = ExportFootprintSearch().get_rows(qs)
         next(rows)  # skip header row
@@ -286,6 +299,26 @@ class ExportFootprintSearchTest(TestCase):
         with self.assertRaises(StopIteration):
             next(rows)
 
+    def export_queries(self):
+        qs = Footprint.objects.order_by('id')
+        with CaptureQueriesContext(connection) as ctx:
+            rows = list(ExportFootprintSearch().get_rows(qs))
+        return len(rows), len(ctx.captured_queries)
+
+    def test_export_queries(self):
+        self.export_queries()  # caches the viaf identifier type
+
+        rows, n = self.export_queries()
+        self.assertEqual(rows, 3)
+
+        FootprintFactory(book_copy=self.footprint2.book_copy)
+        FootprintFactory()
+
+        # the page of hits is hydrated with the same queries
+        rows, m = self.export_queries()
+        self.assertEqual(rows, 5)
+        self.assertEqual(m, n)
+
     def test_get(self):
         url = reverse('export-footprint-list')
 
@@ -309,6 +342,168 @@ class ExportFootprintSearchTest(TestCase):
             next(response.streaming_content)
 
 
+class ExportFormatTest(TestCase):
+
+    def setUp(self):
+        self.footprint = FootprintFactory(title='Footprint 1')
+        self.url = reverse('export-footprint-list')
+        self.params = {
+            'precision': 'contains',
+            'direction': 'asc',
+            'q': 'Footprint',
+            'sort_by': 'ftitle'
+        }
+
+    def test_get_record(self):
+        view = ExportFootprintSearch()
+        record = view.get_record(self.footprint, view.get_loc_type())
+
+        self.assertEqual(record['id'], self.footprint.id)
+        self.assertEqual(record['percent_complete'],
+                         self.footprint.percent_complete)
+        self.assertEqual(record['date_start'],
+                         self.footprint.associated_date.start())
+        self.assertEqual(record['date_end'],
+                         self.footprint.associated_date.end())
+        self.assertEqual(len(record['imprint_actors']), 1)
+        self.assertEqual(set(record['imprint_actors'][0].keys()),
+                         {'role', 'name', 'viaf'})
+
+    def test_get_record_unfilled_bounds(self):
+        # dates whose bound columns were never filled, as the csv reads them
+        dt = self.footprint.associated_date
+        ExtendedDate.objects.filter(id=dt.id).update(
+            start_date=None, end_date=None, display='')
+        self.footprint.refresh_from_db()
+
+        view = ExportFootprintSearch()
+        record = view.get_record(self.footprint, view.get_loc_type())
+        self.assertIsNotNone(record['date_start'])
+        self.assertEqual(record['date_start'], dt.start())
+        self.assertEqual(record['date_end'], dt.end())
+
+    def test_get_invalid_format(self):
+        response = self.client.get(
+            self.url, dict(self.params, format='xls'))
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_jsonl(self):
+        response = self.client.get(
+            self.url, dict(self.params, format='jsonl'))
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+
+        lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(len(lines), 1)
+
+        record = loads(lines[0])
+        self.assertEqual(record['id'], self.footprint.id)
+        self.assertEqual(record['title'], 'Footprint 1')
+
+    def test_get_parquet(self):
+        response = self.client.get(
+            self.url, dict(self.params, format='parquet'))
+        table = pyarrow.parquet.read_table(
+            io.BytesIO(b''.join(response.streaming_content)))
+
+        self.assertEqual(table.num_rows, 1)
+        self.assertEqual(table.schema, get_arrow_schema())
+        self.assertEqual(table.column('id').to_pylist(), [self.footprint.id])
+
+
+class ExportJobTest(TestCase):
+
+    def setUp(self):
+        FootprintFactory(title='Footprint 1')
+        FootprintFactory(title='Footprint 2')
+        self.url = reverse('export-footprint-list')
+        self.params = {
+            'precision': 'contains',
+            'direction': 'asc',
+            'q': 'Footprint',
+            'sort_by': 'ftitle'
+        }
+
+    def start_job(self, **kwargs):
+        params = dict(self.params, **kwargs)
+        with mock.patch('footprints.main.views.export_footprints') as task:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.get(self.url, params)
+        return loads(response.content), task
+
+    def test_start_job(self):
+        ctx, task = self.start_job(**{'async': '1', 'page': 2})
+        job = ExportJob.objects.get(uuid=ctx['id'])
+        self.assertEqual(ctx['status'], ExportJob.STATUS_PENDING)
+        self.assertEqual(
+            job.params,
+            'direction=asc&precision=contains&q=Footprint&sort_by=ftitle')
+        task.delay.assert_called_once_with(job.id)
+
+        # identical exports share the job
+        ctx, task = self.start_job(**{'async': '1'})
+        self.assertEqual(ctx['id'], str(job.uuid))
+        self.assertFalse(task.delay.called)
+
+        # until the search index changes
+        DataVersion.objects.bump(DataVersion.SEARCH_INDEX)
+        ctx, task = self.start_job(**{'async': '1'})
+        self.assertNotEqual(ctx['id'], str(job.uuid))
+        self.assertTrue(task.delay.called)
+
+    def test_start_job_stalled(self):
+        ctx, task = self.start_job(**{'async': '1'})
+        job = ExportJob.objects.get(uuid=ctx['id'])
+
+        # the worker died before finishing the export
+        ExportJob.objects.filter(id=job.id).update(
+            status=ExportJob.STATUS_RUNNING,
+            modified_at=timezone.now() - timedelta(hours=1))
+
+        ctx, task = self.start_job(**{'async': '1'})
+        self.assertNotEqual(ctx['id'], str(job.uuid))
+        self.assertTrue(task.delay.called)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.STATUS_FAILED)
+        self.assertFalse(job.is_stalled())
+
+    def test_run_job(self):
+        job = ExportJob.objects.create(
+            params='direction=asc&precision=contains&q=Footprint',
+            key='abc', compress=True,
+            data_version=0)
+
+        with tempfile.TemporaryDirectory() as media_root:
+            with self.settings(MEDIA_ROOT=media_root):
+                ExportFootprintSearch().run_job(job)
+
+                job.refresh_from_db()
+                self.assertEqual(job.status, ExportJob.STATUS_COMPLETE)
+                self.assertEqual(job.total, 2)
+                self.assertEqual(job.rows, 2)
+
+                with job.artifact.open('rb') as f:
+                    lines = gzip.decompress(f.read()).decode(
+                        'utf-8').splitlines()
+
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith('Footprint ID'))
+
+    def test_job_view(self):
+        job = ExportJob.objects.create(
+            params='q=Footprint', key='abc', data_version=0)
+        url = reverse('export-job', args=[job.uuid])
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 405)
+
+        response = self.client.get(
+            url, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        ctx = loads(response.content)
+        self.assertEqual(ctx['status'], ExportJob.STATUS_PENDING)
+        self.assertTrue('url' not in ctx)
+
+
 class ApiViewTests(TestCase):
 
     def setUp(self):
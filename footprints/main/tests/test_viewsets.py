@@ -7,7 +7,7 @@ from django.urls.base import reverse
 from footprints.main.serializers import (
     StandardizedIdentificationTypeSerializer,
     StandardizedIdentificationSerializer, LanguageSerializer,
-    ExtendedDateSerializer, ActorSerializer)
+    ExtendedDateSerializer, ActorSerializer, PathmapperTableRowSerializer)
 from footprints.main.tests.factories import (
     StandardizedIdentificationFactory,
     LanguageFactory, ExtendedDateFactory, ActorFactory,
@@ -59,6 +59,28 @@ class SerializerTest(TestCase):
 
         self.assertEqual(serializer.to_internal_value(a.id), a)
 
+    def test_pathmapper_table_row_serializer(self):
+        # a raw solr document, without the optional stored fields
+        doc = {
+            'object_id': '5',
+            'work_title': 'The Odyssey',
+            'pub_date_display': 'c. 1600',
+            'censored': True
+        }
+
+        data = PathmapperTableRowSerializer(doc).data
+        self.assertEqual(data['footprint_id'], '5')
+        self.assertEqual(data['work_title'], 'The Odyssey')
+        self.assertEqual(data['imprint_title'], 'The Odyssey')
+        self.assertEqual(data['pub_date'], 'c. 1600')
+        self.assertEqual(data['footprint_date'], None)
+        self.assertEqual(data['censored'], 'True')
+        self.assertEqual(data['expurgated'], 'False')
+
+        doc['imprint_title'] = 'Odyssea'
+        data = PathmapperTableRowSerializer(doc).data
+        self.assertEqual(data['imprint_title'], 'Odyssea')
+
 
 class FootprintViewsetTest(TestCase):
 
@@ -1,12 +1,16 @@
+from functools import lru_cache
 import re
 
 from django.conf import settings
+from django.contrib.gis.db.models.functions import Distance
 from django.contrib.gis.geos.point import Point
+from django.contrib.gis.geos.polygon import Polygon
 from django.utils.encoding import smart_text
 import requests
+from requests.adapters import HTTPAdapter
 from rest_framework.renderers import BrowsableAPIRenderer
 
-from footprints.main.models import CanonicalPlace, Place
+from footprints.main.models import CanonicalPlace, Geoname, Place
 from footprints.mixins import BatchAccessMixin, ModerationAccessMixin, \
     AddChangeAccessMixin
 
@@ -109,7 +113,50 @@ def snake_to_camel(s):
     return re.sub(r'(?!^)_([a-zA-Z])', lambda m: m.group(1).upper(), s)
 
 
+GEONAMES_URL = 'https://secure.geonames.org/'
+
+
+@lru_cache(maxsize=None)
+def geonames_session():
+    '''One pooled session per process. Callers beyond
+    GEONAMES_MAX_CONNECTIONS wait for a free connection'''
+    session = requests.Session()
+    session.mount(GEONAMES_URL, HTTPAdapter(
+        pool_maxsize=settings.GEONAMES_MAX_CONNECTIONS, pool_block=True))
+    return session
+
+
+def geonames_request(service, **params):
+    params.update({'username': settings.GEONAMES_KEY, 'type': 'json'})
+    response = geonames_session().get(
+        GEONAMES_URL + service, params=params,
+        timeout=settings.GEONAMES_TIMEOUT)
+    return response.json()
+
+
+@lru_cache(maxsize=4096)
+def lookup_geoname(gid):
+    '''The geonames record of the id, from the local gazetteer or, on a
+    miss, the geonames api'''
+    try:
+        return Geoname.objects.get(geoname_id=gid).as_json()
+    except Geoname.DoesNotExist:
+        pass
+
+    the_json = geonames_request('getJSON', geonameId=gid)
+    if 'lat' not in the_json:
+        # not found, or over the hourly limit. not cached
+        raise ValueError('Geoname {} not found: {}'.format(
+            gid, the_json.get('status', {}).get('message', '')))
+    return the_json
+
+
 class GeonameUtil(object):
+    # findNearby's feature classes, populated places & countries/regions
+    FEATURE_CLASSES = ['P', 'A']
+
+    # degrees searched around a point in the local gazetteer
+    NEARBY_RADIUS = 0.5
 
     def format_name(self, the_json):
         name = the_json['name']
@@ -120,16 +167,41 @@ class GeonameUtil(object):
         return name
 
     def get_geoname_by_id(self, gid):
-        url = ('https://secure.geonames.org/getJSON?'
-               'username={}&type=json&geonameId={}').format(
-                   settings.GEONAMES_KEY, gid)
-        results = requests.get(url)
-        the_json = results.json()
+        the_json = lookup_geoname(str(gid))
 
         pt = Point(float(the_json['lng']), float(the_json['lat']))
 
         return (self.format_name(the_json), pt)
 
+    def local_nearby(self, lat, lng):
+        '''The nearest place in the local gazetteer, or None'''
+        lat, lng = float(lat), float(lng)
+        pt = Point(lng, lat, srid=4326)
+
+        # the box around the point narrows the search to the spatial index
+        r = self.NEARBY_RADIUS
+        box = Polygon.from_bbox((lng - r, lat - r, lng + r, lat + r))
+        box.srid = 4326
+
+        match = Geoname.objects.filter(
+            feature_class__in=self.FEATURE_CLASSES,
+            latlng__contained=box).annotate(
+                distance=Distance('latlng', pt)).order_by('distance').first()
+        return match.as_json() if match else None
+
+    def remote_nearby(self, lat, lng):
+        '''The nearest place according to the geonames api, or None when
+        there is none, e.g. at sea'''
+        the_json = geonames_request(
+            'findNearby', featureClass=self.FEATURE_CLASSES, lat=lat, lng=lng)
+        if 'status' in the_json:
+            # an error, or over the hourly limit
+            raise ValueError('Geonames error: {}'.format(
+                the_json['status'].get('message', '')))
+
+        if the_json.get('geonames'):
+            return the_json['geonames'][0]
+
     def get_or_create_place(self, gid):
         try:
             cp = CanonicalPlace.objects.get(geoname_id=gid)
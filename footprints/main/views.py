@@ -1,22 +1,37 @@
 import csv
+import gzip
+import hashlib
+import io
+import json
+import tempfile
+from urllib.parse import urlencode
 
 from django.apps import apps
 from django.conf import settings
 from django.contrib.syndication.views import Feed
+from django.core.files import File
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.mail import send_mail
 from django.core.exceptions import FieldDoesNotExist
+from django.db import transaction
+from django.db.models import Prefetch
 from django.db.models.fields.related import ManyToManyField
+from django.http import HttpRequest, QueryDict
 from django.http.response import HttpResponseRedirect, StreamingHttpResponse, \
-    HttpResponseBadRequest
+    HttpResponseBadRequest, HttpResponse, FileResponse
 from django.shortcuts import get_object_or_404
 from django.template import loader
 from django.urls.base import reverse
+from django.utils import timezone
 from django.utils.encoding import smart_text
 from django.views.generic.base import TemplateView, View
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import FormView
 from haystack.generic_views import SearchView
 from haystack.query import SearchQuerySet
+import pyarrow
+import pyarrow.ipc
+import pyarrow.parquet
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -29,8 +44,9 @@ from footprints.main.models import (
     Footprint, Actor, Person, Role, WrittenWork, Language,
     Place, Imprint, BookCopy, StandardizedIdentification,
     StandardizedIdentificationType, ExtendedDate, MEDIUM_CHOICES,
-    work_actor_changed, CanonicalPlace)
+    CanonicalPlace, SLUG_LOC, DataVersion, ExportJob)
 from footprints.main.serializers import NameSerializer
+from footprints.main.tasks import export_footprints
 from footprints.main.templatetags.moderation import moderation_footprints
 from footprints.main.utils import interpolate_role_actors, string_to_point
 from footprints.mixins import (
@@ -171,6 +187,14 @@ class FootprintSearchView(BaseSearchView):
     facet_fields = [
         'footprint_location_title', 'imprint_location_title', 'actor_title']
 
+    def get_form_kwargs(self):
+        kwargs = super(FootprintSearchView, self).get_form_kwargs()
+
+        # the list view renders from the stored fields. only the gallery
+        # view needs the footprints and their digital objects
+        kwargs['load_all'] = self.request.GET.get('gallery_view') == 'on'
+        return kwargs
+
     def get_context_data(self, **kwargs):
 
         context = super(FootprintSearchView, self).get_context_data(**kwargs)
@@ -210,9 +234,77 @@ class Echo(object):
         return value
 
 
+# format: (content type, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+ARROW_FORMATS = ['parquet', 'arrow']
+
+
+def get_arrow_schema():
+    actor = pyarrow.list_(pyarrow.struct([
+        ('role', pyarrow.string()),
+        ('name', pyarrow.string()),
+        ('viaf', pyarrow.string())]))
+
+    return pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('identifier', pyarrow.string()),
+        ('title', pyarrow.string()),
+        ('date', pyarrow.string()),
+        ('date_start', pyarrow.date32()),
+        ('date_end', pyarrow.date32()),
+        ('location', pyarrow.string()),
+        ('owners', pyarrow.list_(pyarrow.string())),
+        ('work_title', pyarrow.string()),
+        ('imprint_title', pyarrow.string()),
+        ('printers', pyarrow.list_(pyarrow.string())),
+        ('publication_date', pyarrow.string()),
+        ('publication_date_start', pyarrow.date32()),
+        ('publication_date_end', pyarrow.date32()),
+        ('created_at', pyarrow.timestamp('us', tz='UTC')),
+        ('percent_complete', pyarrow.int32()),
+        ('literary_work_loc', pyarrow.string()),
+        ('bhb_number', pyarrow.string()),
+        ('oclc_number', pyarrow.string()),
+        ('medium', pyarrow.string()),
+        ('provenance', pyarrow.string()),
+        ('call_number', pyarrow.string()),
+        ('notes', pyarrow.string()),
+        ('footprint_actors', actor),
+        ('imprint_actors', actor),
+    ])
+
+
+class ExportSink(object):
+    """A file-like wrapper that leaves the file open when the arrow
+    writers close their sink.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.closed = False
+
+    def write(self, value):
+        return self.fileobj.write(value)
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def close(self):
+        self.closed = True
+
+
 class ExportFootprintSearch(BaseSearchView):
+    # the hits are hydrated a page at a time in get_rows
+    load_all = False
+    page_size = 500
 
-    def get_header_string(self):
+    def get_header_string(self, footprint_roles, imprint_roles):
         headers = ['Footprint ID',
                    'Footprint Title', 'Footprint Date', 'Footprint Location',
                    'Footprint Owners', 'Written Work Title',
@@ -222,13 +314,13 @@ class ExportFootprintSearch(BaseSearchView):
                    'Imprint Actor and Role', 'Imprint BHB Number',
                    'Imprint OCLC Number', 'Evidence Type', 'Evidence Location',
                    'Evidence Call Number', 'Evidence Details']
-        for r in Role.objects.for_footprint():
+        for r in footprint_roles:
             role = 'Footprint Role ' + smart_text(r.name)\
                 + ' Actor'
             headers.append(role)
             headers.append(role + ' VIAF Number')
 
-        for r in Role.objects.for_imprint():
+        for r in imprint_roles:
             role = 'Imprint Role: ' + smart_text(r.name) + ' Actor'
             headers.append(role)
             headers.append(role + ' VIAF Number')
@@ -236,128 +328,424 @@ class ExportFootprintSearch(BaseSearchView):
 
     # interpolate_role_actors returns a list of already encoded values, these
     # strings do not need to be encoded again.
-    def get_footprint_actors_string(self, footprint):
-        return interpolate_role_actors(Role.objects.all().for_footprint(),
-                                       footprint.actors())
-
-    def get_imprint_actors_string(self, footprint):
-        return interpolate_role_actors(Role.objects.all().for_imprint(),
-                                       footprint.book_copy.imprint.actor.all())
+    def get_footprint_actors_string(self, footprint, roles):
+        return interpolate_role_actors(roles, footprint.actor.all())
+
+    def get_imprint_actors_string(self, footprint, roles):
+        return interpolate_role_actors(
+            roles, footprint.book_copy.imprint.actor.all())
+
+    def get_export_queryset(self, ids):
+        actors = Actor.objects.select_related(
+            'role', 'person__standardized_identifier__identifier_type')
+
+        return Footprint.objects.filter(pk__in=ids).select_related(
+            'associated_date', 'place__canonical_place',
+            'book_copy__imprint__work',
+            'book_copy__imprint__publication_date').prefetch_related(
+                Prefetch('actor', queryset=actors),
+                Prefetch('book_copy__imprint__actor', queryset=actors),
+                'book_copy__imprint__standardized_identifier__identifier_type',
+                'book_copy__imprint__work__standardized_identifier')
+
+    def get_pages(self, queryset):
+        '''Yields the footprints of each page of search hits, in search
+        order, loaded by a single prefetching queryset'''
+        offset = 0
+        while True:
+            hits = list(queryset[offset:offset + self.page_size])
+            if not hits:
+                break
+            offset += len(hits)
+
+            ids = [smart_text(hit.pk) for hit in hits]
+            footprints = {smart_text(fp.pk): fp
+                          for fp in self.get_export_queryset(ids)}
+
+            # Solr may have indexed objects that are not in the database
+            yield [footprints[pk] for pk in ids if pk in footprints]
+
+    def get_library_of_congress_identifier(self, work, loc_type):
+        # same as WrittenWork.get_library_of_congress_identifier, reading
+        # the prefetched identifiers
+        lst = [si for si in work.standardized_identifier.all()
+               if loc_type and si.identifier_type_id == loc_type.id]
+        return min(lst, key=lambda si: si.pk) if lst else None
+
+    def get_loc_type(self):
+        return StandardizedIdentificationType.objects.filter(
+            slug=SLUG_LOC).first()
+
+    def get_row_pages(self, queryset):
+        '''Yields the header, then the rows a page at a time'''
+        # resolved once per export
+        footprint_roles = list(Role.objects.for_footprint())
+        imprint_roles = list(Role.objects.for_imprint())
+        loc_type = self.get_loc_type()
+
+        yield [self.get_header_string(footprint_roles, imprint_roles)]
+
+        for page in self.get_pages(queryset):
+            yield [self.get_row(o, footprint_roles, imprint_roles, loc_type)
+                   for o in page]
 
     def get_rows(self, queryset):
-        yield self.get_header_string()
-
-        for search_result in queryset:
-            o = search_result.object
-            if o is None or type(o) != Footprint:
-                # Solr has an indexed object that is not in the database
-                continue
-
-            row = []
-
-            # Footprint identifier
-            row.append(o.identifier())
-            # Footprint title
-            row.append(o.title)
-            # Footprint date
-            row.append(smart_text(o.associated_date))
-
-            # Footprint location
-            row.append(smart_text(o.place))
-
-            # owners
-            a = [owner.display_name() for owner in o.owners()]
-            row.append(smart_text('; '.join(a)))
-
-            # Written work title
-            row.append(smart_text(o.book_copy.imprint.work.title))
-
-            # Imprint display_title
-            a = smart_text(o.book_copy.imprint.display_title())
-            row.append(a)
-
-            # Imprint Printers
-            a = [p.display_name()
-                 for p in o.book_copy.imprint.printers()]
-            row.append(smart_text('; '.join(a)))
-
-            # Imprint publication date
-            row.append(smart_text(o.book_copy.imprint.publication_date))
-
-            # Imprint created at date
-            row.append(o.created_at.strftime('%m/%d/%Y'))
-
-            # Footprint percent complete
-            row.append(o.percent_complete)
-
-            # Literary work LOC
-            loc_id = o.book_copy.imprint.work\
-                .get_library_of_congress_identifier()
-            loc_id = smart_text(loc_id)
-            row.append(loc_id)
-
-            # Imprint actor
-            actors = [smart_text(p) for p
-                      in o.book_copy.imprint.actor.all()]
-            row.append('; '.join(actors))
-
-            # Imprint BHB
-            if o.book_copy.imprint.has_bhb_number():
-                row.append(smart_text(o.book_copy
-                                       .imprint.get_bhb_number()
-                                       .identifier))
-            else:
-                row.append('')
+        for page in self.get_row_pages(queryset):
+            for row in page:
+                yield row
 
-            # Imprint OCLC #
-            if o.book_copy.imprint.has_oclc_number():
-                row.append(smart_text(o.book_copy
-                                       .imprint.get_oclc_number()
-                                       .identifier))
-            else:
-                row.append('')
+    def get_record_pages(self, queryset):
+        '''Yields the typed records a page at a time'''
+        loc_type = self.get_loc_type()
+
+        for page in self.get_pages(queryset):
+            yield [self.get_record(o, loc_type) for o in page]
+
+    def get_row(self, o, footprint_roles, imprint_roles, loc_type):
+        imprint = o.book_copy.imprint
+        actors = list(o.actor.all())
+        imprint_actors = list(imprint.actor.all())
+
+        row = []
+
+        # Footprint identifier
+        row.append(o.identifier())
+        # Footprint title
+        row.append(o.title)
+        # Footprint date
+        row.append(smart_text(o.associated_date))
+
+        # Footprint location
+        row.append(smart_text(o.place))
+
+        # owners
+        a = [owner.display_name() for owner in actors
+             if owner.role.name == Role.OWNER]
+        row.append(smart_text('; '.join(a)))
+
+        # Written work title
+        row.append(smart_text(imprint.work.title))
+
+        # Imprint display_title
+        a = smart_text(imprint.display_title())
+        row.append(a)
+
+        # Imprint Printers
+        a = [p.display_name() for p in imprint_actors
+             if p.role.name == Role.PRINTER]
+        row.append(smart_text('; '.join(a)))
+
+        # Imprint publication date
+        row.append(smart_text(imprint.publication_date))
+
+        # Imprint created at date
+        row.append(o.created_at.strftime('%m/%d/%Y'))
+
+        # Footprint percent complete
+        row.append(o.percent_complete)
+
+        # Literary work LOC
+        loc_id = self.get_library_of_congress_identifier(
+            imprint.work, loc_type)
+        row.append(smart_text(loc_id))
+
+        # Imprint actor
+        row.append('; '.join(smart_text(p) for p in imprint_actors))
+
+        # Imprint BHB
+        bhb = imprint.get_bhb_number()
+        row.append(smart_text(bhb.identifier) if bhb else '')
+
+        # Imprint OCLC #
+        oclc = imprint.get_oclc_number()
+        row.append(smart_text(oclc.identifier) if oclc else '')
 
-            # Evidence type
-            row.append(smart_text(o.medium))
+        # Evidence type
+        row.append(smart_text(o.medium))
 
-            # Evidence location
-            row.append(smart_text(o.provenance))
+        # Evidence location
+        row.append(smart_text(o.provenance))
 
-            # Evidence source
-            row.append(smart_text(o.call_number))
+        # Evidence source
+        row.append(smart_text(o.call_number))
 
-            # Evidence details
-            row.append(smart_text(o.notes))
+        # Evidence details
+        row.append(smart_text(o.notes))
 
-            # Footprint Actors
-            row.extend(self.get_footprint_actors_string(o))
+        # Footprint Actors
+        row.extend(self.get_footprint_actors_string(o, footprint_roles))
 
-            # Imprint Actors
-            row.extend(self.get_imprint_actors_string(o))
+        # Imprint Actors
+        row.extend(self.get_imprint_actors_string(o, imprint_roles))
 
-            yield row
+        return row
+
+    def get_actor_records(self, actors):
+        return [{
+            'role': smart_text(a.role.name),
+            'name': a.display_name(),
+            'viaf': a.person.get_viaf_number() or None
+        } for a in actors]
+
+    def get_record(self, o, loc_type):
+        '''The fields of get_row, keeping dates, numbers and the actor
+        lists typed for the columnar formats'''
+        imprint = o.book_copy.imprint
+        actors = list(o.actor.all())
+        imprint_actors = list(imprint.actor.all())
+
+        loc_id = self.get_library_of_congress_identifier(
+            imprint.work, loc_type)
+        bhb = imprint.get_bhb_number()
+        oclc = imprint.get_oclc_number()
+
+        date = o.associated_date
+        pub = imprint.publication_date
+
+        return {
+            'id': o.id,
+            'identifier': o.identifier(),
+            'title': o.title,
+            'date': smart_text(date) if date else None,
+            'date_start': date.start() if date else None,
+            'date_end': date.end() if date else None,
+            'location': smart_text(o.place) if o.place else None,
+            'owners': [a.display_name() for a in actors
+                       if a.role.name == Role.OWNER],
+            'work_title': imprint.work.title,
+            'imprint_title': smart_text(imprint.display_title()),
+            'printers': [a.display_name() for a in imprint_actors
+                         if a.role.name == Role.PRINTER],
+            'publication_date': smart_text(pub) if pub else None,
+            'publication_date_start': pub.start() if pub else None,
+            'publication_date_end': pub.end() if pub else None,
+            'created_at': o.created_at,
+            'percent_complete': o.percent_complete,
+            'literary_work_loc': loc_id.identifier if loc_id else None,
+            'bhb_number': bhb.identifier if bhb else None,
+            'oclc_number': oclc.identifier if oclc else None,
+            'medium': o.medium,
+            'provenance': o.provenance,
+            'call_number': o.call_number,
+            'notes': o.notes,
+            'footprint_actors': self.get_actor_records(actors),
+            'imprint_actors': self.get_actor_records(imprint_actors),
+        }
+
+    def get_format(self, query):
+        fmt = query.get('format') or 'csv'
+        return fmt if fmt in EXPORT_FORMATS else None
+
+    def write_csv(self, queryset, fileobj, progress):
+        text = io.TextIOWrapper(fileobj, encoding='utf-8', newline='')
+        writer = csv.writer(text)
+
+        pages = self.get_row_pages(queryset)
+        writer.writerows(next(pages))  # header
+        for page in pages:
+            writer.writerows(page)
+            progress(len(page))
+
+        # leave fileobj open for the caller
+        text.flush()
+        text.detach()
+
+    def get_jsonl(self, records):
+        return ''.join(json.dumps(r, cls=DjangoJSONEncoder) + '\n'
+                       for r in records)
+
+    def write_jsonl(self, queryset, fileobj, progress):
+        for records in self.get_record_pages(queryset):
+            fileobj.write(self.get_jsonl(records).encode('utf-8'))
+            progress(len(records))
+
+    def write_arrow(self, fmt, queryset, fileobj, progress):
+        schema = get_arrow_schema()
+        sink = ExportSink(fileobj)
+        if fmt == 'parquet':
+            writer = pyarrow.parquet.ParquetWriter(sink, schema)
+        else:
+            writer = pyarrow.ipc.new_stream(sink, schema)
+
+        for records in self.get_record_pages(queryset):
+            batch = pyarrow.RecordBatch.from_pylist(records, schema=schema)
+            writer.write_table(pyarrow.Table.from_batches([batch]))
+            progress(len(records))
+
+        writer.close()
+
+    def write_export(self, fmt, queryset, fileobj, progress=lambda n: None):
+        if fmt in ARROW_FORMATS:
+            self.write_arrow(fmt, queryset, fileobj, progress)
+        elif fmt == 'jsonl':
+            self.write_jsonl(queryset, fileobj, progress)
+        else:
+            self.write_csv(queryset, fileobj, progress)
+
+    def get_job_params(self, query):
+        # the search parameters that change the export, in a stable order
+        params = sorted(
+            (key, value) for key, values in query.lists()
+            for value in values if key not in ['async', 'compress', 'page'])
+        return urlencode(params)
+
+    def get_job(self, key, version):
+        # identical exports are served from the stored artifact until
+        # the search index changes
+        job = ExportJob.objects.filter(
+            key=key, data_version=version).exclude(
+            status=ExportJob.STATUS_FAILED).order_by('-created_at').first()
+
+        if job is not None and job.is_stalled():
+            job.status = ExportJob.STATUS_FAILED
+            job.error = 'Stalled'
+            job.save(update_fields=['status', 'error', 'modified_at'])
+            return None
+
+        return job
+
+    def start_job(self, query):
+        params = self.get_job_params(query)
+        # parquet and arrow are compressed or binary already
+        compress = bool(query.get('compress')) and \
+            self.get_format(query) not in ARROW_FORMATS
+        key = hashlib.sha256(
+            '{}&compress={}'.format(params, compress).encode('utf-8'))
+        version = DataVersion.objects.current(DataVersion.SEARCH_INDEX)
+
+        # identical requests wait for the version row, then find the job
+        with transaction.atomic():
+            DataVersion.objects.select_for_update().get(
+                name=DataVersion.SEARCH_INDEX)
+
+            job = self.get_job(key.hexdigest(), version)
+            if job is None:
+                job = ExportJob.objects.create(
+                    params=params, key=key.hexdigest(), compress=compress,
+                    data_version=version)
+                transaction.on_commit(
+                    lambda: export_footprints.delay(job.id))
+
+        return HttpResponse(json.dumps(export_job_context(job)),
+                            content_type='application/json')
+
+    def run_job(self, job):
+        request = HttpRequest()
+        request.method = 'GET'
+        request.GET = QueryDict(job.params)
+        self.setup(request)
+
+        job.status = ExportJob.STATUS_RUNNING
+        job.save(update_fields=['status', 'modified_at'])
+
+        try:
+            form = self.get_form(self.get_form_class())
+            if not form.is_valid():
+                raise ValueError('Invalid search parameters')
+
+            queryset = form.search()
+            job.total = queryset.count()
+            job.save(update_fields=['total', 'modified_at'])
+
+            with tempfile.TemporaryFile() as tmp:
+                self.write_job(job, queryset, tmp)
+                tmp.seek(0)
+
+                ext = EXPORT_FORMATS[self.get_format(request.GET)][1]
+                if job.compress:
+                    ext += '.gz'
+                name = 'footprints-{}.{}'.format(job.uuid, ext)
+                job.artifact.save(name, File(tmp), save=False)
+        except Exception as exc:
+            job.status = ExportJob.STATUS_FAILED
+            job.error = smart_text(exc)
+            job.save()
+            raise
+
+        job.status = ExportJob.STATUS_COMPLETE
+        job.completed_at = timezone.now()
+        job.save()
+
+    def write_job(self, job, queryset, fileobj):
+        def progress(n):
+            job.rows += n
+            job.save(update_fields=['rows', 'modified_at'])
+
+        out = fileobj
+        if job.compress:
+            out = gzip.GzipFile(fileobj=fileobj, mode='wb')
+
+        fmt = self.get_format(QueryDict(job.params))
+        self.write_export(fmt, queryset, out, progress)
+
+        if job.compress:
+            out.close()  # leaves fileobj open
 
     def get(self, request):
         form_class = self.get_form_class()
         form = self.get_form(form_class)
 
-        if not form.is_valid():
+        fmt = self.get_format(request.GET)
+        if not form.is_valid() or fmt is None:
             return HttpResponseBadRequest('')
 
+        if request.GET.get('async'):
+            return self.start_job(request.GET)
+
         queryset = form.search()
+        content_type, ext = EXPORT_FORMATS[fmt]
+        fnm = 'footprints.{}'.format(ext)
+
+        if fmt in ARROW_FORMATS:
+            # the parquet footer is written last. build the file first
+            tmp = tempfile.TemporaryFile()
+            self.write_export(fmt, queryset, tmp)
+            tmp.seek(0)
+            return FileResponse(tmp, as_attachment=True, filename=fnm,
+                                content_type=content_type)
+
+        if fmt == 'jsonl':
+            response = StreamingHttpResponse(
+                (self.get_jsonl(records)
+                 for records in self.get_record_pages(queryset)),
+                content_type=content_type)
+            response['Content-Disposition'] = \
+                'attachment; filename="' + fnm + '"'
+            return response
 
         rows = self.get_rows(queryset)
         pseudo_buffer = Echo()
         writer = csv.writer(pseudo_buffer)
 
-        fnm = "footprints.csv"
         response = StreamingHttpResponse(
-            (writer.writerow(row) for row in rows), content_type="text/csv"
+            (writer.writerow(row) for row in rows), content_type=content_type
         )
         response['Content-Disposition'] = 'attachment; filename="' + fnm + '"'
         return response
 
 
+def export_job_context(job):
+    ctx = {
+        'id': str(job.uuid),
+        'status': job.status,
+        'rows': job.rows,
+        'total': job.total,
+        'poll': reverse('export-job', args=[job.uuid]),
+    }
+
+    if job.status == ExportJob.STATUS_COMPLETE and job.artifact:
+        ctx['url'] = job.artifact.url
+
+    return ctx
+
+
+class ExportJobView(JSONResponseMixin, View):
+
+    def get(self, request, *args, **kwargs):
+        job = get_object_or_404(ExportJob, uuid=kwargs.get('uuid'))
+        return self.render_to_json_response(export_job_context(job))
+
+
 class WrittenWorkDetailView(DetailView):
 
     model = WrittenWork
@@ -500,11 +888,6 @@ class RemoveRelatedView(LoggedInMixin, AddChangeAccessMixin,
     def removeManyToMany(self, the_parent, the_child, attr):
         m2m = getattr(the_parent, attr)
         m2m.remove(the_child)
-
-        if (isinstance(the_parent, WrittenWork) and
-                isinstance(the_child, Actor)):
-            work_actor_changed(None, **{'instance': the_parent})
-
         return self.render_to_json_response({'success': True})
 
     def post(self, *args, **kwargs):
@@ -569,9 +952,6 @@ class AddActorView(AddRelatedRecordView):
         actor = self.create_actor(person_id, person_name, role, alias)
         the_parent.actor.add(actor)
 
-        if isinstance(the_parent, WrittenWork):
-            work_actor_changed(None, **{'instance': the_parent})
-
         return self.render_to_json_response({'success': True})
 
 
@@ -1,12 +1,14 @@
 from datetime import date, datetime
+import json
 
 from django import forms
 from django.db.models.query_utils import Q
 from django.utils.encoding import smart_text
 from haystack.forms import ModelSearchForm
+from haystack.query import EmptySearchQuerySet, SearchQuerySet
 
 from footprints.main.models import (
-    BookCopy, Imprint, WrittenWork, Place, Actor, Footprint)
+    BookCopy, Imprint, WrittenWork, Place, Actor)
 from footprints.main.utils import camel_to_snake, snake_to_camel
 
 
@@ -275,19 +277,86 @@ class BookCopySearchForm(ModelSearchFormEx):
         sqs = self.filter_by_footprint_year('book_copy_id', sqs)
         return sqs
 
-
-class BookCopyFootprintsForm(ModelSearchForm):
-    ''' Given a list of bookcopies, retrieve the associated footprints'''
-    class Meta:
-        model = Footprint
-
-    def search(self, copies):
-        args = [Q(book_copy_id__in=copies)]
-        kwargs = {
-            'django_ct': 'main.footprint',
-        }
-        sqs = self.searchqueryset.filter(*args, **kwargs)
-        return sqs
+    def layer_query(self):
+        '''The layer's search as one Solr query string, including the
+        narrowing footprint year join'''
+        query = self.search().query
+        clauses = [query.build_query()]
+        clauses += [solr_subquery(q) for q in sorted(query.narrow_queries)]
+        return ' AND '.join('({})'.format(clause) for clause in clauses)
+
+
+def normalize_layer(layer):
+    '''The layer's search parameters in a canonical form. Display-only
+    keys and empty or false values don't change the search'''
+    normalized = {}
+    for key, value in layer.items():
+        if camel_to_snake(key) not in BookCopySearchForm.base_fields:
+            continue
+
+        if isinstance(value, bool):
+            value = 'true' if value else ''
+        value = smart_text(value).strip() if value is not None else ''
+
+        if value not in ['', 'false']:
+            normalized[camel_to_snake(key)] = value
+    return normalized
+
+
+def normalize_layers(layers):
+    # the layers are combined, so their order doesn't matter
+    return sorted({json.dumps(normalize_layer(layer), sort_keys=True)
+                   for layer in layers})
+
+
+def solr_subquery(q):
+    # nests a query with local params, e.g. {!join}, in a boolean query
+    return '_query_:"{}"'.format(q.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+class MultiLayerQuery(object):
+    '''Plans the searches across several pathmapper layers as single
+    Solr requests. The layers are ORed into one filter query and their
+    footprints are reached with a join over book_copy_id, instead of
+    sending the matching book copy ids back to Solr'''
+
+    def __init__(self, layers, searchqueryset=None):
+        self.searchqueryset = searchqueryset or SearchQuerySet()
+
+        self.queries = []
+        for layer in layers:
+            form = BookCopySearchForm(layer)
+            if form.is_valid():
+                self.queries.append(form.layer_query())
+
+    def book_copy_query(self):
+        return ' OR '.join('({})'.format(q) for q in self.queries)
+
+    def footprint_query(self):
+        return '{{!join from=django_id to=book_copy_id}}{}'.format(
+            self.book_copy_query())
+
+    def book_copies(self):
+        if not self.queries:
+            return EmptySearchQuerySet()
+        return self.searchqueryset.narrow(self.book_copy_query())
+
+    def footprints(self):
+        if not self.queries:
+            return EmptySearchQuerySet()
+        return self.searchqueryset.narrow(
+            'django_ct:"main.footprint"').narrow(self.footprint_query())
+
+    def events(self):
+        '''The book copies and their footprints in one request, faceted
+        by publication and footprint year'''
+        if not self.queries:
+            return EmptySearchQuerySet()
+
+        q = '({}) OR {}'.format(
+            self.book_copy_query(), solr_subquery(self.footprint_query()))
+        return self.searchqueryset.narrow(q).facet(
+            'pub_year').facet('footprint_year')
 
 
 class ImprintSearchForm(ModelSearchFormEx):
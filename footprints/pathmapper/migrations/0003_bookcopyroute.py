@@ -0,0 +1,24 @@
+# Generated by Django 3.2.18 on 2026-10-18 14:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0053_exportjob_dataversion'),
+        ('pathmapper', '0002_auto_20191028_1340'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookCopyRoute',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.TextField()),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+                ('book_copy', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='route', to='main.bookcopy')),
+            ],
+        ),
+    ]
@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import json
+
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Prefetch
+from django.utils.encoding import smart_text
+
+from footprints.main.models import Actor, BookCopy, Footprint, Role
+from footprints.main.serializers import PlaceSerializer
 
 
 class MapLayerCollection(models.Model):
@@ -17,3 +24,85 @@ class MapLayer(models.Model):
     title = models.TextField()
     collection = models.ForeignKey(
         MapLayerCollection, on_delete=models.CASCADE)
+
+
+def place_data(place):
+    return PlaceSerializer(place).data if place else None
+
+
+def date_data(extended_date):
+    return smart_text(extended_date) if extended_date else None
+
+
+def route_data(book_copy):
+    '''The PathmapperRouteSerializer representation of the book copy,
+    read from the records loaded by BookCopyRouteManager.route_queryset'''
+    imprint = book_copy.imprint
+    footprints = sorted(book_copy.footprint_set.all(),
+                        key=lambda obj: obj.sort_date())
+
+    return {
+        'id': book_copy.id,
+        'identifier': book_copy.identifier(),
+        'imprint': {
+            'id': imprint.id,
+            'title': imprint.title,
+            'place': place_data(imprint.place),
+            'display_date': date_data(imprint.publication_date),
+            'sort_date': imprint.sort_date().isoformat(),
+            'work_id': smart_text(imprint.work.id),
+            'work_title': imprint.work.title,
+        },
+        'footprints': [{
+            'id': fp.id,
+            'title': fp.title,
+            'place': place_data(fp.place),
+            'display_date': date_data(fp.associated_date),
+            'sort_date': fp.sort_date().isoformat(),
+            'narrative': fp.narrative,
+            'owners': ','.join(str(a) for a in fp.owners),
+            'call_number': fp.call_number,
+            'identifier': fp.identifier(),
+            'is_terminal': fp == footprints[-1],
+        } for fp in footprints]
+    }
+
+
+class BookCopyRouteManager(models.Manager):
+
+    def route_queryset(self, ids):
+        owners = Actor.objects.filter(
+            role__name=Role.OWNER).select_related('person', 'role')
+        footprints = Footprint.objects.select_related(
+            'associated_date', 'place__canonical_place').prefetch_related(
+                Prefetch('actor', queryset=owners, to_attr='owners'))
+
+        return BookCopy.objects.filter(id__in=ids).select_related(
+            'imprint__work', 'imprint__publication_date',
+            'imprint__place__canonical_place').prefetch_related(
+                Prefetch('footprint_set', queryset=footprints))
+
+    def refresh(self, ids):
+        '''Rebuilds the routes of the book copies. The routes of deleted
+        copies are removed with them'''
+        routes = [BookCopyRoute(book_copy=book_copy,
+                                data=json.dumps(route_data(book_copy)))
+                  for book_copy in self.route_queryset(ids)]
+
+        with transaction.atomic():
+            self.filter(book_copy__id__in=ids).delete()
+            return self.bulk_create(routes)
+
+
+class BookCopyRoute(models.Model):
+    '''A book copy's journey, pre-serialized for the pathmapper. Kept
+    current by the search index signal handler'''
+    objects = BookCopyRouteManager()
+
+    book_copy = models.OneToOneField(
+        BookCopy, on_delete=models.CASCADE, related_name='route')
+    data = models.TextField()
+    modified_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return smart_text(self.book_copy)
@@ -0,0 +1,78 @@
+from collections import OrderedDict
+
+from haystack.constants import ID
+from haystack.query import EmptySearchQuerySet
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class SolrCursorPagination(PageNumberPagination):
+    '''Pages a SearchQuerySet with Solr's cursorMark when the request has
+    a cursor parameter, starting from cursor=*. Each page costs the same
+    however deep it is. The pages are the raw stored documents, not
+    SearchResults. Without a cursor the pages are numbered as usual'''
+    cursor_query_param = 'cursor'
+    start_cursor = '*'
+
+    def get_search_kwargs(self, query, backend):
+        params = query.build_params()
+        params['start_offset'] = 0
+        params['end_offset'] = self.page_size
+        kwargs = backend.build_search_kwargs(query.build_query(), **params)
+
+        # the cursor needs a total order, so the unique key breaks ties
+        sort = kwargs.get('sort')
+        kwargs['sort'] = '{}, {} asc'.format(sort, ID) if sort \
+            else '{} asc'.format(ID)
+        kwargs.pop('start', None)
+        return kwargs
+
+    def paginate_cursor(self, queryset, cursor):
+        query = queryset.query
+        backend = query.backend
+
+        kwargs = self.get_search_kwargs(query, backend)
+        kwargs['cursorMark'] = cursor
+        raw = backend.conn.search(query.build_query(), **kwargs)
+
+        self.count = raw.hits
+        self.next_cursor = raw.nextCursorMark \
+            if raw.nextCursorMark != cursor else None
+        return list(raw.docs)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.cursor = request.query_params.get(self.cursor_query_param)
+
+        if not self.cursor:
+            return super().paginate_queryset(queryset, request, view)
+
+        if isinstance(queryset, EmptySearchQuerySet) or \
+                not hasattr(queryset.query.backend, 'conn'):
+            # no layers, or a backend without cursors
+            self.count = 0
+            self.next_cursor = None
+            return []
+
+        return self.paginate_cursor(queryset, self.cursor)
+
+    def get_next_cursor_link(self):
+        if self.next_cursor is None:
+            return None
+
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.page_query_param)
+        return replace_query_param(
+            url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        if not self.cursor:
+            return super().get_paginated_response(data)
+
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_cursor_link()),
+            ('previous', None),
+            ('results', data)
+        ]))
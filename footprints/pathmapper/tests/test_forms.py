@@ -3,11 +3,19 @@ from datetime import date
 from django.db.models.query_utils import Q
 from django.test.testcases import TestCase
 from django.utils.encoding import smart_text
+from haystack.query import EmptySearchQuerySet
 
 from footprints.main.tests.factories import PlaceFactory
 from footprints.pathmapper.forms import (
     ActorSearchForm, BookCopySearchForm, ModelSearchFormEx, ImprintSearchForm,
-    WrittenWorkSearchForm)
+    WrittenWorkSearchForm, MultiLayerQuery, normalize_layer, normalize_layers,
+    solr_subquery)
+
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
 
 
 class ModelSearchFormExTest(TestCase):
@@ -335,6 +343,79 @@ class BookCopySearchFormTest(TestCase):
         self.assertEqual(
             kwargs['pub_start_date__lte'], date(1800, 12, 31))
 
+    def test_layer_query(self):
+        form = BookCopySearchForm({'footprintStart': '1700'})
+        self.assertTrue(form.is_valid())
+
+        q = form.layer_query()
+        self.assertTrue(q.startswith('('))
+        self.assertTrue(
+            ' AND (_query_:"{!join from=book_copy_id to=django_id}'
+            'django_ct:\\"main.footprint\\"' in q)
+
+
+class NormalizeLayerTest(TestCase):
+
+    def test_normalize_layer(self):
+        layer = {
+            'title': 'Kuzari',
+            'visible': True,
+            'work': 12,
+            'imprint': None,
+            'pubStart': ' 1700',
+            'pubRange': 'false',
+            'footprintRange': True,
+            'censored': 'no'
+        }
+        self.assertEqual(normalize_layer(layer), {
+            'work': '12',
+            'pub_start': '1700',
+            'footprint_range': 'true',
+            'censored': 'no'
+        })
+
+    def test_normalize_layers(self):
+        self.assertEqual(
+            normalize_layers([{'work': 1}, {'imprint': 2}, {'work': '1'}]),
+            normalize_layers([{'imprint': '2'}, {'work': 1, 'title': 'a'}]))
+
+
+class MultiLayerQueryTest(TestCase):
+
+    def test_solr_subquery(self):
+        self.assertEqual(solr_subquery('{!join from=a to=b}c:"d\\e"'),
+                         '_query_:"{!join from=a to=b}c:\\"d\\\\e\\""')
+
+    def test_no_layers(self):
+        planner = MultiLayerQuery([])
+        self.assertTrue(
+            isinstance(planner.book_copies(), EmptySearchQuerySet))
+        self.assertTrue(isinstance(planner.footprints(), EmptySearchQuerySet))
+        self.assertTrue(isinstance(planner.events(), EmptySearchQuerySet))
+
+    def test_layers(self):
+        with mock.patch.object(BookCopySearchForm, 'layer_query',
+                               side_effect=['A', 'B']):
+            planner = MultiLayerQuery([{}, {'pubStart': 'x'}, {}])
+
+        # the invalid layer is skipped
+        self.assertEqual(planner.book_copy_query(), '(A) OR (B)')
+        self.assertEqual(planner.footprint_query(),
+                         '{!join from=django_id to=book_copy_id}(A) OR (B)')
+
+        sqs = planner.book_copies()
+        self.assertEqual(sqs.query.narrow_queries, {'(A) OR (B)'})
+
+        sqs = planner.footprints()
+        self.assertEqual(sqs.query.narrow_queries, {
+            'django_ct:"main.footprint"', planner.footprint_query()})
+
+        sqs = planner.events()
+        self.assertEqual(sqs.query.narrow_queries, {
+            '(A) OR (B) OR ' + solr_subquery(planner.footprint_query())})
+        self.assertEqual(set(sqs.query.facets.keys()),
+                         {'pub_year', 'footprint_year'})
+
 
 class ImprintSearchFormTest(TestCase):
 
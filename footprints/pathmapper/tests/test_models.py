@@ -0,0 +1,68 @@
+from json import loads
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from footprints.main.models import Role
+from footprints.main.serializers import PathmapperRouteSerializer
+from footprints.main.tests.factories import (
+    ActorFactory, BookCopyFactory, ExtendedDateFactory, FootprintFactory,
+    RoleFactory)
+from footprints.pathmapper.models import BookCopyRoute
+
+
+class BookCopyRouteTest(TestCase):
+
+    def setUp(self):
+        self.book_copy = BookCopyFactory()
+        self.fp1 = FootprintFactory(
+            book_copy=self.book_copy,
+            associated_date=ExtendedDateFactory(edtf_format='1700'))
+        self.fp2 = FootprintFactory(
+            book_copy=self.book_copy,
+            associated_date=ExtendedDateFactory(edtf_format='1650'))
+
+        owner = RoleFactory(name=Role.OWNER)
+        self.fp1.actor.add(ActorFactory(role=owner))
+
+    def test_route_data(self):
+        routes = BookCopyRoute.objects.refresh([self.book_copy.id])
+        self.assertEqual(len(routes), 1)
+
+        data = loads(routes[0].data)
+        expected = loads(JSONRenderer().render(
+            PathmapperRouteSerializer(self.book_copy).data))
+        self.assertEqual(data, expected)
+
+        self.assertEqual([fp['id'] for fp in data['footprints']],
+                         [self.fp2.id, self.fp1.id])
+        self.assertTrue(data['footprints'][1]['is_terminal'])
+
+    def test_refresh_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            BookCopyRoute.objects.refresh([self.book_copy.id])
+
+        # more stops and copies don't add queries
+        other = FootprintFactory().book_copy
+        FootprintFactory(book_copy=self.book_copy)
+        with self.assertNumQueries(len(ctx.captured_queries)):
+            BookCopyRoute.objects.refresh([self.book_copy.id, other.id])
+
+    def test_refresh(self):
+        BookCopyRoute.objects.refresh([self.book_copy.id])
+
+        self.fp1.title = 'Changed'
+        self.fp1.save()
+        BookCopyRoute.objects.refresh([self.book_copy.id])
+
+        route = BookCopyRoute.objects.get(book_copy=self.book_copy)
+        data = loads(route.data)
+        self.assertEqual(data['footprints'][1]['title'], 'Changed')
+
+        # deleted copies lose their routes
+        self.book_copy.delete()
+        self.assertEqual(BookCopyRoute.objects.refresh([route.book_copy_id]),
+                         [])
+        self.assertFalse(BookCopyRoute.objects.exists())
@@ -0,0 +1,97 @@
+from django.test.testcases import TestCase
+from haystack.query import EmptySearchQuerySet
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from footprints.pathmapper.pagination import SolrCursorPagination
+
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class SolrCursorPaginationTest(TestCase):
+
+    def get_request(self, params):
+        return Request(APIRequestFactory().get('/table/', params))
+
+    def get_queryset(self, docs, next_cursor):
+        raw = mock.Mock(hits=20, docs=docs, nextCursorMark=next_cursor)
+
+        backend = mock.Mock()
+        backend.build_search_kwargs.return_value = {
+            'sort': 'wtitle asc', 'start': 0, 'rows': 15}
+        backend.conn.search.return_value = raw
+
+        queryset = mock.Mock()
+        queryset.query.backend = backend
+        queryset.query.build_query.return_value = 'censored:true'
+        queryset.query.build_params.return_value = {}
+        return queryset
+
+    def test_get_search_kwargs(self):
+        paginator = SolrCursorPagination()
+        queryset = self.get_queryset([], '*')
+
+        kwargs = paginator.get_search_kwargs(
+            queryset.query, queryset.query.backend)
+        self.assertEqual(kwargs['sort'], 'wtitle asc, id asc')
+        self.assertFalse('start' in kwargs)
+
+        queryset.query.backend.build_search_kwargs.return_value = {}
+        kwargs = paginator.get_search_kwargs(
+            queryset.query, queryset.query.backend)
+        self.assertEqual(kwargs['sort'], 'id asc')
+
+    def test_paginate_cursor(self):
+        paginator = SolrCursorPagination()
+        queryset = self.get_queryset([{'object_id': '1'}], 'AoE1')
+
+        request = self.get_request({'cursor': '*', 'page': '2'})
+        page = paginator.paginate_queryset(queryset, request)
+        self.assertEqual(page, [{'object_id': '1'}])
+
+        args, kwargs = queryset.query.backend.conn.search.call_args
+        self.assertEqual(args, ('censored:true',))
+        self.assertEqual(kwargs['cursorMark'], '*')
+
+        response = paginator.get_paginated_response(page)
+        self.assertEqual(response.data['count'], 20)
+        self.assertEqual(response.data['previous'], None)
+        self.assertTrue('cursor=AoE1' in response.data['next'])
+        self.assertFalse('page=' in response.data['next'])
+
+    def test_paginate_cursor_last_page(self):
+        paginator = SolrCursorPagination()
+        queryset = self.get_queryset([], 'AoE1')
+
+        request = self.get_request({'cursor': 'AoE1'})
+        paginator.paginate_queryset(queryset, request)
+
+        # solr returns the same cursor once the results are exhausted
+        response = paginator.get_paginated_response([])
+        self.assertEqual(response.data['next'], None)
+
+    def test_paginate_empty(self):
+        paginator = SolrCursorPagination()
+
+        request = self.get_request({'cursor': '*'})
+        page = paginator.paginate_queryset(EmptySearchQuerySet(), request)
+        self.assertEqual(page, [])
+
+        response = paginator.get_paginated_response(page)
+        self.assertEqual(response.data['count'], 0)
+        self.assertEqual(response.data['next'], None)
+
+    def test_paginate_page(self):
+        paginator = SolrCursorPagination()
+
+        request = self.get_request({})
+        page = paginator.paginate_queryset(list(range(20)), request)
+        self.assertEqual(page, list(range(15)))
+
+        response = paginator.get_paginated_response(page)
+        self.assertEqual(response.data['count'], 20)
+        self.assertTrue('page=2' in response.data['next'])
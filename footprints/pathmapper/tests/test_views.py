@@ -1,15 +1,30 @@
 from datetime import datetime
-from json import loads
+from json import dumps, loads
 
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
 from django.test.client import RequestFactory
 from django.test.testcases import TestCase
+from django.test.utils import override_settings
 from django.urls.base import reverse
+from haystack.query import SearchQuerySet
 
-from footprints.main.models import CanonicalPlace
-from footprints.main.tests.factories import PlaceFactory
+from footprints.main.models import BookCopy, CanonicalPlace, DataVersion
+from footprints.main.tests.factories import BookCopyFactory, \
+    FootprintFactory, PlaceFactory
 from footprints.main.viewsets import PlaceViewSet
 from footprints.pathmapper.forms import PlaceSearchForm
-from footprints.pathmapper.views import PathmapperView, PathmapperEventViewSet
+from footprints.pathmapper.models import BookCopyRoute
+from footprints.pathmapper.views import PathmapperView, \
+    PathmapperEventViewSet, PathmapperRouteView, PathmapperClusterMixin, \
+    PathmapperTableView, BookCopySearchView, STATS_FIELDS, \
+    TOTAL_CACHE_KEY, get_pathmapper_cache
+
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
 
 
 class PathmapperViewTest(TestCase):
@@ -71,6 +86,71 @@ class BookCopySearchViewTest(TestCase):
         the_json = loads(response.content.decode('utf-8'))
         self.assertEqual(the_json['total'], 0)
 
+    def test_get_stats(self):
+        def run(query, **kwargs):
+            query._results = []
+            query._hit_count = 3
+            query._stats = {
+                'pub_start_date': {'min': '1701-01-01T00:00:00Z'},
+                'pub_end_date': {'max': '1750-12-31T00:00:00Z'}}
+
+        view = BookCopySearchView()
+        sqs = SearchQuerySet()
+        with mock.patch.object(type(sqs.query), 'run', autospec=True,
+                               side_effect=run) as mock_run:
+            total, stats = view.get_stats(sqs)
+
+        # one request for the count and stats, no documents
+        self.assertEqual(mock_run.call_count, 1)
+        query = mock_run.call_args[0][0]
+        self.assertEqual(query.end_offset, 0)
+        self.assertEqual(set(query.stats.keys()), set(STATS_FIELDS))
+
+        self.assertEqual(total, 3)
+        self.assertEqual(view.min_year(stats, 'pub_start_date'), 1701)
+        self.assertEqual(view.max_year(stats, 'pub_end_date'), 1750)
+        self.assertEqual(view.min_year(stats, 'footprint_start_date'), 1000)
+
+    def test_get_stats_solr(self):
+        raw = mock.Mock(hits=3, stats={'stats_fields': {
+            'pub_start_date': {'min': '1701-01-01T00:00:00Z'},
+            'footprint_start_date': {'min': '1650-01-01T00:00:00Z'}}})
+
+        sqs = mock.Mock()
+        sqs.query.build_query.return_value = 'censored:true'
+        sqs.query.build_params.return_value = {}
+        sqs.query.backend.build_search_kwargs.return_value = {
+            'fl': '* score', 'stats': 'true', 'stats.field': 'pub_end_date',
+            'start': 0, 'rows': 0}
+        sqs.query.backend.conn.search.return_value = raw
+
+        view = BookCopySearchView()
+        total, stats = view.get_stats(sqs)
+
+        # one request carrying all four stats fields
+        self.assertEqual(sqs.query.backend.conn.search.call_count, 1)
+        args, kwargs = sqs.query.backend.conn.search.call_args
+        self.assertEqual(args, ('censored:true',))
+        self.assertEqual(kwargs['stats'], 'true')
+        self.assertEqual(kwargs['stats.field'], STATS_FIELDS)
+        self.assertEqual(len(kwargs['stats.field']), 4)
+        self.assertEqual(kwargs['rows'], 0)
+
+        self.assertEqual(total, 3)
+        self.assertEqual(view.min_year(stats, 'pub_start_date'), 1701)
+        self.assertEqual(view.min_year(stats, 'footprint_start_date'), 1650)
+
+    def test_get_total_max(self):
+        cache.delete(TOTAL_CACHE_KEY)
+        BookCopyFactory()
+
+        view = BookCopySearchView()
+        self.assertEqual(view.get_total_max(), 1)
+
+        BookCopyFactory()
+        with self.assertNumQueries(0):
+            self.assertEqual(view.get_total_max(), 1)
+
 
 class PathmapperTableViewTest(TestCase):
 
@@ -99,6 +179,152 @@ class PathmapperRouteViewTest(TestCase):
         self.assertEqual(the_json['previous'], None)
         self.assertEqual(the_json['results'], [])
 
+    def test_get_routes(self):
+        fp = FootprintFactory()
+        BookCopyRoute.objects.refresh([fp.book_copy.id])
+        other = FootprintFactory()  # no route yet
+
+        view = PathmapperRouteView()
+        qs = BookCopy.objects.filter(
+            id__in=[fp.book_copy.id, other.book_copy.id]).select_related(
+                'route').order_by('id')
+        routes = view.get_routes(list(qs))
+
+        self.assertEqual([route['id'] for route in routes],
+                         [fp.book_copy.id, other.book_copy.id])
+        self.assertEqual(routes[1]['footprints'][0]['id'], other.id)
+
+        # the missing route is left to the signal handler
+        self.assertFalse(BookCopyRoute.objects.filter(
+            book_copy=other.book_copy).exists())
+
+
+class PathmapperClusterViewTest(TestCase):
+
+    def setUp(self):
+        self.near = [
+            BookCopyFactory(imprint__place__canonical_place__latlng=Point(
+                20.0, 50.0, srid=4326)),
+            BookCopyFactory(imprint__place__canonical_place__latlng=Point(
+                20.1, 50.1, srid=4326))]
+        self.far = BookCopyFactory(
+            imprint__place__canonical_place__latlng=Point(
+                -70.0, 40.0, srid=4326))
+
+        self.ids = [bc.id for bc in self.near + [self.far]]
+        patcher = mock.patch.object(
+            PathmapperClusterMixin, 'get_layer_ids', return_value=self.ids)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_post(self):
+        url = reverse('pathmapper-cluster-view')
+        response = self.client.post(url, {
+            'layer': '{}', 'zoom': 0, 'source': 'imprint'})
+        self.assertEqual(response.status_code, 200)
+
+        the_json = loads(response.content.decode('utf-8'))
+        self.assertEqual(the_json['type'], 'FeatureCollection')
+
+        features = sorted(the_json['features'],
+                          key=lambda f: f['properties']['count'])
+        self.assertEqual(len(features), 2)
+        self.assertEqual(features[0]['properties']['count'], 1)
+        self.assertEqual(features[1]['properties']['copies'], 2)
+
+        lng, lat = features[1]['geometry']['coordinates']
+        self.assertAlmostEqual(lng, 20.05)
+        self.assertAlmostEqual(lat, 50.05)
+
+        # zoomed in, the near copies are apart
+        response = self.client.post(url, {
+            'layer': '{}', 'zoom': 12, 'source': 'imprint'})
+        the_json = loads(response.content.decode('utf-8'))
+        self.assertEqual(len(the_json['features']), 3)
+
+    def test_post_bbox(self):
+        url = reverse('pathmapper-cluster-view')
+        response = self.client.post(url, {
+            'layer': '{}', 'zoom': 0, 'bbox': '-80,30,-60,45'})
+        the_json = loads(response.content.decode('utf-8'))
+        self.assertEqual(len(the_json['features']), 1)
+
+    def test_post_invalid(self):
+        url = reverse('pathmapper-cluster-view')
+        response = self.client.post(url, {'layer': '{}', 'zoom': 'a'})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(url, {
+            'layer': '{}', 'zoom': 1, 'source': 'foo'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_detail(self):
+        url = reverse('pathmapper-cluster-view')
+        response = self.client.post(url, {'layer': '{}', 'zoom': 0})
+        features = loads(response.content.decode('utf-8'))['features']
+        cluster = max(features, key=lambda f: f['properties']['count'])
+        x, y = cluster['properties']['cell']
+
+        url = reverse('pathmapper-cluster-detail-view')
+        response = self.client.post(url, {
+            'layer': '{}', 'zoom': 0, 'x': x, 'y': y})
+        the_json = loads(response.content.decode('utf-8'))
+
+        self.assertEqual(the_json['count'], 2)
+        self.assertEqual([route['id'] for route in the_json['results']],
+                         [bc.id for bc in self.near])
+
+
+@override_settings(PATHMAPPER_CACHE='default')
+class PathmapperCacheMixinTest(TestCase):
+
+    def setUp(self):
+        get_pathmapper_cache().clear()
+        self.url = reverse('pathmapper-route-view')
+
+    def post(self, layer):
+        return self.client.post(self.url, {'layer': dumps(layer)},
+                                HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+    def test_dispatch(self):
+        with mock.patch.object(PathmapperRouteView, 'get_book_copies',
+                               return_value=[]) as search, \
+                mock.patch('footprints.pathmapper.views.statsd') as statsd:
+            response = self.post({'work': 1, 'title': 'Map A'})
+            self.assertEqual(response.status_code, 200)
+            statsd.incr.assert_called_with('pathmapper.cache.route.miss')
+
+            # the same search under another display title
+            cached = self.post({'work': '1', 'title': 'Map B', 'pubEnd': ''})
+            statsd.incr.assert_called_with('pathmapper.cache.route.hit')
+            self.assertEqual(search.call_count, 1)
+            self.assertEqual(cached.content, response.content)
+            self.assertEqual(cached['Content-Type'], 'application/json')
+
+            self.post({'work': 2})
+            self.assertEqual(search.call_count, 2)
+
+            # index changes invalidate the entries
+            DataVersion.objects.bump(DataVersion.SEARCH_INDEX)
+            self.post({'work': 1})
+            self.assertEqual(search.call_count, 3)
+
+    def test_get_cache_key(self):
+        view = PathmapperTableView()
+        request = RequestFactory().post('/', {'layers': dumps([
+            {'work': 1}, {'imprint': 2, 'visible': True}])})
+        key = view.get_cache_key(request)
+        self.assertTrue(key.startswith('pathmapper:table:0:'))
+
+        # the layers are combined, their order doesn't matter
+        request = RequestFactory().post('/', {'layers': dumps([
+            {'imprint': 2}, {'work': 1}])})
+        self.assertEqual(view.get_cache_key(request), key)
+
+        # malformed layers are left to the view
+        request = RequestFactory().post('/', {'layers': 'x'})
+        self.assertIsNone(view.get_cache_key(request))
+
 
 class PlaceViewSetTest(TestCase):
 
@@ -128,41 +354,6 @@ class PlaceViewSetTest(TestCase):
 
 class PathmapperEventViewSetTest(TestCase):
 
-    def test_get_book_copies_invalid(self):
-        layer = {
-            'work': None,
-            'imprint': None,
-            'imprintLocation': None,
-            'footprintLocation': None,
-            'footprintStart': '2000',
-            'footprintEnd': '1970',
-            'footprintRange': True,
-            'pubRange': 'false',
-            'pubStart': None,
-            'pubEnd': None
-        }
-
-        viewset = PathmapperEventViewSet()
-        self.assertIsNone(viewset.get_book_copies(layer))
-
-    def test_get_book_copies_valid(self):
-        layer = {
-            'work': None,
-            'imprint': None,
-            'imprintLocation': None,
-            'footprintLocation': None,
-            'footprintStart': '',
-            'footprintEnd': '',
-            'footprintRange': False,
-            'pubRange': 'false',
-            'pubStart': None,
-            'pubEnd': None
-        }
-
-        viewset = PathmapperEventViewSet()
-        sqs = viewset.get_book_copies(layer)
-        self.assertEquals(sqs.count(), 0)
-
     def test_map_events(self):
         events = {}
         current_year = int(datetime.now().year)
@@ -2,22 +2,37 @@
 from __future__ import unicode_literals
 
 from datetime import datetime
+import hashlib
 import html
+import json
 from json import loads
 import re
 
+from django.conf import settings
+from django.contrib.gis.db.models import Collect
+from django.contrib.gis.db.models.functions import Centroid, SnapToGrid
+from django.contrib.gis.geos import Point, Polygon
+from django.core.cache import cache, caches
+from django.db.models import Count
+from django.http import HttpResponse
 from django.views.generic.base import TemplateView, View
+from django_statsd.clients import statsd
+from haystack.query import EmptySearchQuerySet
 from rest_framework import viewsets
+from rest_framework.exceptions import ParseError
 from rest_framework.generics import ListAPIView
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from footprints.main.models import Footprint, BookCopy
+from footprints.main.models import Footprint, BookCopy, DataVersion
 from footprints.main.serializers import (
     PathmapperRouteSerializer, PathmapperTableRowSerializer,
     PathmapperEventSerializer)
 from footprints.mixins import JSONResponseMixin
 from footprints.pathmapper.forms import BookCopySearchForm, \
-    BookCopyFootprintsForm
+    MultiLayerQuery, normalize_layer, normalize_layers
+from footprints.pathmapper.models import BookCopyRoute, route_data
+from footprints.pathmapper.pagination import SolrCursorPagination
 
 
 class PathmapperView(TemplateView):
@@ -87,47 +102,150 @@ class PathmapperView(TemplateView):
         return ctx
 
 
-class BookCopySearchView(JSONResponseMixin, View):
+def get_pathmapper_cache():
+    alias = getattr(settings, 'PATHMAPPER_CACHE', 'default')
+    if alias not in settings.CACHES:
+        alias = 'default'
+    return caches[alias]
 
-    def min_year(self, sqs, key):
-        stats = sqs.stats(key).stats_results()
-        if not stats or not stats[key] or not stats[key]['min']:
+
+class PathmapperCacheMixin(object):
+    '''Serves repeated requests for the same layers from the pathmapper
+    cache. The entries are keyed by the search index data version, so
+    they are dropped once the index changes'''
+    cache_name = None
+
+    def get_cache_params(self, request):
+        raise NotImplementedError
+
+    def get_cache_key(self, request):
+        try:
+            params = self.get_cache_params(request)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return None  # the view reports the bad request
+
+        digest = hashlib.sha256(
+            json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+        version = DataVersion.objects.current(DataVersion.SEARCH_INDEX)
+        return 'pathmapper:{}:{}:{}'.format(self.cache_name, version, digest)
+
+    def dispatch(self, request, *args, **kwargs):
+        key = self.get_cache_key(request)
+        if key is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        cache = get_pathmapper_cache()
+        cached = cache.get(key)
+        if cached is not None:
+            statsd.incr('pathmapper.cache.{}.hit'.format(self.cache_name))
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        statsd.incr('pathmapper.cache.{}.miss'.format(self.cache_name))
+        response = super().dispatch(request, *args, **kwargs)
+
+        if response.status_code == 200:
+            if hasattr(response, 'render'):
+                response.render()
+            cache.set(key, (response.content, response['Content-Type']),
+                      getattr(settings, 'PATHMAPPER_CACHE_TIMEOUT', None))
+        return response
+
+
+# the layer sliders' upper bound. a few minutes stale is fine
+TOTAL_CACHE_KEY = 'pathmapper:bookcopy-total'
+TOTAL_CACHE_TIMEOUT = 60 * 10
+
+STATS_FIELDS = [
+    'footprint_start_date', 'footprint_end_date',
+    'pub_start_date', 'pub_end_date']
+
+
+class BookCopySearchView(JSONResponseMixin, PathmapperCacheMixin, View):
+    cache_name = 'search'
+
+    def get_cache_params(self, request):
+        return normalize_layer(request.POST.dict())
+
+    def min_year(self, stats, key):
+        if not stats or not stats.get(key) or not stats[key]['min']:
             return 1000
 
         return datetime.strptime(stats[key]['min'], '%Y-%m-%dT%H:%M:%SZ').year
 
-    def max_year(self, sqs, key):
+    def max_year(self, stats, key):
         this_year = datetime.now().year
-        stats = sqs.stats(key).stats_results()
-        if not stats or not stats[key] or not stats[key]['max']:
+        if not stats or not stats.get(key) or not stats[key]['max']:
             return this_year
         return min(
             this_year,
             datetime.strptime(stats[key]['max'], '%Y-%m-%dT%H:%M:%SZ').year)
 
+    def get_total_max(self):
+        return cache.get_or_set(
+            TOTAL_CACHE_KEY, BookCopy.objects.count, TOTAL_CACHE_TIMEOUT)
+
+    def get_solr_stats(self, query):
+        params = query.build_params()
+        params['start_offset'] = 0
+        params['end_offset'] = 0
+        kwargs = query.backend.build_search_kwargs(
+            query.build_query(), **params)
+
+        # haystack's stats.field holds a single field. send them all
+        kwargs.update({'stats': 'true', 'stats.field': STATS_FIELDS,
+                       'rows': 0})
+        raw = query.backend.conn.search(query.build_query(), **kwargs)
+        return raw.hits, raw.stats.get('stats_fields', {})
+
+    def get_stats(self, sqs):
+        '''The hit count and the date stats from a single request
+        that returns no documents'''
+        if isinstance(sqs, EmptySearchQuerySet):
+            return 0, {}
+
+        if hasattr(sqs.query.backend, 'conn'):
+            return self.get_solr_stats(sqs.query)
+
+        # a backend without a solr connection
+        for key in STATS_FIELDS:
+            sqs = sqs.stats(key)
+
+        query = sqs.query
+        query.set_limits(0, 0)
+        stats = query.get_stats()
+        return query.get_count(), stats
+
     def post(self, request):
         form = BookCopySearchForm(request.POST)
         if form.is_valid():
-            sqs = form.search()
+            total, stats = self.get_stats(form.search())
             ctx = {
-                'totalMax': BookCopy.objects.count(),
-                'total': sqs.count(),
-                'footprintMin': self.min_year(sqs, 'footprint_start_date'),
-                'footprintMax': self.max_year(sqs, 'footprint_end_date'),
-                'pubMin': self.min_year(sqs, 'pub_start_date'),
-                'pubMax': self.max_year(sqs, 'pub_end_date')
+                'totalMax': self.get_total_max(),
+                'total': total,
+                'footprintMin': self.min_year(stats, 'footprint_start_date'),
+                'footprintMax': self.max_year(stats, 'footprint_end_date'),
+                'pubMin': self.min_year(stats, 'pub_start_date'),
+                'pubMax': self.max_year(stats, 'pub_end_date')
             }
             return self.render_to_json_response(ctx)
 
         return self.render_to_json_response({'errors': form.errors})
 
 
-class PathmapperRouteView(ListAPIView):
+class PathmapperRouteView(PathmapperCacheMixin, ListAPIView):
     model = BookCopy
     serializer_class = PathmapperRouteSerializer
     authentication_classes = []
     permission_classes = []
     page_size = 15
+    cache_name = 'route'
+
+    def get_cache_params(self, request):
+        return {
+            'layer': normalize_layer(loads(request.POST['layer'])),
+            'page': request.GET.get('page')
+        }
 
     def get_book_copies(self, layer):
         form = BookCopySearchForm(layer)
@@ -139,50 +257,194 @@ class PathmapperRouteView(ListAPIView):
         layer = loads(self.request.POST.get('layer'))
         ids = self.get_book_copies(layer)
         return BookCopy.objects.filter(id__in=ids).select_related(
-            'imprint__place')
+            'route').order_by('id')
+
+    def get_routes(self, book_copies):
+        # routes are stored by the search index signal handler. those
+        # it hasn't reached yet are built here, without writing them
+        missing = [bc.id for bc in book_copies if not hasattr(bc, 'route')]
+        built = {bc.id: route_data(bc)
+                 for bc in BookCopyRoute.objects.route_queryset(missing)}
+
+        return [loads(bc.route.data) if hasattr(bc, 'route')
+                else built[bc.id] for bc in book_copies]
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        return self.get_paginated_response(self.get_routes(page))
 
     def post(self, request, *args, **kwargs):
         return self.get(request, *args, **kwargs)
 
 
-class PathmapperTableView(ListAPIView):
+# grid cells across each 256px map tile
+CLUSTER_CELLS = 4
+MAX_ZOOM = 20
+
+# source: (model, book copy field, point field)
+CLUSTER_SOURCES = {
+    'imprint': (BookCopy, 'id', 'imprint__place__canonical_place__latlng'),
+    'footprint': (Footprint, 'book_copy', 'place__canonical_place__latlng'),
+}
+
+
+class PathmapperClusterMixin(object):
+
+    def get_param(self, name, parse=str):
+        try:
+            return parse(self.request.POST[name])
+        except (KeyError, ValueError):
+            raise ParseError('Invalid {}'.format(name))
+
+    def get_source(self):
+        source = self.request.POST.get('source', 'imprint')
+        if source not in CLUSTER_SOURCES:
+            raise ParseError('Invalid source')
+        return source
+
+    def get_grid_size(self):
+        zoom = min(max(self.get_param('zoom', int), 0), MAX_ZOOM)
+        return 360.0 / (2 ** zoom * CLUSTER_CELLS)
+
+    def get_bbox(self):
+        # west,south,east,north. the clusters in view
+        bbox = self.request.POST.get('bbox')
+        if not bbox:
+            return None
+
+        try:
+            return Polygon.from_bbox([float(x) for x in bbox.split(',')])
+        except (TypeError, ValueError):
+            raise ParseError('Invalid bbox')
+
+    def get_layer_ids(self):
+        form = BookCopySearchForm(self.get_param('layer', loads))
+        if not form.is_valid():
+            return []
+        return form.search().values_list('object_id', flat=True)
+
+    def cluster_queryset(self, source, ids, size, bbox=None):
+        '''The located records of the book copies, annotated with the
+        grid cell their point snaps to'''
+        model, copy_field, point_field = CLUSTER_SOURCES[source]
+
+        qs = model.objects.filter(**{
+            copy_field + '__in': ids,
+            point_field + '__isnull': False})
+        if bbox is not None:
+            qs = qs.filter(**{point_field + '__intersects': bbox})
+
+        return qs.annotate(cell=SnapToGrid(point_field, size)).order_by()
+
+
+class PathmapperClusterView(PathmapperClusterMixin, APIView):
+    '''GeoJSON clusters of the imprint or footprint locations of a
+    layer's book copies. The number of clusters is bounded by the grid,
+    not by the number of copies'''
+    authentication_classes = []
+    permission_classes = []
+
+    def get_clusters(self, source, ids, size, bbox=None):
+        model, copy_field, point_field = CLUSTER_SOURCES[source]
+        qs = self.cluster_queryset(source, ids, size, bbox)
+
+        return qs.values('cell').annotate(
+            count=Count('id'),
+            copies=Count(copy_field, distinct=True),
+            center=Centroid(Collect(point_field)))
+
+    def get_feature(self, source, cluster):
+        return {
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Point',
+                'coordinates': list(cluster['center'].coords)
+            },
+            'properties': {
+                'source': source,
+                'count': cluster['count'],
+                'copies': cluster['copies'],
+                # identifies the cluster to the detail view
+                'cell': list(cluster['cell'].coords)
+            }
+        }
+
+    def post(self, request, *args, **kwargs):
+        source = self.get_source()
+        size = self.get_grid_size()
+        clusters = self.get_clusters(
+            source, self.get_layer_ids(), size, self.get_bbox())
+
+        return Response({
+            'type': 'FeatureCollection',
+            'features': [self.get_feature(source, cluster)
+                         for cluster in clusters]
+        })
+
+
+class PathmapperClusterDetailView(PathmapperClusterMixin,
+                                  PathmapperRouteView):
+    '''The routes of the book copies in one cluster, fetched when the
+    cluster is opened'''
+    cache_name = 'cluster-detail'
+
+    def get_cache_params(self, request):
+        params = super().get_cache_params(request)
+        for key in ['source', 'zoom', 'x', 'y']:
+            params[key] = request.POST.get(key)
+        return params
+
+    def get_queryset(self):
+        source = self.get_source()
+        cell = Point(self.get_param('x', float), self.get_param('y', float),
+                     srid=4326)
+        copy_field = CLUSTER_SOURCES[source][1]
+
+        qs = self.cluster_queryset(
+            source, self.get_layer_ids(), self.get_grid_size())
+        ids = qs.filter(cell=cell).values(copy_field)
+
+        return BookCopy.objects.filter(id__in=ids).select_related(
+            'route').order_by('id')
+
+
+class PathmapperTableView(PathmapperCacheMixin, ListAPIView):
     model = Footprint
     serializer_class = PathmapperTableRowSerializer
+    pagination_class = SolrCursorPagination
     authentication_classes = []
     permission_classes = []
     page_size = 15
+    cache_name = 'table'
 
-    def get_book_copies(self, layer):
-        form = BookCopySearchForm(layer)
-        if form.is_valid():
-            sqs = form.search()
-            return sqs.values_list('object_id', flat=True)
+    def get_cache_params(self, request):
+        return {
+            'layers': normalize_layers(loads(request.POST['layers'])),
+            'page': request.GET.get('page'),
+            'cursor': request.GET.get('cursor')
+        }
 
     def get_queryset(self):
-        ids = []
         layers = loads(self.request.POST.get('layers'))
-        for layer in layers:
-            ids += self.get_book_copies(layer)
-
-        form = BookCopyFootprintsForm()
-        sqs = form.search(ids)
+        sqs = MultiLayerQuery(layers).footprints()
         return sqs.order_by('wtitle', 'pub_start_date', 'book_copy_id')
 
     def post(self, request, *args, **kwargs):
         return self.get(request, *args, **kwargs)
 
 
-class PathmapperEventViewSet(viewsets.ViewSet):
+class PathmapperEventViewSet(PathmapperCacheMixin, viewsets.ViewSet):
     serializer_class = PathmapperEventSerializer
     authentication_classes = []
     permission_classes = []
     page_size = 15
+    cache_name = 'events'
 
-    def get_book_copies(self, layer):
-        form = BookCopySearchForm(layer)
-        if form.is_valid():
-            sqs = form.search()
-            return sqs
+    def get_cache_params(self, request):
+        return {
+            'layers': normalize_layers(
+                loads(request.POST.get('layers', '[]')))
+        }
 
     def map_events(self, counts, current_year, events):
         for key, value in counts:
@@ -195,18 +457,13 @@ class PathmapperEventViewSet(viewsets.ViewSet):
     def get_events(self):
         events = {}
         cur_year = int(datetime.now().year)
-        ids = []
         layers = loads(self.request.POST.get('layers', '[]'))
-        for layer in layers:
-            sqs = self.get_book_copies(layer)
-            counts = sqs.facet('pub_year').facet_counts()
-            self.map_events(counts['fields']['pub_year'], cur_year, events)
-            ids += sqs.values_list('object_id', flat=True)
-
-        form = BookCopyFootprintsForm()
-        sqs = form.search(ids)
-        counts = sqs.facet('footprint_year').facet_counts()
-        self.map_events(counts['fields']['footprint_year'], cur_year, events)
+
+        # both facets come from a single request
+        counts = MultiLayerQuery(layers).events().facet_counts()
+        fields = counts.get('fields', {})
+        for field in ['pub_year', 'footprint_year']:
+            self.map_events(fields.get(field, []), cur_year, events)
         return events.values()
 
     def list(self, request):
@@ -22,7 +22,8 @@ from footprints.main.views import (
     AddIdentifierView, AddDigitalObjectView, ConnectFootprintView,
     ContactUsView, AddLanguageView, DisplayDateView, CopyFootprintView,
     SignS3View, ModerationView, VerifyFootprintView,
-    FootprintSearchView, ExportFootprintSearch, VerifiedFootprintFeed)
+    FootprintSearchView, ExportFootprintSearch, VerifiedFootprintFeed,
+    ExportJobView)
 from footprints.main.viewsets import (
     BookCopyViewSet, ImprintViewSet, ActorViewSet,
     ExtendedDateViewSet, FootprintViewSet, LanguageViewSet,
@@ -32,7 +33,8 @@ from footprints.main.viewsets import (
     AlternatePlaceNameViewSet, DigitalObjectExtendedViewSet)
 from footprints.pathmapper.views import (
     PathmapperView, BookCopySearchView, PathmapperTableView,
-    PathmapperRouteView, PathmapperEventViewSet)
+    PathmapperRouteView, PathmapperEventViewSet, PathmapperClusterView,
+    PathmapperClusterDetailView)
 
 
 admin.autodiscover()
@@ -135,6 +137,8 @@ urlpatterns = [
     url(r'^export/footprints/$',
         ExportFootprintSearch.as_view(),
         name='export-footprint-list'),
+    url(r'^export/job/(?P<uuid>[0-9a-f-]+)/$',
+        ExportJobView.as_view(), name='export-job'),
 
     url(r'^date/display/$',
         DisplayDateView.as_view(), name='display-date-view'),
@@ -174,6 +178,11 @@ urlpatterns = [
 
     url(r'^pathmapper/route/',
         PathmapperRouteView.as_view(), name='pathmapper-route-view'),
+    url(r'^pathmapper/cluster/detail/',
+        PathmapperClusterDetailView.as_view(),
+        name='pathmapper-cluster-detail-view'),
+    url(r'^pathmapper/cluster/',
+        PathmapperClusterView.as_view(), name='pathmapper-cluster-view'),
     url(r'^pathmapper/table/',
         PathmapperTableView.as_view(), name='pathmapper-table-view'),
     url(r'^pathmapper/vision/',
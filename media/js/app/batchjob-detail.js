@@ -13,9 +13,14 @@
                 this, 'clickRecord', 'updateRecord',
                 'deleteRecord', 'confirmDeleteRecord', 'checkErrorState',
                 'onKeydown', 'openRecord', 'closeRecord',
-                'confirmProcessJob', 'processJob');
+                'confirmProcessJob', 'processJob', 'pollProgress');
 
             this.baseUpdateUrl = options.baseUpdateUrl;
+            this.progressUrl = options.progressUrl;
+
+            if (options.processing) {
+                this.pollProgress();
+            }
 
             this.checkErrorState();
 
@@ -111,6 +116,20 @@
         },
         processJob: function(evt) {
             this.$process.submit();
+        },
+        pollProgress: function() {
+            var self = this;
+            jQuery.getJSON(this.progressUrl, function(data) {
+                jQuery(self.el).find('.batch-job-progress').text(
+                    data.imported + ' of ' + data.total + ' imported');
+
+                if (data.status === 'pending' || data.status === 'running') {
+                    setTimeout(self.pollProgress, 2000);
+                } else {
+                    // show the created footprints & row errors
+                    window.location.reload();
+                }
+            });
         }
     });
 })();